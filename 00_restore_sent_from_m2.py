@@ -1,5 +1,8 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
-from errant.converter import convert_m2_file
+from errant.converter import find_m2_chunks, iter_m2_references, read_m2_annotators
 
 
 input_files = [
@@ -12,32 +15,145 @@ input_files = [
 #     "data/output/txt/ABC.train.gold.bea19.errant3_0_0.m2",
 # ]
 
+# input_files = [str(p) for p in sorted(Path("data/m2").glob("*.m2"))]
+
+# Annotator ids to write per-annotator references for (None: all annotators in the file)
+annotators = None
+# annotators = [0, 1]
+
+# Convert files in a process pool; files larger than chunk_size are split into block-aligned chunks
+parallel = False
+# parallel = True
+max_workers = None
+chunk_size = 1024 * 1024
+
 def main():
     orig_suffix = ".orig.txt"
     cor_suffix = ".cor.txt"
-    convert_m2_to_txt(orig_suffix=orig_suffix, cor_suffix=cor_suffix)
+    ref_suffix = ".cor.{annotator}.txt"
+    # ref_suffix = None
+    if parallel:
+        convert_m2_to_txt_parallel(orig_suffix=orig_suffix, cor_suffix=cor_suffix, ref_suffix=ref_suffix)
+    else:
+        convert_m2_to_txt(orig_suffix=orig_suffix, cor_suffix=cor_suffix, ref_suffix=ref_suffix)
 
 
-def convert_m2_to_txt(orig_suffix=".orig.txt", cor_suffix=".cor.txt"):
+def convert_m2_to_txt(orig_suffix=".orig.txt", cor_suffix=".cor.txt", ref_suffix=None):
     for input_file in input_files:
-        ip = Path(input_file)
-        output_path = ip.parent.parent / "output" / "txt"
-        output_path.mkdir(parents=True, exist_ok=True)
-        result = convert_m2_file(input_file)
-
-        if orig_suffix:
-            output_file_orig = output_path / ip.name.replace(".m2", orig_suffix)
-            with open(output_file_orig, "w", encoding="utf-8") as f:
-                for item in result:
-                    f.write(item["original"] + "\n")
-            print(f"Saved {output_file_orig}")
-            
-        if cor_suffix:
-            output_file_cor = output_path / ip.name.replace(".m2", cor_suffix)
-            with open(output_file_cor, "w", encoding="utf-8") as f:
-                for item in result:
-                    f.write(item["corrected"] + "\n")
-            print(f"Saved {output_file_cor}")
+        start_time = time.perf_counter()
+        convert_m2_file_to_txt(input_file, orig_suffix, cor_suffix, ref_suffix)
+        print(f"Converted {input_file} in {time.perf_counter() - start_time:.2f}s")
+
+
+def convert_m2_file_to_txt(input_file, orig_suffix=".orig.txt", cor_suffix=".cor.txt", ref_suffix=None):
+    """Write the original, corrected and per-annotator reference files side by side.
+    Args:
+        input_file: str, the path to the M2 file
+        ref_suffix: str, suffix template for per-annotator references, e.g. ".cor.{annotator}.txt"
+    Returns: list, the paths of the saved files
+    """
+    output_file_orig, output_file_cor = get_output_files(input_file, orig_suffix, cor_suffix)
+    output_files_ref = {}
+
+    # Write all outputs in a single streaming pass over the M2 file
+    with ExitStack() as stack:
+        f_orig = stack.enter_context(open(output_file_orig, "w", encoding="utf-8")) if output_file_orig else None
+        f_cor = stack.enter_context(open(output_file_cor, "w", encoding="utf-8")) if output_file_cor else None
+        f_refs = {}
+        for item in iter_m2_references(input_file, annotators):
+            if f_orig:
+                f_orig.write(item["original"] + "\n")
+            if f_cor:
+                f_cor.write(item["corrected"] + "\n")
+            if ref_suffix:
+                for annotator, reference in item["references"].items():
+                    if annotator not in f_refs:
+                        output_files_ref[annotator] = get_ref_output_file(input_file, ref_suffix, annotator)
+                        f_refs[annotator] = stack.enter_context(open(output_files_ref[annotator], "w", encoding="utf-8"))
+                    f_refs[annotator].write(reference + "\n")
+
+    saved_files = [f for f in [output_file_orig, output_file_cor, *output_files_ref.values()] if f]
+    for f in saved_files:
+        print(f"Saved {f}")
+    return saved_files
+
+
+def convert_m2_to_txt_parallel(orig_suffix=".orig.txt", cor_suffix=".cor.txt", ref_suffix=None):
+    """Fan the input files (and chunks of large files) out to a process pool.
+    The chunks of each file are written back in order, so the outputs are
+    identical to those of `convert_m2_to_txt`.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        jobs = []
+        for input_file in input_files:
+            # Fix the annotator set up front so that every chunk agrees on it
+            file_annotators = annotators if annotators is not None else read_m2_annotators(input_file)
+            chunks = find_m2_chunks(input_file, chunk_size)
+            futures = [
+                executor.submit(convert_m2_chunk, input_file, start, end, file_annotators)
+                for start, end in chunks
+            ]
+            jobs.append((input_file, file_annotators, futures, time.perf_counter()))
+
+        for input_file, file_annotators, futures, start_time in jobs:
+            results = [future.result() for future in futures]
+            finish_time = max(result["finish_time"] for result in results)
+            cpu_seconds = sum(result["seconds"] for result in results)
+            write_chunks_to_txt(input_file, results, file_annotators, orig_suffix, cor_suffix, ref_suffix)
+            print(f"Converted {input_file} in {finish_time - start_time:.2f}s "
+                  f"({len(results)} chunk(s), {cpu_seconds:.2f}s of worker time)")
+
+
+def convert_m2_chunk(input_file, start, end, file_annotators):
+    """Convert a block-aligned byte range of an M2 file into output text."""
+    start_time = time.perf_counter()
+    original, corrected = [], []
+    references = {annotator: [] for annotator in file_annotators}
+    for item in iter_m2_references(input_file, file_annotators, start=start, end=end):
+        original.append(item["original"] + "\n")
+        corrected.append(item["corrected"] + "\n")
+        for annotator, reference in item["references"].items():
+            references[annotator].append(reference + "\n")
+    finish_time = time.perf_counter()
+    return {
+        "original": "".join(original),
+        "corrected": "".join(corrected),
+        "references": {annotator: "".join(lines) for annotator, lines in references.items()},
+        "seconds": finish_time - start_time,
+        "finish_time": finish_time,
+    }
+
+
+def write_chunks_to_txt(input_file, results, file_annotators, orig_suffix=".orig.txt", cor_suffix=".cor.txt", ref_suffix=None):
+    output_file_orig, output_file_cor = get_output_files(input_file, orig_suffix, cor_suffix)
+    outputs = [(output_file_orig, lambda result: result["original"]),
+               (output_file_cor, lambda result: result["corrected"])]
+    if ref_suffix:
+        for annotator in file_annotators:
+            outputs.append((get_ref_output_file(input_file, ref_suffix, annotator),
+                            lambda result, annotator=annotator: result["references"][annotator]))
+
+    for output_file, get_text in outputs:
+        if not output_file:
+            continue
+        with open(output_file, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(get_text(result))
+        print(f"Saved {output_file}")
+
+
+def get_output_files(input_file, orig_suffix, cor_suffix):
+    ip = Path(input_file)
+    output_path = ip.parent.parent / "output" / "txt"
+    output_path.mkdir(parents=True, exist_ok=True)
+    output_file_orig = output_path / ip.name.replace(".m2", orig_suffix) if orig_suffix else None
+    output_file_cor = output_path / ip.name.replace(".m2", cor_suffix) if cor_suffix else None
+    return output_file_orig, output_file_cor
+
+
+def get_ref_output_file(input_file, ref_suffix, annotator):
+    ip = Path(input_file)
+    return ip.parent.parent / "output" / "txt" / ip.name.replace(".m2", ref_suffix.format(annotator=annotator))
 
 
 if __name__ == "__main__":
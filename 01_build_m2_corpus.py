@@ -0,0 +1,26 @@
+# Build memory-mapped corpora from data/m2 once, so later stages can load sentences without re-parsing
+import time
+from errant.corpus import M2Corpus
+import settings
+
+
+corpora = {
+    settings.train_corpus_dir: [
+        "data/m2/A.train.gold.bea19.m2",
+        "data/m2/B.train.gold.bea19.m2",
+        "data/m2/C.train.gold.bea19.m2",
+    ],
+    settings.test_corpus_dir: [
+        "data/m2/ABCN.dev.gold.bea19.m2",
+    ],
+}
+
+def main():
+    for corpus_dir, m2_files in corpora.items():
+        start_time = time.perf_counter()
+        corpus = M2Corpus.build(m2_files, corpus_dir)
+        print(f"Built {corpus_dir} with {len(corpus)} sentences in {time.perf_counter() - start_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,14 @@
 
 import os
 from lib.dataset_preparation import DatasetPreparation
+from lib.stage_cache import StageCache
+from lib.token_counter import CostEstimator
 import settings
 from lib.utils import setup_log
 
-skip_if_exist = True
-skip_if_exist = False
+# Stages re-run only when their inputs, settings or code change; set to True to re-run anyway
+force = False
+# force = True
 
 def main():
     # Create output directory if it doesn't exist
@@ -14,8 +17,10 @@ def main():
     
     # Prepare the dataset
     dataset_prep = DatasetPreparation(settings)
-    dataset_prep.run(skip_if_exist=skip_if_exist)
-    
+    dataset_prep.run(cache=StageCache.from_config(settings), force=force)
+
+    # Count the tokens of the datasets and estimate what fine-tuning and inference will cost
+    CostEstimator(settings).run()
 
 if __name__ == "__main__":
     setup_log()
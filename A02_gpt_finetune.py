@@ -2,11 +2,13 @@
 
 import os
 from lib.finetuning_helper import FineTuningHelper
+from lib.stage_cache import StageCache
 from lib.utils import setup_log
 import settings
 
-skip_if_exist = True
-# skip_if_exist = False
+# Stages re-run only when their inputs, settings or code change; set to True to re-run anyway
+force = False
+# force = True
 
 def main():
     # Create output directory if it doesn't exist
@@ -14,7 +16,7 @@ def main():
     
     # Run fine-tuning
     finetuning = FineTuningHelper(settings)
-    finetuning.run(wait_for_job=True, skip_if_exist=skip_if_exist)
+    finetuning.run(wait_for_job=True, cache=StageCache.from_config(settings), force=force)
 
 if __name__ == "__main__":
     setup_log()
@@ -1,21 +1,25 @@
 from lib.utils import setup_log
 from lib.model_runner import ModelRunner
+from lib.results_store import ResultsStore
+from lib.stage_cache import StageCache
 import settings
 import os
 
-skip_if_exist = True
-skip_if_exist = False
+# Stages re-run only when their inputs, settings or code change; set to True to re-run anyway
+force = False
+# force = True
 run_top_k = -1
 # run_top_k = 5
 
 def main():
     os.makedirs("data/output/result", exist_ok=True)
     
-    runner = ModelRunner(settings, run_top_k=run_top_k)
+    runner = ModelRunner(settings, run_top_k=run_top_k, results_store=ResultsStore.from_config(settings))
     runner.run(
         baseline=False,
         fine_tuned=True,
-        skip_if_exists=skip_if_exist
+        cache=StageCache.from_config(settings),
+        force=force
     )
 
 
@@ -1,10 +1,13 @@
 from lib.utils import setup_log
 from lib.data_formatter import DataFormatter
+from lib.results_store import ResultsStore
+from lib.stage_cache import StageCache
 import settings
 import os
 
-# skip_if_exists = True
-skip_if_exists = False
+# Stages re-run only when their inputs, settings or code change; set to True to re-run anyway
+force = False
+# force = True
 
 file_pairs = [
     ('gpt-4o_baseline', settings.dataset_test_result_gpt_4o_baseline_filename, settings.gpt_4o_baseline_results_excel),
@@ -13,8 +16,8 @@ file_pairs = [
 ]
 
 def main():
-    formatter = DataFormatter(settings)
-    formatter.run(file_pairs, skip_if_exists)
+    formatter = DataFormatter(settings, results_store=ResultsStore.from_config(settings))
+    formatter.run(file_pairs, cache=StageCache.from_config(settings), force=force)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import os
+import time
+import logging
+from errant.alignment import write_m2_file
+from lib.dataset_preparation import DatasetPreparation
+from lib.io import read_data
+from lib.utils import setup_log
+from A04_gpt_format_output import file_pairs
+import settings
+
+logger = logging.getLogger(__name__)
+
+processes = None  # None: one worker per CPU
+
+
+def main():
+    for model_name, _, excel_file in file_pairs:
+        if not os.path.exists(excel_file):
+            logger.warning(f"Excel file {excel_file} does not exist.")
+            continue
+        m2_file = os.path.join(settings.m2_output_dir, f"{model_name}.m2")
+        start_time = time.perf_counter()
+        count = convert_results_to_m2(model_name, excel_file, m2_file)
+        logger.info(f"Saved {count} sentences to {m2_file} in {time.perf_counter() - start_time:.2f}s")
+
+
+def convert_results_to_m2(model_name, excel_file, m2_file):
+    df = read_data(excel_file)
+    # Write one block per test sentence, in test set order, so the file lines up with the gold M2
+    originals = [orig.strip() for orig, _ in load_test_pairs()]
+    corrections = dict(zip(df['id'], df[f'{model_name}_corrected'].fillna('').astype(str)))
+    missing = 0
+    hypotheses = []
+    for sentence_id, orig in enumerate(originals, start=1):
+        hyp = corrections.get(sentence_id, '')
+        if not hyp.strip():
+            # A missing, failed or empty correction is scored as leaving the sentence unchanged
+            missing += 1
+            hyp = orig
+        hypotheses.append(hyp)
+    if missing:
+        logger.warning(f"{missing} sentence(s) without a correction from {model_name}, kept unchanged.")
+    return write_m2_file(m2_file, originals, hypotheses, processes=processes)
+
+
+def load_test_pairs():
+    return DatasetPreparation(settings).read_sentence_pairs(
+        original_file=settings.test_files["original"],
+        corrected_file=settings.test_files["corrected"],
+        corpus_dir=settings.test_corpus_dir,
+    )
+
+
+if __name__ == "__main__":
+    setup_log()
+    main()
@@ -0,0 +1,69 @@
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+from errant.corpus import M2Corpus
+from errant.scorer import score_corpus
+from lib.io import write_data
+from lib.utils import setup_log
+from A04_gpt_format_output import file_pairs
+import settings
+
+logger = logging.getLogger(__name__)
+
+beta = 0.5
+processes = None  # None: one worker per CPU
+
+
+def main():
+    gold = load_gold_corpus()
+    summary = []
+    for model_name, _, _ in file_pairs:
+        hyp_m2_file = os.path.join(settings.m2_output_dir, f"{model_name}.m2")
+        if not os.path.exists(hyp_m2_file):
+            logger.warning(f"M2 file {hyp_m2_file} does not exist, run A05_gpt_output_to_m2.py first.")
+            continue
+        start_time = time.perf_counter()
+        scores = score_corpus(hyp_m2_file, gold, beta=beta, processes=processes)
+        logger.info(f"Scored {model_name} in {time.perf_counter() - start_time:.2f}s")
+        save_scores(model_name, scores)
+        summary.append({
+            'model': model_name,
+            'tp': scores['tp'],
+            'fp': scores['fp'],
+            'fn': scores['fn'],
+            'precision': scores['precision'],
+            'recall': scores['recall'],
+            f'f{beta}': scores['f'],
+        })
+
+    if summary:
+        df = pd.DataFrame(summary)
+        print(df.to_string(index=False, float_format="%.4f"))
+        write_data(df, os.path.join(settings.score_output_dir, "summary.csv"))
+
+
+def load_gold_corpus():
+    if not M2Corpus.exists(settings.test_corpus_dir):
+        logger.info(f"Building gold corpus {settings.test_corpus_dir} from {settings.test_m2_file}")
+        return M2Corpus.build([settings.test_m2_file], settings.test_corpus_dir)
+    return M2Corpus(settings.test_corpus_dir)
+
+
+def save_scores(model_name, scores):
+    os.makedirs(settings.score_output_dir, exist_ok=True)
+    # per-sentence TP/FP/FN counts, e.g. for significance testing
+    np.savez(
+        os.path.join(settings.score_output_dir, f"{model_name}.npz"),
+        counts=scores['counts'],
+        annotators=scores['annotators'],
+    )
+    by_type = pd.DataFrame.from_dict(scores['by_type'], orient='index')
+    by_type.index.name = 'error_type'
+    write_data(by_type.reset_index(), os.path.join(settings.score_output_dir, f"{model_name}_by_type.csv"))
+
+
+if __name__ == "__main__":
+    setup_log()
+    main()
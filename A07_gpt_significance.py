@@ -0,0 +1,58 @@
+import os
+import time
+import itertools
+import logging
+import numpy as np
+import pandas as pd
+from errant.significance import approximate_randomization, paired_bootstrap
+from lib.io import write_data
+from lib.utils import setup_log
+from A04_gpt_format_output import file_pairs
+from A06_gpt_score import beta
+import settings
+
+logger = logging.getLogger(__name__)
+
+n_resamples = 10_000
+seed = 0
+
+
+def main():
+    # per-sentence counts written by A06_gpt_score.py
+    counts = {}
+    for model_name, _, _ in file_pairs:
+        score_file = os.path.join(settings.score_output_dir, f"{model_name}.npz")
+        if not os.path.exists(score_file):
+            logger.warning(f"Score file {score_file} does not exist, run A06_gpt_score.py first.")
+            continue
+        counts[model_name] = np.load(score_file)['counts']
+
+    rows = []
+    for model_a, model_b in itertools.combinations(counts, 2):
+        start_time = time.perf_counter()
+        bootstrap = paired_bootstrap(counts[model_a], counts[model_b], n_resamples=n_resamples, beta=beta, seed=seed)
+        randomization = approximate_randomization(counts[model_a], counts[model_b], n_resamples=n_resamples, beta=beta, seed=seed)
+        logger.info(f"Tested {model_a} vs {model_b} in {time.perf_counter() - start_time:.2f}s")
+        rows.append({
+            'system_a': model_a,
+            'system_b': model_b,
+            f'f{beta}_a': bootstrap['f_a'],
+            f'f{beta}_b': bootstrap['f_b'],
+            'delta': bootstrap['delta'],
+            'ci_low': bootstrap['ci_low'],
+            'ci_high': bootstrap['ci_high'],
+            'bootstrap_p': bootstrap['p_value'],
+            'randomization_p': randomization['p_value'],
+        })
+
+    if rows:
+        df = pd.DataFrame(rows)
+        print(df.to_string(index=False, float_format="%.4f"))
+        write_data(df, os.path.join(settings.score_output_dir, "significance.csv"))
+    else:
+        logger.warning("Need per-sentence scores of at least two systems.")
+
+
+if __name__ == "__main__":
+    setup_log()
+    main()
@@ -1,5 +1,6 @@
 from datasets import Dataset, DatasetDict
 import os
+from errant.corpus import M2Corpus
 import settings
 
 train_file_original = settings.train_files["original"]
@@ -9,7 +10,15 @@ test_file_original = settings.test_files["original"]
 test_file_corrected = settings.test_files["corrected"]
 
 
-def compose_dict(original_file, corrected_file):    
+def compose_dict(original_file, corrected_file, corpus_dir=None):    
+    # Read from the memory-mapped corpus if it has been built
+    if M2Corpus.exists(corpus_dir):
+        pairs = list(M2Corpus(corpus_dir).iter_pairs())
+        return {
+            'original': [orig for orig, _ in pairs],
+            'corrected': [corr for _, corr in pairs]
+        }
+
     # Read the files
     with open(original_file, 'r', encoding='utf-8') as f1, open(corrected_file, 'r', encoding='utf-8') as f2:
         original_lines = f1.read().splitlines()
@@ -22,10 +31,10 @@ def compose_dict(original_file, corrected_file):
     }
     return data
 
-train_data = compose_dict(train_file_original, train_file_corrected)
+train_data = compose_dict(train_file_original, train_file_corrected, settings.train_corpus_dir)
 train_dataset = Dataset.from_dict(train_data)
 
-test_data = compose_dict(test_file_original, test_file_corrected)
+test_data = compose_dict(test_file_original, test_file_corrected, settings.test_corpus_dir)
 test_dataset = Dataset.from_dict(test_data)
 
 dataset = DatasetDict({
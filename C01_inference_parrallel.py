@@ -8,6 +8,11 @@ import time
 import io
 import logging
 
+from lib.dedup import build_dedup_index, fan_out_results, load_previous_results
+from lib.io import JsonlWriter, dumps, loads, open_file, split_ext
+from lib.jsonl_index import JsonlIndex, select_lines
+from lib.prompts import render_messages
+from lib.results_store import ResultsStore
 from lib.utils import backup_output_file, setup_log
 
 logger = logging.getLogger(__name__)
@@ -22,9 +27,13 @@ async def batch_process_jsonl_file(
     max_tokens=None, 
     batch_size=10, 
     requests_per_minute=60, 
-    previous_output_file=None,
+    previous_output_files=(),
     dry_run=False,
-    max_retries=3):
+    max_retries=3,
+    results_store=None,
+    run_id=None,
+    store_model=None,
+    line_numbers=None):
     """
     Process a JSONL file with llm model using a sliding window of concurrent tasks.
     
@@ -36,9 +45,13 @@ async def batch_process_jsonl_file(
         max_tokens: Maximum tokens for generation
         batch_size: Maximum number of concurrent tasks
         requests_per_minute: Maximum number of requests per minute to avoid rate limits
-        previous_output_file: Path to previous output JSONL file
+        previous_output_files: Paths of previous output JSONL files to resume from
         dry_run: Whether to run in dry run mode
         max_retries: Maximum number of retry attempts for failed requests
+        results_store: ResultsStore to resume from and write the results to, under (run_id, store_model)
+        run_id: Run id of the results in the store
+        store_model: Model name of the results in the store
+        line_numbers: Lines of the input file to process (see lib/jsonl_index.py), all if None
     """
     # Create output file directory if not dry run
     if not dry_run:
@@ -46,22 +59,19 @@ async def batch_process_jsonl_file(
     
     # Load previous results if available
     previous_results = {}
-    if previous_output_file and os.path.exists(previous_output_file):
-        with open(previous_output_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    result = json.loads(line)
-                    # Get sentence_id from metadata
-                    sentence_id = result[2].get('sentence_id')  # metadata is the third element
-                    response = result[1]
-                    if sentence_id is not None and is_successful_response(response):
-                        previous_results[sentence_id] = line.strip()
-                except (json.JSONDecodeError, IndexError) as e:
-                    logger.warning(f"Error parsing previous result: {e}")
-                    continue
+    if results_store is not None:
+        # Successful results of earlier attempts of this run, by sentence_id
+        previous_results = results_store.completed(run_id, store_model)
+        logger.info(f"Resuming {run_id}/{store_model} with {len(previous_results)} results from {results_store.db_file}")
+    else:
+        # the parsed results are written back as they are
+        previous_results = load_previous_results(previous_output_files, is_successful_response)
     
-    with open(input_file, 'r', encoding='utf-8') as f_in:
-        lines = f_in.readlines()
+    if line_numbers is None:
+        with open_file(input_file, 'rb') as f_in:
+            lines = f_in.readlines()
+    else:
+        lines = [line for _, line in JsonlIndex(input_file).iter_lines(line_numbers)]
     
     delay_between_requests = 60.0 / requests_per_minute if requests_per_minute > 0 else 0
     
@@ -70,18 +80,19 @@ async def batch_process_jsonl_file(
     
     async def process_with_rate_limit(line):
         try:
-            data = json.loads(line)
+            data = loads(line)
             sentence_id = data.get("metadata", {}).get("sentence_id")
             
             # Check if we have a successful previous result
             if sentence_id in previous_results:
                 logger.debug(f"Using cached result for sentence_id: {sentence_id}")
-                return json.loads(previous_results[sentence_id])
+                return previous_results[sentence_id], None
             
             async with semaphore:
                 start_time = time.time()
                 try:
-                    messages = data.get("messages", [])
+                    # Compact records are rendered into messages only now, when the request is sent
+                    messages = render_messages(data)
                     metadata = data.get("metadata", {})
                     result = await process_request(
                         model_name, 
@@ -99,6 +110,9 @@ async def batch_process_jsonl_file(
                         {"error": str(e)},
                         metadata if 'metadata' in locals() else {}
                     ]
+                if "messages" not in data:
+                    # Save the compact record rather than the rendered prompt
+                    result[0] = {k: v for k, v in data.items() if k != "metadata"}
                 
                 # Apply rate limiting
                 elapsed = time.time() - start_time
@@ -107,26 +121,30 @@ async def batch_process_jsonl_file(
                     logger.debug(f"Rate limiting: Sleeping for {delay_needed:.2f} seconds")
                     await asyncio.sleep(delay_needed)
                 
-                return result
+                return result, elapsed
         except json.JSONDecodeError as e:
             logger.error(f"Error parsing JSON: {e}")
             return [
                 {"messages": []},
                 {"error": f"JSON parse error: {str(e)}"},
                 {}
-            ]
+            ], None
 
     # Create tasks for all lines
     tasks = [process_with_rate_limit(line) for line in lines]
     
     # Process all tasks with progress bar
-    output_buffer = io.StringIO() if dry_run else open(output_file, 'w', encoding='utf-8')
+    output_buffer = io.StringIO() if dry_run else JsonlWriter(output_file, batch_size=1)
     try:
         for result in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing requests"):
-            result_data = await result
-            output_buffer.write(json.dumps(result_data) + '\n')
-            if not dry_run:
-                output_buffer.flush()  # Ensure results are written immediately
+            result_data, latency = await result
+            if results_store is not None and not dry_run:
+                # Cached results keep their stored row
+                results_store.put_many(run_id, store_model, [(result_data, latency)], replace=latency is not None)
+            if dry_run:
+                output_buffer.write(dumps(result_data) + '\n')
+            else:
+                output_buffer.write(result_data)  # Flushed immediately, so no result is lost on a crash
     finally:
         if not dry_run:
             output_buffer.close()
@@ -226,30 +244,82 @@ def main():
                         help="Run without sending requests or saving results")
     parser.add_argument("--max_retries", type=int, default=3,
                         help="Maximum number of retry attempts for failed requests")
+    parser.add_argument("--no_dedup", action="store_true",
+                        help="Send every request, even when several sentences share the same prompt")
+    parser.add_argument("--top_k", type=int, default=-1,
+                        help="Only process the first k records")
+    parser.add_argument("--sample", type=int, default=-1,
+                        help="Only process k random records")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of --sample")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="Only process shard i of n of the input, as i/n (e.g. 0/4)")
+    parser.add_argument("--sentence_ids", type=str, default=None,
+                        help="Only process these comma-separated sentence ids")
+    parser.add_argument("--results_db", type=str, default=None,
+                        help="SQLite results store to resume from and write to (e.g. data/output/result/results.sqlite)")
+    parser.add_argument("--run_id", type=str, default="default",
+                        help="Run id of the results in the results store")
+    parser.add_argument("--name", type=str, default=None,
+                        help="Model name of the results in the results store (defaults to --model)")
     
     args = parser.parse_args()
     
     if args.dry_run:
-        previous_output_file = args.output
         logger.info("-" * 20)
         logger.info("- Dry run mode -")
         logger.info("-" * 20)
-    else:
-        previous_output_file = backup_output_file(args.output)
-        logger.info("Backup file: %s --> %s", args.output, previous_output_file)
     
-    logger.info("Processing %s with model %s...", args.input, args.model)
+    # Subsets of the input are read in place through its line index, without copies
+    line_numbers = None
+    if args.top_k > 0 or args.sample > 0 or args.shard or args.sentence_ids:
+        line_numbers = select_lines(
+            JsonlIndex(args.input),
+            top_k=args.top_k,
+            sample=args.sample,
+            shard=tuple(int(x) for x in args.shard.split('/')) if args.shard else None,
+            sentence_ids=[int(x) for x in args.sentence_ids.split(',')] if args.sentence_ids else None,
+            seed=args.seed,
+        )
+        logger.info("Selected %d records of %s", len(line_numbers), args.input)
+
+    input_file, output_file = args.input, args.output
+    if not args.no_dedup:
+        # Identical prompts are sent once; their result is copied to every sentence afterwards
+        # named after the output, so runs over different subsets of the same input do not clash
+        input_file, index_file = build_dedup_index(args.input, line_numbers, base_name=split_ext(args.output)[0] + "_requests")
+        output_file = args.output.replace(".jsonl", "_unique.jsonl")
+        line_numbers = None
+
+    # The results of an interrupted run are kept: with dedup, those written so far are only
+    # in the unique results file, since the output is written once the run completes
+    previous_output_files = [args.output] if output_file == args.output else [args.output, output_file]
+    if not args.dry_run:
+        backup_files = []
+        for previous_output_file in previous_output_files:
+            backup_files.append(backup_output_file(previous_output_file))
+            logger.info("Backup file: %s --> %s", previous_output_file, backup_files[-1])
+        previous_output_files = backup_files
+
+    results_store = ResultsStore(args.results_db) if args.results_db else None
+    store_model = args.name or args.model
+
+    logger.info("Processing %s with model %s...", input_file, args.model)
     result = asyncio.run(batch_process_jsonl_file(
-        args.input, 
-        args.output,
+        input_file, 
+        output_file,
         args.model,
         args.temperature,
         args.max_tokens,
         args.batch_size,
         args.requests_per_minute,
-        previous_output_file,
+        previous_output_files,
         args.dry_run,
-        args.max_retries
+        args.max_retries,
+        results_store,
+        args.run_id,
+        store_model,
+        line_numbers,
     ))
     
     if args.dry_run:
@@ -257,6 +327,12 @@ def main():
         print(result)
         print("-" * 20)
     else:
+        if not args.no_dedup:
+            fan_out_results(output_file, index_file, args.output)
+            os.remove(output_file)
+            if results_store is not None:
+                # Add the duplicates, keeping the rows of the requests actually sent
+                results_store.import_jsonl(args.run_id, store_model, args.output)
         print(f"Results saved to {args.output}")
 
 if __name__ == "__main__":
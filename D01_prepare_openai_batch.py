@@ -5,6 +5,7 @@ from typing import List, Dict
 
 from lib.io import save_to_jsonl, read_jsonl
 from lib.finetuning_helper import FineTuningHelper
+from lib.prompts import render_messages
 import settings
 
 
@@ -33,7 +34,7 @@ def format_for_batch(data: List[Dict], model: str, temperature: float = 0) -> Li
     formatted_data = []
     for index, item in enumerate(data):
         # Extract the user message content and sentence_id
-        user_message = item['messages'][0]['content']
+        user_message = render_messages(item)[0]['content']
         sentence_id = item['metadata']['sentence_id']
         
         formatted_item = {
@@ -1,4 +1,4 @@
-import json
+from lib.io import JsonlWriter, iter_jsonl
 from lib.utils import backup_output_file
 import os
 
@@ -9,13 +9,9 @@ target_file = "data/output/result/test_result_gpt_4o_finetuned.jsonl"
 
 
 def check_duplicate_original(input_file: str):
-    with open(input_file, "r") as f:
-        lines = f.readlines()
-
     duplicate_count = 0
     text_set = set()
-    for line in lines:
-        data = json.loads(line)
+    for data in iter_jsonl(input_file):
         text = data["metadata"]["original"]
         text += data["metadata"]["corrected"]
         
@@ -33,30 +29,24 @@ def add_sentence_id_to_dataset(input_file: str, target_file: str):
         return
 
     backup_file = backup_output_file(target_file)
-    with open(input_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
     mapping = {}
-    for line in lines:
-        data = json.loads(line)
+    for data in iter_jsonl(input_file):
         metadata = data["metadata"]
         sentence_id = metadata.pop("sentence_id")
         
         sig = metadata["original"] + metadata["corrected"]
         mapping[sig] = sentence_id
         
-    with open(backup_file, "r", encoding="utf-8") as f_in:
-        with open(target_file, "w", encoding="utf-8") as f_out:
-            for line in f_in.readlines():
-                data = json.loads(line)
-                target_metadata = data[2]
-                sig = target_metadata["original"] + target_metadata["corrected"]
-                sentence_id = mapping.get(sig, None)
-                if sentence_id is None:
-                    print(f"Sentence id not found for {sig}")
-                else:
-                    target_metadata["sentence_id"] = sentence_id
-                f_out.write(json.dumps(data) + "\n")
+    with JsonlWriter(target_file) as writer:
+        for data in iter_jsonl(backup_file):
+            target_metadata = data[2]
+            sig = target_metadata["original"] + target_metadata["corrected"]
+            sentence_id = mapping.get(sig, None)
+            if sentence_id is None:
+                print(f"Sentence id not found for {sig}")
+            else:
+                target_metadata["sentence_id"] = sentence_id
+            writer.write(data)
     
     print(f"Added sentence id to {target_file}")
 
@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+from lib.api_request_parallel_processor import process_api_requests_from_file_openai
+from lib.http_transport import HttpTransport
+from lib.io import JsonlWriter
+from lib.mock_openai_server import MockOpenAIServer
+from lib.prompts import create_record
+from lib.token_counter import count_file_tokens
+from lib.utils import setup_log
+
+logger = logging.getLogger(__name__)
+
+
+class WordEncoding:
+    """One token per word; the benchmark only needs stable token budgets, not tiktoken's exact counts"""
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [text.split() for text in texts]
+
+
+def write_requests(file_path: str, num_requests: int) -> None:
+    with JsonlWriter(file_path) as writer:
+        for i in range(num_requests):
+            record = create_record(f"Sentence number {i} have a error .")
+            record["metadata"] = {"sentence_id": i}
+            writer.write(record)
+    count_file_tokens(file_path, encoding=WordEncoding())
+
+
+async def run_scenario(name: str, num_requests: int, latency: float, max_requests_per_minute: float,
+                       max_tokens_per_minute: float, work_dir: str) -> dict:
+    requests_file = os.path.join(work_dir, f"{name}.jsonl")
+    results_file = os.path.join(work_dir, f"{name}_results.jsonl")
+    write_requests(requests_file, num_requests)
+    async with MockOpenAIServer(latency=latency) as server:
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        await process_api_requests_from_file_openai(
+            requests_filepath=requests_file,
+            save_filepath=results_file,
+            request_url=server.url,
+            api_key="mock",
+            max_requests_per_minute=max_requests_per_minute,
+            max_tokens_per_minute=max_tokens_per_minute,
+            token_encoding_name="cl100k_base",
+            max_attempts=1,
+            logging_level=logging.WARNING,
+            additional_params={"model": "mock"},
+        )
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    # the process time includes the mock server, which runs in the same event loop
+    return {
+        "scenario": name,
+        "requests": server.num_requests,
+        "wall_s": round(wall, 2),
+        "cpu_s": round(cpu, 2),
+        "cpu_share": round(cpu / wall, 3),
+        "requests_per_s": round(server.num_requests / wall, 1),
+    }
+
+
+async def run_model_pair(shared: bool, num_requests: int, latency: float, work_dir: str) -> dict:
+    """A baseline and a fine-tuned run one after the other, as ModelRunner does, with or without a shared transport"""
+    requests_file = os.path.join(work_dir, "pair.jsonl")
+    write_requests(requests_file, num_requests)
+    shared_transport = HttpTransport()
+    transports = []
+    async with MockOpenAIServer(latency=latency) as server:
+        for model in ("baseline", "finetuned"):
+            transport = shared_transport if shared else HttpTransport()
+            transports.append(transport)
+            await process_api_requests_from_file_openai(
+                requests_filepath=requests_file,
+                save_filepath=os.path.join(work_dir, f"pair_{model}_{shared}_results.jsonl"),
+                request_url=server.url,
+                api_key="mock",
+                max_requests_per_minute=1e9,
+                max_tokens_per_minute=1e12,
+                token_encoding_name="cl100k_base",
+                max_attempts=1,
+                logging_level=logging.WARNING,
+                additional_params={"model": model},
+                transport=transport,
+            )
+            if not shared:
+                await transport.close()
+        await shared_transport.close()
+    # the metrics of a transport it does not own are kept by the processor's caller
+    metrics = [transport.metrics() for transport in (transports[:1] if shared else transports)]
+    return {
+        "scenario": "shared_transport" if shared else "transport_per_run",
+        "connections_created": sum(m["connections_created"] for m in metrics),
+        "connections_reused": sum(m["connections_reused"] for m in metrics),
+        "cold_request_ms": [m["cold_request_ms"] for m in metrics],
+        "warm_request_ms_p95": [m["warm_request_ms"] and m["warm_request_ms"]["p95"] for m in metrics],
+    }
+
+
+async def main(args) -> None:
+    with tempfile.TemporaryDirectory() as work_dir:
+        scenarios = [
+            # unthrottled: how fast the scheduler dispatches
+            ("throughput", args.num_requests, args.latency, 1e9, 1e12),
+            # request budget exhausted after the first minute's worth: the loop mostly waits for capacity
+            ("throttled", 600 + args.throttled_extra, args.latency, 600, 1e12),
+            # slow responses: the loop mostly waits for in-flight requests
+            ("slow_responses", 50, args.slow_latency, 1e9, 1e12),
+        ]
+        for scenario in scenarios:
+            print(await run_scenario(*scenario, work_dir=work_dir))
+        # connection setup of consecutive model runs
+        for shared in (False, True):
+            print(await run_model_pair(shared, args.pair_requests, args.latency, work_dir))
+
+
+if __name__ == "__main__":
+    setup_log(logging.WARNING)
+    parser = argparse.ArgumentParser(description="Measure the dispatch throughput, idle CPU and connection reuse of the API request processor against a local mock server")
+    parser.add_argument("--num_requests", type=int, default=5_000, help="Requests of the throughput scenario")
+    parser.add_argument("--latency", type=float, default=0.02, help="Response latency of the mock server, in seconds")
+    parser.add_argument("--slow_latency", type=float, default=5.0, help="Response latency of the slow_responses scenario")
+    parser.add_argument("--pair_requests", type=int, default=500, help="Requests of each run of the transport scenarios")
+    parser.add_argument("--throttled_extra", type=int, default=50, help="Requests beyond the initial budget of the throttled scenario, sent at 10 per second")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,195 @@
+import os
+import string
+from difflib import SequenceMatcher
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Iterable
+
+
+NOOP_EDIT = "A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||{annotator}"
+
+
+def align_sentences(original: str, hypothesis: str, merge: bool = True) -> list[tuple[int, int, str, str]]:
+    """
+    Compute the edits that turn a tokenized original sentence into a hypothesis.
+
+    Results are cached, so repeated (original, hypothesis) pairs, e.g. the
+    same sentence corrected identically by several systems, are aligned once.
+
+    Args:
+        original (str): Tokenized original sentence
+        hypothesis (str): Tokenized corrected sentence
+        merge (bool): Merge adjacent non-matching operations into one edit
+
+    Returns:
+        list: (start, end, replacement, error_type) edits over the original tokens
+    """
+    return list(_align_cached(original, hypothesis, merge))
+
+@lru_cache(maxsize=1 << 16)
+def _align_cached(original: str, hypothesis: str, merge: bool) -> tuple:
+    orig_tokens = original.split()
+    hyp_tokens = hypothesis.split()
+    if orig_tokens == hyp_tokens:
+        return ()
+    return tuple(
+        (start, end, ' '.join(hyp_tokens[hyp_start:hyp_end]), classify_edit(orig_tokens[start:end], hyp_tokens[hyp_start:hyp_end]))
+        for start, end, hyp_start, hyp_end in align_tokens(orig_tokens, hyp_tokens, merge)
+    )
+
+def align_tokens(orig_tokens: list[str], hyp_tokens: list[str], merge: bool = True) -> list[tuple[int, int, int, int]]:
+    """
+    Align two token lists with a Levenshtein alignment using linguistic costs.
+
+    Substituting a token with a similar one (same word up to case, or a close
+    spelling) is cheaper than substituting an unrelated one, so alignments
+    prefer plausible replacements over delete-and-insert pairs. Matching
+    blocks are found first, and the quadratic alignment only runs over the
+    short gaps between them.
+
+    Args:
+        orig_tokens (list[str]): Original tokens
+        hyp_tokens (list[str]): Hypothesis tokens
+        merge (bool): Merge adjacent non-matching operations into one edit
+
+    Returns:
+        list: (orig_start, orig_end, hyp_start, hyp_end) spans of each edit
+    """
+    edits = []
+    matcher = SequenceMatcher(None, orig_tokens, hyp_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        for op, start, end, hyp_start, hyp_end in _align_gap(orig_tokens[i1:i2], hyp_tokens[j1:j2]):
+            if op == 'M':
+                continue
+            start, end, hyp_start, hyp_end = start + i1, end + i1, hyp_start + j1, hyp_end + j1
+            if edits and edits[-1][1] == start and edits[-1][3] == hyp_start and (merge or (start == end and edits[-1][0] == edits[-1][1])):
+                # extend the previous edit; stacked insertions always form one edit
+                edits[-1] = (edits[-1][0], end, edits[-1][2], hyp_end)
+            else:
+                edits.append((start, end, hyp_start, hyp_end))
+    return edits
+
+def _align_gap(orig: list[str], hyp: list[str]) -> list[tuple[str, int, int, int, int]]:
+    """Levenshtein alignment of a gap, returned as (op, start, end, hyp_start, hyp_end) operations."""
+    n, m = len(orig), len(hyp)
+    costs = [[0.0] * (m + 1) for _ in range(n + 1)]
+    ops = [[''] * (m + 1) for _ in range(n + 1)]
+    for i in range(1, n + 1):
+        costs[i][0] = float(i)
+        ops[i][0] = 'D'
+    for j in range(1, m + 1):
+        costs[0][j] = float(j)
+        ops[0][j] = 'I'
+    for i in range(1, n + 1):
+        row, prev = costs[i], costs[i - 1]
+        for j in range(1, m + 1):
+            if orig[i - 1] == hyp[j - 1]:
+                best, op = prev[j - 1], 'M'
+            else:
+                best, op = prev[j - 1] + substitution_cost(orig[i - 1], hyp[j - 1]), 'S'
+            if prev[j] + 1 < best:
+                best, op = prev[j] + 1, 'D'
+            if row[j - 1] + 1 < best:
+                best, op = row[j - 1] + 1, 'I'
+            row[j] = best
+            ops[i][j] = op
+
+    # Trace back the cheapest path
+    path = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        op = ops[i][j]
+        if op in ('M', 'S'):
+            i, j = i - 1, j - 1
+            path.append((op, i, i + 1, j, j + 1))
+        elif op == 'D':
+            i -= 1
+            path.append((op, i, i + 1, j, j))
+        else:
+            j -= 1
+            path.append((op, i, i, j, j + 1))
+    path.reverse()
+    return path
+
+@lru_cache(maxsize=1 << 16)
+def substitution_cost(orig_token: str, hyp_token: str) -> float:
+    """Cost of substituting one token for another, between 0 and 2."""
+    if orig_token.lower() == hyp_token.lower():
+        return 0.0
+    char_cost = 1 - SequenceMatcher(None, orig_token.lower(), hyp_token.lower()).ratio()
+    # unrelated tokens cost as much as a deletion plus an insertion
+    return 1 + char_cost if char_cost > 0.5 else 2 * char_cost
+
+def classify_edit(orig_tokens: list[str], hyp_tokens: list[str]) -> str:
+    """Give an edit a coarse ERRANT-style type (M/U/R plus PUNCT, ORTH or OTHER)."""
+    if not orig_tokens:
+        op = 'M'
+    elif not hyp_tokens:
+        op = 'U'
+    else:
+        op = 'R'
+    tokens = orig_tokens + hyp_tokens
+    if all(token.strip(string.punctuation) == '' for token in tokens):
+        category = 'PUNCT'
+    elif op == 'R' and ''.join(orig_tokens).lower() == ''.join(hyp_tokens).lower():
+        category = 'ORTH'
+    else:
+        category = 'OTHER'
+    return f'{op}:{category}'
+
+def format_m2_block(original: str, edits: list[tuple[int, int, str, str]], annotator: int = 0) -> str:
+    """Format one sentence and its edits as an M2 block."""
+    lines = [f'S {original}']
+    if not edits:
+        lines.append(NOOP_EDIT.format(annotator=annotator))
+    for start, end, replacement, error_type in edits:
+        lines.append(f'A {start} {end}|||{error_type}|||{replacement}|||REQUIRED|||-NONE-|||{annotator}')
+    return '\n'.join(lines) + '\n'
+
+def _align_pair(pair: tuple[str, str]) -> list[tuple[int, int, str, str]]:
+    return align_sentences(*pair)
+
+def align_corpus(originals: Iterable[str], hypotheses: Iterable[str], processes: int | None = None, chunksize: int = 256) -> list[list[tuple[int, int, str, str]]]:
+    """
+    Align a whole result set, fanning the sentences out to a process pool.
+
+    Args:
+        originals (Iterable[str]): Tokenized original sentences
+        hypotheses (Iterable[str]): Tokenized hypotheses, in the same order
+        processes (int, optional): Number of worker processes, 1 to align in-process
+        chunksize (int): Number of sentences sent to a worker at a time
+
+    Returns:
+        list: Edits of each sentence, in input order
+    """
+    pairs = list(zip(originals, hypotheses))
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(pairs) <= chunksize:
+        return [_align_pair(pair) for pair in pairs]
+    with Pool(processes) as pool:
+        return pool.map(_align_pair, pairs, chunksize=chunksize)
+
+def write_m2_file(file_path: str, originals: Iterable[str], hypotheses: Iterable[str], annotator: int = 0, processes: int | None = None) -> int:
+    """
+    Align hypotheses with their originals and write them as an M2 file.
+
+    Args:
+        file_path (str): Path to the output M2 file
+        originals (Iterable[str]): Tokenized original sentences
+        hypotheses (Iterable[str]): Tokenized hypotheses, in the same order
+        annotator (int): Annotator id written on every edit
+        processes (int, optional): Number of worker processes
+
+    Returns:
+        int: Number of sentences written
+    """
+    originals = list(originals)
+    all_edits = align_corpus(originals, hypotheses, processes=processes)
+    path = os.path.dirname(file_path)
+    if path:
+        os.makedirs(path, exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(format_m2_block(original, edits, annotator) for original, edits in zip(originals, all_edits)))
+    return len(originals)
@@ -1,12 +1,17 @@
-def convert_m2_to_text(m2_string: str) -> dict:
+import os
+from typing import Iterable, Iterator
+
+
+def parse_m2_block(m2_string: str) -> tuple[str, list[tuple[int, int, str, int, str]]]:
     """
-    Convert M2 formatted text to corrected sentence.
+    Parse one M2 block into the original sentence and its edits.
     
     Args:
         m2_string (str): String in M2 format
         
     Returns:
-        dict: Dictionary with original and corrected sentences
+        tuple: Original sentence and a list of
+            (start, end, replacement, annotator, error_type) edits in file order
     """
     if not m2_string:
         raise ValueError("Input string is empty")
@@ -20,10 +25,7 @@ def convert_m2_to_text(m2_string: str) -> dict:
     # Get the original sentence (first line starting with S)
     original = lines[0][2:].strip()  # Remove 'S ' from the start
     
-    # Convert the sentence to a list of characters for easier manipulation
-    tokens = original.split()
-    
-    # Store all edits: (start_pos, end_pos, replacement)
+    # Store all edits: (start_pos, end_pos, replacement, annotator, error_type)
     edits = []
     
     # Process annotation lines
@@ -36,55 +38,267 @@ def convert_m2_to_text(m2_string: str) -> dict:
         if len(parts) < 3:
             continue
             
-        # Get the position indices and replacement
+        # Get the position indices, replacement, annotator id and error type
         try:
             start, end = map(int, parts[0].split())
             replacement = parts[2]
-            edits.append((start, end, replacement))
+            annotator = int(parts[5]) if len(parts) > 5 else 0
+            edits.append((start, end, replacement, annotator, parts[1]))
         except (ValueError, IndexError):
             continue
     
-    # Sort edits in reverse order (to handle overlapping edits)
-    # simply reverse the list instead of sorting to avoid single-point insertions
-    # e.g., a sequence of insertions at position (1 1)
-    edits = reversed(edits)
+    return original, edits
+
+def convert_m2_to_text(m2_string: str) -> dict:
+    """
+    Convert M2 formatted text to corrected sentence.
+    
+    Edits from all annotators are applied together.
+    
+    Args:
+        m2_string (str): String in M2 format
+        
+    Returns:
+        dict: Dictionary with original and corrected sentences
+    """
+    original, edits = parse_m2_block(m2_string)
+    
+    # Convert the sentence to a list of tokens for easier manipulation
+    tokens = original.split()
+    tokens = apply_edits(tokens, [edit[:3] for edit in edits])
+
+    corrected = ' '.join(tokens).strip()
+    
+    return {
+        'original': original,
+        'corrected': corrected
+    }
+
+def convert_m2_to_references(m2_string: str, annotators: Iterable[int] | None = None) -> dict:
+    """
+    Convert M2 formatted text to one corrected reference per annotator.
+    
+    The block is parsed once; the combined correction (all annotators, as in
+    `convert_m2_to_text`) is returned alongside the per-annotator references.
+    
+    Args:
+        m2_string (str): String in M2 format
+        annotators (Iterable[int], optional): Annotator ids to keep. If omitted,
+            every annotator found in the block is returned. Requested annotators
+            without any line in the block get the original sentence.
+        
+    Returns:
+        dict: Dictionary with original, corrected and references
+            ({annotator_id: corrected sentence}) keys
+    """
+    original, edits = parse_m2_block(m2_string)
+    tokens = original.split()
+
+    by_annotator = {}
+    for start, end, replacement, annotator, _ in edits:
+        by_annotator.setdefault(annotator, []).append((start, end, replacement))
+    
+    if annotators is None:
+        annotators = sorted(by_annotator)
+    
+    references = {}
+    for annotator in annotators:
+        references[annotator] = ' '.join(apply_edits(tokens, by_annotator.get(annotator, []))).strip()
     
-    # Apply the edits
+    return {
+        'original': original,
+        'corrected': ' '.join(apply_edits(tokens, [edit[:3] for edit in edits])).strip(),
+        'references': references
+    }
+
+def apply_edits(tokens: list[str], edits: list[tuple[int, int, str]]) -> list[str]:
+    """
+    Apply M2 edits to a token list in a single left-to-right pass.
+    
+    Edits are given in file order. Stacked insertions at the same index keep
+    their file order, matching the original reverse-order application. If the
+    edits are not ordered and non-overlapping (or fall outside the sentence),
+    the sequential reverse-order application is used so that the result is
+    unchanged for such inputs.
+    
+    Args:
+        tokens (list[str]): Tokens of the original sentence
+        edits (list[tuple]): (start, end, replacement) in file order
+        
+    Returns:
+        list: Tokens of the corrected sentence
+    """
+    n = len(tokens)
+    active = []
+    size = n
+    prev_end = 0
     for start, end, replacement in edits:
+        if start < 0 or end < 0:
+            continue
+        if start < prev_end or end < start or end > n:
+            return _apply_edits_sequential(tokens, edits)
+        prev_end = end
+        active.append((start, end, replacement))
+        size -= end - start
+        if replacement != '':
+            size += 1
+    
+    if not active:
+        return list(tokens)
+    
+    # Fill a preallocated buffer, copying the untouched spans between edits
+    output = [None] * size
+    pos = 0
+    i = 0
+    for start, end, replacement in active:
+        span = start - pos
+        output[i:i + span] = tokens[pos:start]
+        i += span
+        if replacement != '':
+            output[i] = replacement
+            i += 1
+        pos = end
+    output[i:] = tokens[pos:]
+    return output
+
+def _apply_edits_sequential(tokens: list[str], edits: list[tuple[int, int, str]]) -> list[str]:
+    """Apply edits one by one in reverse file order (quadratic fallback)."""
+    # Simply reverse the list instead of sorting to avoid reordering
+    # single-point insertions, e.g., a sequence of insertions at position (1 1)
+    for start, end, replacement in reversed(edits):
         if start < 0 or end < 0:
             continue
         if replacement == '':
             tokens = tokens[:start] + tokens[end:]
         else:
             tokens = tokens[:start] + [replacement] + tokens[end:]
+    return tokens
 
-    corrected = ' '.join(tokens).strip()
+def iter_m2_file(file_path: str) -> Iterator[dict]:
+    """
+    Lazily convert an M2 file, yielding one sentence block at a time.
     
-    return {
-        'original': original,
-        'corrected': corrected
-    }
+    The file is read line by line through a buffered handle, so memory use
+    stays flat regardless of the size of the corpus.
+    
+    Args:
+        file_path (str): Path to the M2 file
+        
+    Yields:
+        dict: Dictionary with original and corrected sentences
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for block in iter_m2_blocks(f):
+            yield convert_m2_to_text(block)
 
-def convert_m2_file(file_path: str) -> list[dict]:
+def iter_m2_references(file_path: str, annotators: Iterable[int] | None = None, start: int = 0, end: int | None = None) -> Iterator[dict]:
     """
-    Convert an M2 file to a list of dictionaries with original and corrected sentences.
+    Lazily convert an M2 file into per-annotator references in a single pass.
+    
+    Every yielded record has a reference for the same set of annotators, so
+    per-annotator outputs stay line-aligned. Without a filter, that set is
+    taken from the first block that is read.
+    
+    Args:
+        file_path (str): Path to the M2 file
+        annotators (Iterable[int], optional): Annotator ids to keep
+        start (int): Byte offset to start reading from, must be block-aligned
+        end (int, optional): Byte offset to stop reading at, must be block-aligned
+        
+    Yields:
+        dict: Dictionary with original, corrected and references keys
+    """
+    if annotators is not None:
+        annotators = list(annotators)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        for block in iter_m2_blocks(_read_lines(f, end)):
+            if annotators is None:
+                result = convert_m2_to_references(block)
+                annotators = list(result['references'])
+            else:
+                result = convert_m2_to_references(block, annotators)
+            yield result
+
+def read_m2_annotators(file_path: str) -> list[int]:
+    """
+    Return the annotator ids found in the first block of an M2 file.
     
     Args:
         file_path (str): Path to the M2 file
         
     Returns:
-        list: List of dictionaries with original and corrected sentences
+        list: Sorted annotator ids
     """
     with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+        for block in iter_m2_blocks(f):
+            _, edits = parse_m2_block(block)
+            return sorted({edit[3] for edit in edits})
+    return []
+
+def find_m2_chunks(file_path: str, chunk_size: int) -> list[tuple[int, int]]:
+    """
+    Split an M2 file into block-aligned byte ranges of roughly `chunk_size` bytes.
     
-    # Split the content into sentence blocks
-    blocks = content.strip().split('\n\n')
+    Args:
+        file_path (str): Path to the M2 file
+        chunk_size (int): Target size of each chunk in bytes
+        
+    Returns:
+        list: (start, end) byte offsets, each starting at a sentence block
+    """
+    size = os.path.getsize(file_path)
+    offsets = [0]
+    with open(file_path, 'rb') as f:
+        while offsets[-1] + chunk_size < size:
+            f.seek(offsets[-1] + chunk_size)
+            f.readline()  # finish the current line
+            # move past the blank line that ends the current block
+            for line in iter(f.readline, b''):
+                if not line.strip():
+                    break
+            pos = f.tell()
+            if pos >= size:
+                break
+            offsets.append(pos)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def _read_lines(f, end: int | None = None) -> Iterator[str]:
+    """Decode lines from a binary file handle until the byte offset `end`."""
+    for line in iter(f.readline, b''):
+        yield line.decode('utf-8').replace('\r\n', '\n')
+        if end is not None and f.tell() >= end:
+            break
+
+def iter_m2_blocks(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Group M2 lines into sentence blocks separated by blank lines.
     
-    # Convert each block
-    results = []
-    for block in blocks:
-        if block.strip():
-            results.append(convert_m2_to_text(block))
+    Args:
+        lines (Iterable[str]): Lines of an M2 file, e.g. an open file handle
+        
+    Yields:
+        str: One M2 block (S line followed by its A lines)
+    """
+    block = []
+    for line in lines:
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+def convert_m2_file(file_path: str) -> list[dict]:
+    """
+    Convert an M2 file to a list of dictionaries with original and corrected sentences.
     
-    return results
+    Args:
+        file_path (str): Path to the M2 file
+        
+    Returns:
+        list: List of dictionaries with original and corrected sentences
+    """
+    return list(iter_m2_file(file_path))
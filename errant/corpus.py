@@ -0,0 +1,192 @@
+import json
+import os
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from errant.converter import apply_edits, iter_m2_blocks, parse_m2_block
+
+
+CORPUS_VERSION = 1
+
+
+class M2Corpus:
+    """
+    Columnar, memory-mapped view of one or more parsed M2 files.
+
+    The corpus is a directory of `.npy` arrays written once by `build`:
+    UTF-8 text blobs with offset arrays for the original and corrected
+    sentences, vocabulary ids for the original tokens, and the edit spans,
+    replacements, error types and annotator ids. Arrays are opened with
+    `mmap_mode='r'`, so opening a corpus does not parse anything and
+    sentence N is read in O(1).
+    """
+
+    def __init__(self, corpus_dir: str) -> None:
+        self.corpus_dir = corpus_dir
+        with open(os.path.join(corpus_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != CORPUS_VERSION:
+            raise ValueError(f"Unsupported corpus version in {corpus_dir}: {self.meta.get('version')}")
+        self.error_types = self.meta["error_types"]
+
+        self.original_blob = self._load("original")
+        self.original_offsets = self._load("original_offsets")
+        self.corrected_blob = self._load("corrected")
+        self.corrected_offsets = self._load("corrected_offsets")
+        self.vocab_blob = self._load("vocab")
+        self.vocab_offsets = self._load("vocab_offsets")
+        self.token_ids = self._load("token_ids")
+        self.token_offsets = self._load("token_offsets")
+        self.edit_offsets = self._load("edit_offsets")
+        self.edit_spans = self._load("edit_spans")
+        self.edit_types = self._load("edit_types")
+        self.edit_annotators = self._load("edit_annotators")
+        self.replacement_blob = self._load("replacements")
+        self.replacement_offsets = self._load("replacement_offsets")
+
+    def _load(self, name: str) -> np.ndarray:
+        path = os.path.join(self.corpus_dir, f"{name}.npy")
+        try:
+            return np.load(path, mmap_mode="r")
+        except ValueError:
+            # empty arrays cannot be memory-mapped
+            return np.load(path)
+
+    @staticmethod
+    def exists(corpus_dir: str | None) -> bool:
+        return bool(corpus_dir) and os.path.exists(os.path.join(corpus_dir, "meta.json"))
+
+    def __len__(self) -> int:
+        return len(self.original_offsets) - 1
+
+    def original(self, index: int) -> str:
+        # sentences are newline-terminated in the blob
+        return _decode(self.original_blob, self.original_offsets[index], self.original_offsets[index + 1] - 1)
+
+    def corrected(self, index: int) -> str:
+        return _decode(self.corrected_blob, self.corrected_offsets[index], self.corrected_offsets[index + 1] - 1)
+
+    def tokens(self, index: int) -> list[str]:
+        ids = self.token_ids[self.token_offsets[index]:self.token_offsets[index + 1]]
+        return [_decode(self.vocab_blob, self.vocab_offsets[i], self.vocab_offsets[i + 1]) for i in ids]
+
+    def edits(self, index: int) -> list[tuple[int, int, str, int, str]]:
+        """Return the (start, end, replacement, annotator, error_type) edits of sentence `index`."""
+        edits = []
+        for i in range(self.edit_offsets[index], self.edit_offsets[index + 1]):
+            start, end = self.edit_spans[i]
+            edits.append((
+                int(start),
+                int(end),
+                _decode(self.replacement_blob, self.replacement_offsets[i], self.replacement_offsets[i + 1]),
+                int(self.edit_annotators[i]),
+                self.error_types[self.edit_types[i]],
+            ))
+        return edits
+
+    def __getitem__(self, index: int) -> dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Sentence index out of range: {index}")
+        return {"original": self.original(index), "corrected": self.corrected(index)}
+
+    def iter_pairs(self) -> Iterator[tuple[str, str]]:
+        """Yield (original, corrected) pairs in corpus order, one sentence at a time."""
+        for index in range(len(self)):
+            yield self.original(index), self.corrected(index)
+
+    @classmethod
+    def build(cls, m2_files: Iterable[str], corpus_dir: str) -> "M2Corpus":
+        """
+        Parse M2 files once and write them as a memory-mappable corpus.
+
+        Args:
+            m2_files (Iterable[str]): M2 files, concatenated in the given order
+            corpus_dir (str): Output directory
+
+        Returns:
+            M2Corpus: The newly built corpus
+        """
+        m2_files = list(m2_files)
+        original = bytearray()
+        original_offsets = [0]
+        corrected = bytearray()
+        corrected_offsets = [0]
+        vocab = {}
+        token_ids = []
+        token_offsets = [0]
+        edit_offsets = [0]
+        edit_spans = []
+        edit_types = []
+        edit_annotators = []
+        replacements = bytearray()
+        replacement_offsets = [0]
+        error_types = {}
+
+        for m2_file in m2_files:
+            with open(m2_file, "r", encoding="utf-8") as f:
+                for block in iter_m2_blocks(f):
+                    sentence, edits = parse_m2_block(block)
+                    tokens = sentence.split()
+
+                    original += (sentence + "\n").encode("utf-8")
+                    original_offsets.append(len(original))
+                    correction = " ".join(apply_edits(tokens, [edit[:3] for edit in edits])).strip()
+                    corrected += (correction + "\n").encode("utf-8")
+                    corrected_offsets.append(len(corrected))
+
+                    for token in tokens:
+                        token_ids.append(vocab.setdefault(token, len(vocab)))
+                    token_offsets.append(len(token_ids))
+
+                    for start, end, replacement, annotator, error_type in edits:
+                        edit_spans.append((start, end))
+                        edit_types.append(error_types.setdefault(error_type, len(error_types)))
+                        edit_annotators.append(annotator)
+                        replacements += replacement.encode("utf-8")
+                        replacement_offsets.append(len(replacements))
+                    edit_offsets.append(len(edit_spans))
+
+        vocab_blob = bytearray()
+        vocab_offsets = [0]
+        for token in vocab:
+            vocab_blob += token.encode("utf-8")
+            vocab_offsets.append(len(vocab_blob))
+
+        os.makedirs(corpus_dir, exist_ok=True)
+        arrays = {
+            "original": np.frombuffer(bytes(original), dtype=np.uint8),
+            "original_offsets": np.asarray(original_offsets, dtype=np.int64),
+            "corrected": np.frombuffer(bytes(corrected), dtype=np.uint8),
+            "corrected_offsets": np.asarray(corrected_offsets, dtype=np.int64),
+            "vocab": np.frombuffer(bytes(vocab_blob), dtype=np.uint8),
+            "vocab_offsets": np.asarray(vocab_offsets, dtype=np.int64),
+            "token_ids": np.asarray(token_ids, dtype=np.int32),
+            "token_offsets": np.asarray(token_offsets, dtype=np.int64),
+            "edit_offsets": np.asarray(edit_offsets, dtype=np.int64),
+            "edit_spans": np.asarray(edit_spans, dtype=np.int32).reshape(-1, 2),
+            "edit_types": np.asarray(edit_types, dtype=np.int16),
+            "edit_annotators": np.asarray(edit_annotators, dtype=np.int16),
+            "replacements": np.frombuffer(bytes(replacements), dtype=np.uint8),
+            "replacement_offsets": np.asarray(replacement_offsets, dtype=np.int64),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(corpus_dir, f"{name}.npy"), array)
+
+        meta = {
+            "version": CORPUS_VERSION,
+            "sources": m2_files,
+            "num_sentences": len(original_offsets) - 1,
+            "num_tokens": len(token_ids),
+            "num_edits": len(edit_spans),
+            "error_types": list(error_types),
+        }
+        with open(os.path.join(corpus_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=4)
+        return cls(corpus_dir)
+
+
+def _decode(blob: np.ndarray, start: int, end: int) -> str:
+    return bytes(blob[start:end]).decode("utf-8")
@@ -0,0 +1,257 @@
+import os
+from multiprocessing import Pool
+from typing import Iterable
+
+import numpy as np
+
+from errant.alignment import align_tokens, classify_edit
+from errant.converter import apply_edits, iter_m2_blocks, parse_m2_block
+from errant.corpus import M2Corpus
+
+
+# Edit types that are not scored as corrections
+IGNORED_TYPES = {'noop', 'UNK', 'Um'}
+
+TP, FP, FN = 0, 1, 2
+
+
+def read_m2_edits(file_path: str) -> list[tuple[str, list[tuple[int, int, str, int, str]]]]:
+    """
+    Read the original sentence and edits of every block of an M2 file.
+
+    Args:
+        file_path (str): Path to the M2 file
+
+    Returns:
+        list: (original, edits) per sentence, edits as returned by `parse_m2_block`
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [parse_m2_block(block) for block in iter_m2_blocks(f)]
+
+def split_by_annotator(edits: Iterable[tuple[int, int, str, int, str]]) -> dict[int, dict[tuple[int, int, str], str]]:
+    """
+    Group scorable edits by annotator.
+
+    Returns:
+        dict: {annotator: {(start, end, replacement): error_type}}; annotators
+            with only a noop edit map to an empty dict
+    """
+    by_annotator = {}
+    for start, end, replacement, annotator, error_type in edits:
+        annotator_edits = by_annotator.setdefault(annotator, {})
+        if start < 0 or error_type in IGNORED_TYPES:
+            continue
+        annotator_edits[(start, end, replacement)] = error_type
+    return by_annotator
+
+def normalize_edits(orig_tokens: list[str], edits: Iterable[tuple[int, int, str]], merge: bool = True) -> dict[tuple[int, int, str], str]:
+    """
+    Re-split edits the way the aligner does.
+
+    The edits are applied to the original, and the corrected sentence is
+    aligned back with `align_tokens`, so that gold and hypothesis edits that
+    make the same correction get the same spans however they were split
+    (e.g. gold (2, 3, 'it') + (3, 4, '') and hypothesis (2, 4, 'it')).
+
+    Returns:
+        dict: {(start, end, replacement): coarse error_type}
+    """
+    corrected = ' '.join(apply_edits(orig_tokens, list(edits))).split()
+    return {
+        (start, end, ' '.join(corrected[hyp_start:hyp_end])): classify_edit(orig_tokens[start:end], corrected[hyp_start:hyp_end])
+        for start, end, hyp_start, hyp_end in align_tokens(orig_tokens, corrected, merge)
+    }
+
+def normalize_gold(orig_tokens: list[str], edits: Iterable[tuple[int, int, str, int, str]], merge: bool = True) -> dict[int, dict[tuple[int, int, str], str]]:
+    """
+    Normalize the gold edits of every annotator with `normalize_edits`.
+
+    Each normalized edit keeps the (fine) type of the first gold edit it
+    overlaps, so that per-type scores stay in the gold annotation scheme.
+
+    Returns:
+        dict: {annotator: {(start, end, replacement): error_type}}, as `split_by_annotator`
+    """
+    by_annotator = {}
+    for start, end, replacement, annotator, error_type in edits:
+        annotator_edits = by_annotator.setdefault(annotator, [])
+        if start < 0 or error_type in IGNORED_TYPES:
+            continue
+        annotator_edits.append((start, end, replacement, error_type))
+
+    normalized = {}
+    for annotator, gold_edits in by_annotator.items():
+        spans = [(start, end, error_type) for start, end, _, error_type in gold_edits]
+        normalized[annotator] = {
+            edit: _overlapping_type(edit, spans) or error_type
+            for edit, error_type in normalize_edits(orig_tokens, [edit[:3] for edit in gold_edits], merge).items()
+        }
+    return normalized
+
+def _overlapping_type(edit: tuple[int, int, str], spans: Iterable[tuple[int, int, str]]) -> str | None:
+    """Type of the first span overlapping the edit; an insertion overlaps the spans it touches."""
+    start, end = edit[0], edit[1]
+    for span_start, span_end, error_type in spans:
+        low, high = max(start, span_start), min(end, span_end)
+        if low < high or (low == high and (start == end or span_start == span_end)):
+            return error_type
+    return None
+
+def score_sentence(hyp_edits: dict[tuple[int, int, str], str], gold_by_annotator: dict[int, dict[tuple[int, int, str], str]], beta: float = 0.5) -> tuple[int, int, int, int, list[tuple[str, int]]]:
+    """
+    Compare hypothesis edits with the gold edits of one sentence.
+
+    With several annotators, the one giving the highest sentence F-score
+    (then most true positives, then fewest errors) is used.
+
+    Every edit is typed in the same way: by the gold edit of the chosen
+    annotator it overlaps, or by its own type if it overlaps none. A false
+    positive on a gold error span thus counts against the type of that error.
+
+    Args:
+        hyp_edits (dict): {(start, end, replacement): error_type} of the hypothesis
+        gold_by_annotator (dict): Gold edits as returned by `split_by_annotator`
+        beta (float): Weight of recall in the F-score
+
+    Returns:
+        tuple: tp, fp, fn, chosen annotator and (error_type, TP/FP/FN) outcomes
+    """
+    if not gold_by_annotator:
+        gold_by_annotator = {0: {}}
+    best = None
+    for annotator, gold_edits in sorted(gold_by_annotator.items()):
+        tp = sum(1 for edit in hyp_edits if edit in gold_edits)
+        fp = len(hyp_edits) - tp
+        fn = len(gold_edits) - tp
+        key = (_f_score(tp, fp, fn, beta), tp, -fp - fn)
+        if best is None or key > best[0]:
+            best = (key, tp, fp, fn, annotator)
+    _, tp, fp, fn, annotator = best
+
+    gold_edits = gold_by_annotator[annotator]
+    gold_spans = [(start, end, error_type) for (start, end, _), error_type in gold_edits.items()]
+    outcomes = []
+    for edit, error_type in gold_edits.items():
+        outcomes.append((error_type, TP if edit in hyp_edits else FN))
+    for edit, error_type in hyp_edits.items():
+        if edit not in gold_edits:
+            outcomes.append((_overlapping_type(edit, gold_spans) or error_type, FP))
+    return tp, fp, fn, annotator, outcomes
+
+def _f_score(tp: int, fp: int, fn: int, beta: float) -> float:
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    if precision + recall == 0:
+        return 0.0
+    return (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall)
+
+def compute_prf(tp, fp, fn, beta: float = 0.5):
+    """
+    Vectorized precision, recall and F-beta.
+
+    Works on scalars or NumPy arrays of counts. As in ERRANT, precision is 1
+    when there are no hypothesis edits and recall is 1 when there are no gold
+    edits.
+
+    Returns:
+        tuple: precision, recall, f
+    """
+    tp, fp, fn = (np.asarray(x, dtype=np.float64) for x in (tp, fp, fn))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 1.0)
+        denominator = beta ** 2 * precision + recall
+        f = np.where(denominator > 0, (1 + beta ** 2) * precision * recall / denominator, 0.0)
+    return precision, recall, f
+
+def _score_chunk(args):
+    chunk, beta, merge = args
+    results = []
+    for original, hyp_edits, gold_edits in chunk:
+        orig_tokens = original.split()
+        hyp_edits = normalize_edits(orig_tokens, hyp_edits, merge)
+        results.append(score_sentence(hyp_edits, normalize_gold(orig_tokens, gold_edits, merge), beta))
+    return results
+
+def score_corpus(hyp_m2_file: str, gold: M2Corpus, beta: float = 0.5, processes: int | None = None, chunksize: int = 512, merge: bool = True) -> dict:
+    """
+    Score a hypothesis M2 file against a gold corpus at the span level.
+
+    Edits are compared on (start, end, replacement), as in ERRANT's span
+    correction scoring, after the hypothesis and gold edits were both
+    re-split by the aligner (see `normalize_edits`), so that the two sides
+    only differ where the corrections differ. Sentences are scored in a
+    process pool and the corpus and per-type totals are aggregated with NumPy.
+
+    Args:
+        hyp_m2_file (str): M2 file of the system, one block per gold sentence
+        gold (M2Corpus): Gold corpus, e.g. built from ABCN.dev.gold.bea19.m2
+        beta (float): Weight of recall in the F-score
+        processes (int, optional): Number of worker processes, 1 to score in-process
+        chunksize (int): Number of sentences sent to a worker at a time
+        merge (bool): Merge adjacent non-matching operations into one edit when re-splitting
+
+    Returns:
+        dict: counts (n x 3 array of per-sentence TP/FP/FN), annotators,
+            precision, recall, f and by_type ({error_type: {tp, fp, fn,
+            precision, recall, f}})
+    """
+    hypotheses = read_m2_edits(hyp_m2_file)
+    if len(hypotheses) != len(gold):
+        raise ValueError(f"{hyp_m2_file} has {len(hypotheses)} sentences, gold has {len(gold)}")
+
+    items = []
+    for index, (original, edits) in enumerate(hypotheses):
+        if original != gold.original(index):
+            raise ValueError(f"Sentence {index + 1} of {hyp_m2_file} does not match the gold original")
+        hyp_edits = [(start, end, replacement)
+                     for start, end, replacement, _, error_type in edits
+                     if start >= 0 and error_type not in IGNORED_TYPES]
+        items.append((original, hyp_edits, gold.edits(index)))
+
+    chunks = [(items[i:i + chunksize], beta, merge) for i in range(0, len(items), chunksize)]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(chunks) <= 1:
+        chunk_results = [_score_chunk(chunk) for chunk in chunks]
+    else:
+        with Pool(processes) as pool:
+            chunk_results = pool.map(_score_chunk, chunks)
+    results = [result for chunk_result in chunk_results for result in chunk_result]
+    return aggregate_scores(results, beta)
+
+def aggregate_scores(results: list[tuple[int, int, int, int, list[tuple[str, int]]]], beta: float = 0.5) -> dict:
+    """Aggregate per-sentence results of `score_sentence` into corpus and per-type scores."""
+    counts = np.array([result[:3] for result in results], dtype=np.int64).reshape(-1, 3)
+    annotators = np.array([result[3] for result in results], dtype=np.int64)
+    tp, fp, fn = counts.sum(axis=0)
+    precision, recall, f = compute_prf(tp, fp, fn, beta)
+
+    # per-type totals: one row per (type, outcome), summed with bincount
+    types = sorted({error_type for result in results for error_type, _ in result[4]})
+    type_index = {error_type: i for i, error_type in enumerate(types)}
+    outcomes = np.array([(type_index[error_type], outcome) for result in results for error_type, outcome in result[4]], dtype=np.int64).reshape(-1, 2)
+    type_counts = np.bincount(outcomes[:, 0] * 3 + outcomes[:, 1], minlength=len(types) * 3).reshape(-1, 3)
+    type_precision, type_recall, type_f = compute_prf(type_counts[:, TP], type_counts[:, FP], type_counts[:, FN], beta)
+
+    by_type = {}
+    for i, error_type in enumerate(types):
+        by_type[error_type] = {
+            'tp': int(type_counts[i, TP]),
+            'fp': int(type_counts[i, FP]),
+            'fn': int(type_counts[i, FN]),
+            'precision': float(type_precision[i]),
+            'recall': float(type_recall[i]),
+            'f': float(type_f[i]),
+        }
+
+    return {
+        'counts': counts,
+        'annotators': annotators,
+        'tp': int(tp),
+        'fp': int(fp),
+        'fn': int(fn),
+        'precision': float(precision),
+        'recall': float(recall),
+        'f': float(f),
+        'by_type': by_type,
+    }
@@ -0,0 +1,103 @@
+import numpy as np
+
+from errant.scorer import compute_prf
+
+
+def _corpus_f(sums: np.ndarray, beta: float) -> np.ndarray:
+    """F-beta of rows of summed (tp, fp, fn) counts."""
+    return compute_prf(sums[..., 0], sums[..., 1], sums[..., 2], beta)[2]
+
+def _check_counts(counts_a: np.ndarray, counts_b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    counts_a = np.asarray(counts_a, dtype=np.float64)
+    counts_b = np.asarray(counts_b, dtype=np.float64)
+    if counts_a.shape != counts_b.shape or counts_a.ndim != 2 or counts_a.shape[1] != 3:
+        raise ValueError(f"Expected two (n, 3) TP/FP/FN count arrays, got {counts_a.shape} and {counts_b.shape}")
+    return counts_a, counts_b
+
+def paired_bootstrap(counts_a, counts_b, n_resamples: int = 10_000, beta: float = 0.5, confidence: float = 0.95, seed: int | None = 0, batch_size: int = 500) -> dict:
+    """
+    Paired bootstrap over sentences for the F-score difference of two systems.
+
+    Each resample draws sentences with replacement; both systems are scored
+    on the same draw. A batch of resamples is a matrix of per-sentence draw
+    counts, so the resampled corpus totals of a batch are one matrix product.
+
+    Args:
+        counts_a (array): (n, 3) per-sentence TP/FP/FN counts of system A
+        counts_b (array): (n, 3) per-sentence TP/FP/FN counts of system B
+        n_resamples (int): Number of bootstrap resamples
+        beta (float): Weight of recall in the F-score
+        confidence (float): Confidence level of the interval
+        seed (int, optional): Seed of the random generator
+        batch_size (int): Number of resamples drawn at a time
+
+    Returns:
+        dict: f_a, f_b, delta (f_b - f_a), ci_low, ci_high and p_value
+            (two-sided: twice the share of resamples on the less frequent side
+            of 0, at most 1, so it tests the same hypothesis as
+            `approximate_randomization`)
+    """
+    counts_a, counts_b = _check_counts(counts_a, counts_b)
+    n = len(counts_a)
+    rng = np.random.default_rng(seed)
+    deltas = np.empty(n_resamples)
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        # row r of `weights` counts how often each sentence is drawn in resample r
+        draws = rng.integers(0, n, size=(size, n)) + np.arange(size)[:, None] * n
+        weights = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(np.float64)
+        deltas[start:start + size] = _corpus_f(weights @ counts_b, beta) - _corpus_f(weights @ counts_a, beta)
+
+    f_a = float(_corpus_f(counts_a.sum(axis=0), beta))
+    f_b = float(_corpus_f(counts_b.sum(axis=0), beta))
+    alpha = (1 - confidence) / 2
+    ci_low, ci_high = np.quantile(deltas, [alpha, 1 - alpha])
+    p_value = min(1.0, 2 * min(np.mean(deltas <= 0), np.mean(deltas >= 0)))
+    return {
+        'f_a': f_a,
+        'f_b': f_b,
+        'delta': f_b - f_a,
+        'ci_low': float(ci_low),
+        'ci_high': float(ci_high),
+        'p_value': float(p_value),
+    }
+
+def approximate_randomization(counts_a, counts_b, n_resamples: int = 10_000, beta: float = 0.5, seed: int | None = 0, batch_size: int = 500) -> dict:
+    """
+    Two-sided approximate randomization test for the F-score difference.
+
+    Each permutation swaps the outputs of the two systems on a random half of
+    the sentences; a batch of permutations is a 0/1 swap matrix applied to
+    the per-sentence count differences.
+
+    Args:
+        counts_a (array): (n, 3) per-sentence TP/FP/FN counts of system A
+        counts_b (array): (n, 3) per-sentence TP/FP/FN counts of system B
+        n_resamples (int): Number of random permutations
+        beta (float): Weight of recall in the F-score
+        seed (int, optional): Seed of the random generator
+        batch_size (int): Number of permutations drawn at a time
+
+    Returns:
+        dict: delta (f_b - f_a) and p_value
+    """
+    counts_a, counts_b = _check_counts(counts_a, counts_b)
+    n = len(counts_a)
+    rng = np.random.default_rng(seed)
+    total_a = counts_a.sum(axis=0)
+    total_b = counts_b.sum(axis=0)
+    diff = counts_b - counts_a
+    observed = abs(float(_corpus_f(total_b, beta) - _corpus_f(total_a, beta)))
+
+    at_least_as_extreme = 0
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        swaps = (rng.random((size, n)) < 0.5).astype(np.float64)
+        moved = swaps @ diff
+        deltas = _corpus_f(total_b - moved, beta) - _corpus_f(total_a + moved, beta)
+        at_least_as_extreme += int(np.sum(np.abs(deltas) >= observed - 1e-12))
+
+    return {
+        'delta': float(_corpus_f(total_b, beta) - _corpus_f(total_a, beta)),
+        'p_value': (at_least_as_extreme + 1) / (n_resamples + 1),
+    }
@@ -12,7 +12,7 @@ Features:
 - Streams requests from file, to avoid running out of memory for giant jobs
 - Makes requests concurrently, to maximize throughput
 - Throttles request and token usage, to stay under rate limits
-- Retries failed requests up to {max_attempts} times, to avoid missing data
+- Retries failed requests up to {max_attempts} times, each after its own jittered backoff, to avoid missing data
 - Logs errors, to diagnose problems with requests
 
 Example command to call script:
@@ -45,17 +45,19 @@ Inputs:
     - URL of the API endpoint to call
     - if omitted, will default to "https://api.openai.com/v1/embeddings"
 - api_key : str, optional
-    - API key to use
+    - API key to use, or several comma separated keys to balance the requests over (see lib/key_pool.py);
+      a key may be followed by ':' and the organization to bill
     - if omitted, the script will attempt to read it from an environment variable {os.getenv("OPENAI_API_KEY")}
 - max_requests_per_minute : float, optional
-    - target number of requests to make per minute (will make less if limited by tokens)
-    - leave headroom by setting this to 50% or 75% of your limit
+    - starting number of requests to make per minute and per key (will make less if limited by tokens)
+    - the x-ratelimit-limit-requests header of the responses replaces it with your actual limit,
+      so there is no need to leave headroom
     - if requests are limiting you, try batching multiple embeddings or completions into one request
-    - if omitted, will default to 1,500
+    - if omitted, will default to 3,000
 - max_tokens_per_minute : float, optional
-    - target number of tokens to use per minute (will use less if limited by requests)
-    - leave headroom by setting this to 50% or 75% of your limit
-    - if omitted, will default to 125,000
+    - starting number of tokens to use per minute and per key (will use less if limited by requests)
+    - the x-ratelimit-limit-tokens header of the responses replaces it with your actual limit
+    - if omitted, will default to 250,000
 - token_encoding_name : str, optional
     - name of the token encoding used, as defined in the `tiktoken` package
     - if omitted, will default to "cl100k_base" (used by `text-embedding-ada-002`)
@@ -76,16 +78,21 @@ The script is structured as follows:
         - Initialize things
         - In main loop:
             - Get next request if one is not already waiting for capacity
-            - Update available token & request capacity
-            - If enough capacity available, call API
-            - The loop pauses if a rate limit error is hit
+            - If no request is waiting, sleep until a task finishes or queues a retry
+            - Otherwise sleep until the request & token buckets (lib/rate_limiter.py) of an API key can afford it,
+              then call API with the key that can send it soonest (lib/key_pool.py)
+            - The buckets of each key follow the x-ratelimit-* headers of its responses and shrink (AIMD) on rate limit errors
+            - Keys that keep failing are put aside for a while, and keys the API refuses are disabled
+            - Failed requests are retried after their own jittered backoff (or Retry-After), unless the error is fatal
             - The loop breaks when no tasks remain
     - Define dataclasses
         - StatusTracker (stores script metadata counters; only one instance is created)
         - APIRequest (stores API inputs, outputs, metadata; one method to call API)
     - Define functions
         - api_endpoint_from_url (extracts API endpoint from request URL)
-        - append_to_jsonl (writes to results file)
+        - AsyncJsonlWriter (lib/io.py, single task writing the results file)
+        - response_is_truncated (whether a completion was cut short by max_tokens)
+        - num_tokens_estimated_from_request (token usage from the prompt length, with a completion estimator)
         - num_tokens_consumed_from_request (bigger function to infer token usage from request)
         - task_id_generator_function (yields 1, 2, 3, ...)
     - Run main()
@@ -95,12 +102,19 @@ The script is structured as follows:
 import aiohttp  # for making API calls concurrently
 import argparse  # for running script from command line
 import asyncio  # for running API calls concurrently
-import json  # for saving results to a jsonl file
 import logging  # for logging rate limit warnings and other messages
 import os  # for reading API key
 import re  # for matching endpoint from request URL
 import tiktoken  # for counting tokens
 import time  # for sleeping after rate limit is hit
+from lib.http_transport import HttpTransport  # for pooled connections shared across runs
+from lib.io import AsyncJsonlWriter, loads, open_file  # for reading requests and saving results
+from lib.checkpoint import RequestCheckpoint  # for resuming interrupted runs
+from lib.jsonl_index import JsonlIndex  # for reading selected lines of the requests file
+from lib.key_pool import KeyPool, PooledKey, is_key_error, parse_api_keys  # for balancing requests over API keys
+from lib.prompts import render_request  # for rendering compact records into chat requests
+from lib.retry import RetryQueue, backoff_delay, is_retryable  # for retrying failed requests
+from lib.token_counter import load_token_counts  # for reading precomputed prompt token counts
 from dataclasses import (
     dataclass,
     field,
@@ -118,156 +132,241 @@ async def process_api_requests_from_file_openai(
     max_attempts: int,
     logging_level: int,
     additional_params: object,
+    on_results=None,
+    line_numbers=None,
+    completion_estimator=None,
+    transport=None,
+    api_keys=None,
 ):
-    """Processes API requests in parallel, throttling to stay under rate limits."""
-    # constants
-    seconds_to_pause_after_rate_limit_error = 15
-    seconds_to_sleep_each_loop = (
-        0.001  # 1 ms limits max throughput to 1,000 requests per second
-    )
-
+    """Processes API requests in parallel, throttling to stay under rate limits.
+
+    `line_numbers`, if given, selects the lines of the requests file to
+    process (see lib/jsonl_index.py); they are read by seeking, without
+    copying the file. `on_results`, if given, is called by the results writer with batches of
+    (result, latency in seconds) pairs, e.g. to store them in a ResultsStore.
+    `completion_estimator`, if given (see lib/token_counter.py), budgets the
+    completion of each chat request by its prompt length instead of by
+    max_tokens, and sets max_tokens to a cap derived from it when the request
+    has none; it needs precomputed token counts. A response cut short by that
+    cap (finish_reason "length") is sent once more without it.
+
+    Progress is checkpointed next to the results file (see lib/checkpoint.py):
+    a run over the same requests after a crash keeps the results saved so far
+    and only sends the requests that are missing or failed. The checkpoint is
+    removed once every request succeeded.
+
+    `transport` (see lib/http_transport.py), if given, is the pooled session
+    to send the requests with; it is left open, so that the next run reuses
+    its connections. Otherwise a transport is opened for this run only.
+
+    `api_keys`, if given, is a list of API keys (or "key:organization") used
+    instead of `api_key`. Each key gets its own request and token budgets,
+    starting from the max_*_per_minute ones, and every request goes to the
+    key that can send it soonest (see lib/key_pool.py), so the throughput
+    adds up over the keys and one throttled key does not hold back the run.
+    """
     # initialize logging
     logging.basicConfig(level=logging_level)
     logging.debug(f"Logging initialized at level {logging_level}")
 
-    # infer API endpoint and construct request header
+    # infer API endpoint
     api_endpoint = api_endpoint_from_url(request_url)
-    request_header = {"Authorization": f"Bearer {api_key}"}
+
+    # use the prompt token counts precomputed by lib/token_counter.py when they are up to date
+    token_counts = (
+        load_token_counts(requests_filepath, token_encoding_name)
+        if api_endpoint.startswith("chat/")
+        else None
+    )
+    if token_counts is None:
+        logging.debug("No precomputed token counts, counting tokens at send time")
+        if completion_estimator is not None:
+            logging.warning("The completion estimator needs precomputed token counts, budgeting max_tokens instead")
+            completion_estimator = None
 
     # initialize trackers
-    queue_of_requests_to_retry = asyncio.Queue()
+    queue_of_requests_to_retry = RetryQueue()  # ordered by the time each retry is due
     task_id_generator = (
         task_id_generator_function()
-    )  # generates integer IDs of 1, 2, 3, ...
+    )  # generates integer IDs of 0, 1, 2, ...
     status_tracker = (
         StatusTracker()
     )  # single instance to track a collection of variables
     next_request = None  # variable to hold the next request to call
 
-    # initialize available capacity counts
-    available_request_capacity = max_requests_per_minute
-    available_token_capacity = max_tokens_per_minute
-    last_update_time = time.time()
+    # initialize available capacity, per API key; the buckets refill continuously
+    # and follow the rate limit headers of the responses to their key
+    key_pool = KeyPool.from_api_keys(
+        parse_api_keys(api_keys if api_keys is not None else [api_key]),
+        max_requests_per_minute,
+        max_tokens_per_minute,
+    )
+    logging.debug(f"Balancing requests over {len(key_pool)} API key(s)")
 
     # initialize flags
     file_not_finished = True  # after file is empty, we'll skip reading it
     logging.debug(f"Initialization complete.")
 
-    # initialize file reading
-    with open(requests_filepath) as file:
-        # `requests` will provide requests one at a time
-        requests = file.__iter__()
-        logging.debug(f"File opened. Entering main loop")
-        async with aiohttp.ClientSession() as session:  # Initialize ClientSession here
-            while True:
-                # get next request (if one is not already waiting for capacity)
-                if next_request is None:
-                    if not queue_of_requests_to_retry.empty():
-                        next_request = queue_of_requests_to_retry.get_nowait()
-                        logging.debug(
-                            f"Retrying request {next_request.task_id}: {next_request}"
-                        )
-                    elif file_not_finished:
-                        try:
-                            # get new request
-                            request_json = json.loads(next(requests))
-                            request_json.update(additional_params)
-                            next_request = APIRequest(
-                                task_id=next(task_id_generator),
-                                request_json=request_json,
-                                token_consumption=num_tokens_consumed_from_request(
-                                    request_json, api_endpoint, token_encoding_name
-                                ),
-                                attempts_left=max_attempts,
-                                metadata=request_json.pop("metadata", None),
-                            )
-                            status_tracker.num_tasks_started += 1
-                            status_tracker.num_tasks_in_progress += 1
+    # initialize the checkpoint: the results of an interrupted run are kept,
+    # and only the requests that are missing or failed are sent again
+    checkpoint = RequestCheckpoint(save_filepath, requests_filepath, additional_params)
+    completed_lines = checkpoint.recover()
+    checkpoint.open()
+
+    # initialize the HTTP transport; a shared one keeps its connections warm across runs
+    owns_transport = transport is None
+    if owns_transport:
+        transport = HttpTransport()
+
+    def on_batch(batch):
+        # called by the results writer right after it wrote the batch
+        checkpoint.record((line_number, ok) for _, (line_number, ok, _) in batch)
+        if on_results is not None:
+            on_results([(result, latency) for result, (_, _, latency) in batch])
+
+    try:
+        # initialize file reading
+        with open_file(requests_filepath, "rb") as file:
+            # `requests` will provide (line number, request) pairs one at a time
+            # skipping the requests that already have a successful result
+            requests = (
+                ((i, line) for i, line in enumerate(file) if i not in completed_lines)
+                if line_numbers is None
+                else JsonlIndex(requests_filepath).iter_lines(
+                    [i for i in line_numbers if i not in completed_lines]
+                )
+            )
+            logging.debug(f"File opened. Entering main loop")
+            # a single writer task owns the results file and batches the writes
+            session = await transport.session()
+            async with AsyncJsonlWriter(
+                save_filepath, mode="a", on_batch=on_batch
+            ) as result_writer:
+                while True:
+                    # cleared before looking for work, so a task finishing or a
+                    # retry being queued from now on wakes the loop up again
+                    status_tracker.wakeup.clear()
+
+                    # get next request (if one is not already waiting for capacity)
+                    if next_request is None:
+                        next_request = queue_of_requests_to_retry.pop_due()
+                        if next_request is not None:
                             logging.debug(
-                                f"Reading request {next_request.task_id}: {next_request}"
+                                f"Retrying request {next_request.task_id}: {next_request}"
                             )
-                        except StopIteration:
-                            # if file runs out, set flag to stop reading it
-                            logging.debug("Read file exhausted")
-                            file_not_finished = False
-
-                # update available capacity
-                current_time = time.time()
-                seconds_since_update = current_time - last_update_time
-                available_request_capacity = min(
-                    available_request_capacity
-                    + max_requests_per_minute * seconds_since_update / 60.0,
-                    max_requests_per_minute,
-                )
-                available_token_capacity = min(
-                    available_token_capacity
-                    + max_tokens_per_minute * seconds_since_update / 60.0,
-                    max_tokens_per_minute,
-                )
-                last_update_time = current_time
-
-                # if enough capacity available, call API
-                if next_request:
-                    next_request_tokens = next_request.token_consumption
-                    if (
-                        available_request_capacity >= 1
-                        and available_token_capacity >= next_request_tokens
-                    ):
-                        # update counters
-                        available_request_capacity -= 1
-                        available_token_capacity -= next_request_tokens
-                        next_request.attempts_left -= 1
-
-                        # call API
-                        asyncio.create_task(
-                            next_request.call_api(
-                                session=session,
-                                request_url=request_url,
-                                request_header=request_header,
-                                retry_queue=queue_of_requests_to_retry,
-                                save_filepath=save_filepath,
-                                status_tracker=status_tracker,
+                        elif file_not_finished:
+                            try:
+                                # get new request
+                                line_number, line = next(requests)
+                                request_json = loads(line)
+                                request_json.update(additional_params)
+                                metadata = request_json.pop("metadata", None)
+                                task_id = next(task_id_generator)
+                                capped = completion_estimator is not None and "max_tokens" not in request_json
+                                if completion_estimator is not None:
+                                    token_consumption = num_tokens_estimated_from_request(
+                                        request_json, token_counts["prompt_tokens"][line_number], completion_estimator
+                                    )
+                                elif token_counts is not None:
+                                    token_consumption = token_counts["prompt_tokens"][
+                                        line_number
+                                    ] + num_completion_tokens(request_json)
+                                else:
+                                    token_consumption = num_tokens_consumed_from_request(
+                                        render_request(request_json), api_endpoint, token_encoding_name
+                                    )
+                                next_request = APIRequest(
+                                    task_id=task_id,
+                                    request_json=request_json,
+                                    token_consumption=token_consumption,
+                                    attempts_left=max_attempts,
+                                    metadata=metadata,
+                                    line_number=line_number,
+                                    capped=capped,
+                                )
+                                status_tracker.num_tasks_started += 1
+                                status_tracker.num_tasks_in_progress += 1
+                                logging.debug(
+                                    f"Reading request {next_request.task_id}: {next_request}"
+                                )
+                            except StopIteration:
+                                # if file runs out, set flag to stop reading it
+                                logging.debug("Read file exhausted")
+                                file_not_finished = False
+
+                    if next_request is None:
+                        # if all tasks are finished, break
+                        if status_tracker.num_tasks_in_progress == 0:
+                            break
+                        # otherwise sleep until a task finishes or queues a retry,
+                        # or until the next retry is due
+                        try:
+                            await asyncio.wait_for(
+                                status_tracker.wakeup.wait(),
+                                queue_of_requests_to_retry.time_until_due(),
                             )
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+
+                    # sleep exactly until a key has capacity for the next request
+                    key, seconds_to_wait = key_pool.select(next_request.token_consumption)
+                    if seconds_to_wait > 0:
+                        await asyncio.sleep(seconds_to_wait)
+                        continue
+
+                    # update counters
+                    key.limiter.consume(next_request.token_consumption)
+                    key.num_requests += 1
+                    next_request.attempts_left -= 1
+
+                    # call API
+                    asyncio.create_task(
+                        next_request.call_api(
+                            session=session,
+                            request_url=request_url,
+                            key=key,
+                            key_pool=key_pool,
+                            retry_queue=queue_of_requests_to_retry,
+                            result_writer=result_writer,
+                            status_tracker=status_tracker,
                         )
-                        next_request = None  # reset next_request to empty
-
-                # if all tasks are finished, break
-                if status_tracker.num_tasks_in_progress == 0:
-                    break
-
-                # main loop sleeps briefly so concurrent tasks can run
-                await asyncio.sleep(seconds_to_sleep_each_loop)
-
-                # if a rate limit error was hit recently, pause to cool down
-                seconds_since_rate_limit_error = (
-                    time.time() - status_tracker.time_of_last_rate_limit_error
-                )
-                if (
-                    seconds_since_rate_limit_error
-                    < seconds_to_pause_after_rate_limit_error
-                ):
-                    remaining_seconds_to_pause = (
-                        seconds_to_pause_after_rate_limit_error
-                        - seconds_since_rate_limit_error
                     )
-                    await asyncio.sleep(remaining_seconds_to_pause)
-                    # ^e.g., if pause is 15 seconds and final limit was hit 5 seconds ago
-                    logging.warn(
-                        f"Pausing to cool down until {time.ctime(status_tracker.time_of_last_rate_limit_error + seconds_to_pause_after_rate_limit_error)}"
-                    )
-
-        # after finishing, log final status
+                    next_request = None  # reset next_request to empty
+
+                    # let the new task start before dispatching the next one
+                    await asyncio.sleep(0)
+    finally:
+        checkpoint.close()
+        if owns_transport:
+            await transport.close()
+    if status_tracker.num_tasks_failed == 0:
+        # every request has a successful result: the results file is complete
+        checkpoint.remove()
+
+    # after finishing, log final status
+    logging.info(
+        f"""Parallel processing complete. Results saved to {save_filepath}"""
+    )
+    if status_tracker.num_tasks_failed > 0:
+        logging.warning(
+            f"{status_tracker.num_tasks_failed} / {status_tracker.num_tasks_started} requests failed. Errors logged to {save_filepath}."
+        )
+    if status_tracker.num_rate_limit_errors > 0:
+        logging.warning(
+            f"{status_tracker.num_rate_limit_errors} rate limit errors received. Budgets per minute adapted to {key_pool.capacity}."
+        )
+    if status_tracker.num_uncapped_retries > 0:
         logging.info(
-            f"""Parallel processing complete. Results saved to {save_filepath}"""
+            f"{status_tracker.num_uncapped_retries} responses cut short by the max_tokens cap of the completion estimator were sent again without it."
         )
-        if status_tracker.num_tasks_failed > 0:
-            logging.warning(
-                f"{status_tracker.num_tasks_failed} / {status_tracker.num_tasks_started} requests failed. Errors logged to {save_filepath}."
-            )
-        if status_tracker.num_rate_limit_errors > 0:
-            logging.warning(
-                f"{status_tracker.num_rate_limit_errors} rate limit errors received. Consider running at a lower rate."
-            )
+    if status_tracker.num_truncated > 0:
+        logging.warning(
+            f"{status_tracker.num_truncated} / {status_tracker.num_tasks_succeeded} responses were cut short by max_tokens and saved truncated."
+        )
+    if len(key_pool) > 1:
+        logging.info(f"Requests sent per API key: { {key.name: key.num_requests for key in key_pool.keys} }")
+    logging.info(f"HTTP transport: {transport.metrics()}")
 
 
 # dataclasses
@@ -284,7 +383,11 @@ class StatusTracker:
     num_rate_limit_errors: int = 0
     num_api_errors: int = 0  # excluding rate limit errors, counted above
     num_other_errors: int = 0
-    time_of_last_rate_limit_error: int = 0  # used to cool off after hitting rate limits
+    num_uncapped_retries: int = 0  # responses cut short by the estimated cap, sent again without it
+    num_truncated: int = 0  # responses cut short by max_tokens, saved as they are
+    wakeup: asyncio.Event = field(
+        default_factory=asyncio.Event
+    )  # set when a task finishes or is queued for a retry, to wake up the main loop
 
 
 @dataclass
@@ -296,37 +399,64 @@ class APIRequest:
     token_consumption: int
     attempts_left: int
     metadata: dict
+    line_number: int  # in the requests file, recorded in the checkpoint
+    capped: bool = False  # max_tokens was set by the completion estimator
     result: list = field(default_factory=list)
 
     async def call_api(
         self,
         session: aiohttp.ClientSession,
         request_url: str,
-        request_header: dict,
-        retry_queue: asyncio.Queue,
-        save_filepath: str,
+        key: PooledKey,
+        key_pool: KeyPool,
+        retry_queue: RetryQueue,
+        result_writer: AsyncJsonlWriter,
         status_tracker: StatusTracker,
     ):
         """Calls the OpenAI API and saves results."""
         logging.info(f"Starting request #{self.task_id}")
         error = None
+        status = None
+        retry_after = None
+        start_time = time.time()
         try:
+            # compact records are rendered into full messages only when sent;
+            # the compact form is what gets saved with the response
             async with session.post(
-                url=request_url, headers=request_header, json=self.request_json
-            ) as response:
-                response = await response.json()
+                url=request_url, headers=key.headers, json=render_request(self.request_json)
+            ) as http_response:
+                status = http_response.status
+                headers = http_response.headers
+                response = await http_response.json()
+            key.limiter.update(headers)
             if "error" in response:
                 logging.warning(
                     f"Request {self.task_id} failed with error {response['error']}"
                 )
                 status_tracker.num_api_errors += 1
                 error = response
-                if "Rate limit" in response["error"].get("message", ""):
-                    status_tracker.time_of_last_rate_limit_error = time.time()
+                retry_after = key.limiter.retry_after(headers)
+                if is_key_error(status, response["error"]):
+                    # checked first: an exhausted quota also comes as a 429, but waiting does not help
+                    if key_pool.disable(key, response["error"]):
+                        # not the request's fault: send it again right away with another key
+                        self.attempts_left += 1
+                        retry_queue.push(self)
+                        status_tracker.wakeup.set()
+                        return
+                elif status == 429 or "Rate limit" in response["error"].get("message", ""):
+                    key.limiter.on_rate_limit()
                     status_tracker.num_rate_limit_errors += 1
                     status_tracker.num_api_errors -= (
                         1  # rate limit errors are counted separately
                     )
+                    if key_pool.can_send_elsewhere(key, self.token_consumption):
+                        # the wait asked for only applies to this key
+                        retry_after = None
+                elif status is not None and status >= 500:
+                    key_pool.on_failure(key)
+            else:
+                key.on_success()
 
         except (
             Exception
@@ -334,32 +464,57 @@ class APIRequest:
             logging.warning(f"Request {self.task_id} failed with Exception {e}")
             status_tracker.num_other_errors += 1
             error = e
+            key_pool.on_failure(key)
         if error:
             self.result.append(error)
-            if self.attempts_left:
-                retry_queue.put_nowait(self)
+            retryable = is_retryable(status, error.get("error") if isinstance(error, dict) else error)
+            if self.attempts_left and retryable:
+                # only this request waits: its own backoff, or as long as the API asks
+                delay = max(backoff_delay(len(self.result) - 1), retry_after or 0.0)
+                logging.debug(f"Retrying request {self.task_id} in {delay:.2f} s")
+                retry_queue.push(self, delay)
             else:
                 logging.error(
-                    f"Request {self.request_json} failed after all attempts. Saving errors: {self.result}"
+                    f"Request {self.request_json} failed after {len(self.result)} attempts"
+                    f"{'' if retryable else ' with an error that is not retryable'}. Saving errors: {self.result}"
                 )
                 data = (
                     [self.request_json, [str(e) for e in self.result], self.metadata]
                     if self.metadata
                     else [self.request_json, [str(e) for e in self.result]]
                 )
-                append_to_jsonl(data, save_filepath)
+                result_writer.put(data, key=self.task_id, info=(self.line_number, False, time.time() - start_time))
                 status_tracker.num_tasks_in_progress -= 1
                 status_tracker.num_tasks_failed += 1
         else:
+            if response_is_truncated(response):
+                if self.capped:
+                    # the estimated cap was too low for this sentence: send it once more without it
+                    logging.warning(
+                        f"Request {self.task_id} was cut short by max_tokens={self.request_json['max_tokens']}, retrying without the cap"
+                    )
+                    del self.request_json["max_tokens"]
+                    self.capped = False
+                    self.attempts_left += 1  # not the request's fault
+                    status_tracker.num_uncapped_retries += 1
+                    retry_queue.push(self)
+                    status_tracker.wakeup.set()
+                    return
+                logging.warning(f"Request {self.task_id} was cut short by max_tokens, saving the truncated response")
+                status_tracker.num_truncated += 1
             data = (
                 [self.request_json, response, self.metadata]
                 if self.metadata
                 else [self.request_json, response]
             )
-            append_to_jsonl(data, save_filepath)
+            if result_writer.put(data, key=self.task_id, info=(self.line_number, True, time.time() - start_time)):
+                logging.debug(f"Request {self.task_id} queued for {result_writer.file_path}")
+            else:
+                logging.warning(f"Request {self.task_id} was already saved, dropping duplicate result")
             status_tracker.num_tasks_in_progress -= 1
             status_tracker.num_tasks_succeeded += 1
-            logging.debug(f"Request {self.task_id} saved to {save_filepath}")
+        # a retry is queued or a task is done: the main loop may have work again
+        status_tracker.wakeup.set()
 
 
 # functions
@@ -367,15 +522,28 @@ class APIRequest:
 
 def api_endpoint_from_url(request_url):
     """Extract the API endpoint from the request URL."""
-    match = re.search("^https://[^/]+/v\\d+/(.+)$", request_url)
+    match = re.search("^https?://[^/]+/v\\d+/(.+)$", request_url)
     return match[1]
 
 
-def append_to_jsonl(data, filename: str) -> None:
-    """Append a json payload to the end of a jsonl file."""
-    json_string = json.dumps(data)
-    with open(filename, "a") as f:
-        f.write(json_string + "\n")
+def response_is_truncated(response: dict):
+    """Whether a completion was cut short by max_tokens."""
+    return any(choice.get("finish_reason") == "length" for choice in response.get("choices", []))
+
+
+def num_completion_tokens(request_json: dict):
+    """Count the completion tokens budgeted for a completions request."""
+    max_tokens = request_json.get("max_tokens", 15)
+    n = request_json.get("n", 1)
+    return n * max_tokens
+
+
+def num_tokens_estimated_from_request(request_json: dict, prompt_tokens: int, completion_estimator):
+    """Count the prompt tokens plus the expected completion tokens of a chat request.
+    Sets max_tokens to the cap of the estimator if the request has none."""
+    request_json.setdefault("max_tokens", completion_estimator.max_tokens(prompt_tokens))
+    completion_tokens = min(completion_estimator.estimate(prompt_tokens), request_json["max_tokens"])
+    return prompt_tokens + request_json.get("n", 1) * completion_tokens
 
 
 def num_tokens_consumed_from_request(
@@ -387,9 +555,7 @@ def num_tokens_consumed_from_request(
     encoding = tiktoken.get_encoding(token_encoding_name)
     # if completions request, tokens = prompt + n * max_tokens
     if api_endpoint.endswith("completions"):
-        max_tokens = request_json.get("max_tokens", 15)
-        n = request_json.get("n", 1)
-        completion_tokens = n * max_tokens
+        completion_tokens = num_completion_tokens(request_json)
 
         # chat completions
         if api_endpoint.startswith("chat/"):
@@ -458,8 +624,8 @@ if __name__ == "__main__":
     # parser.add_argument("--request_url", default="https://api.openai.com/v1/embeddings")
     parser.add_argument("--request_url", default="https://api.openai.com/v1/chat/completions")
     parser.add_argument("--api_key", default=os.getenv("OPENAI_API_KEY"))
-    parser.add_argument("--max_requests_per_minute", type=int, default=3_000 * 0.5)
-    parser.add_argument("--max_tokens_per_minute", type=int, default=250_000 * 0.5)
+    parser.add_argument("--max_requests_per_minute", type=int, default=3_000)
+    parser.add_argument("--max_tokens_per_minute", type=int, default=250_000)
     parser.add_argument("--token_encoding_name", default="cl100k_base")
     parser.add_argument("--max_attempts", type=int, default=5)
     parser.add_argument("--logging_level", default=logging.INFO)
@@ -0,0 +1,120 @@
+import os
+import hashlib
+import logging
+from typing import Any, Iterable, Set
+
+from lib.io import JsonlWriter, dumps_bytes, is_compressed, loads, read_intact, split_ext
+from lib.utils import backup_output_file
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_file(results_file: str) -> str:
+    return split_ext(results_file)[0] + "_checkpoint.jsonl"
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 24) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RequestCheckpoint:
+    """Line numbers of the requests whose results are in a results file, to resume a run after a crash.
+
+    The processor appends a [line number, ok] entry for every result right
+    after the result itself is written, so the entries always describe the
+    first results of the file. On recovery, results written after the last
+    entry (and a line cut short by the crash) are truncated, and failed
+    results are dropped, so that their requests are sent again. The first
+    line identifies the job (the content of the requests file and the
+    parameters added to every request); the results of another job, or
+    results without a checkpoint, are backed up instead of being resumed.
+
+    A compressed (.gz, .zst) results file is written in the background, so
+    its entries may run ahead of the data on disk; it is read back up to the
+    last block that can be decompressed, and always rewritten on recovery.
+    """
+
+    def __init__(self, results_file: str, requests_file: str, params: Any = None) -> None:
+        self.results_file = results_file
+        self.file_path = checkpoint_file(results_file)
+        self.job = {"requests": file_digest(requests_file), "params": params or {}}
+        self._writer: JsonlWriter | None = None
+
+    def recover(self) -> Set[int]:
+        """Reconcile the results file with the checkpoint
+        Returns: set, the line numbers of the requests with a successful result
+        """
+        if not os.path.exists(self.file_path):
+            self._set_aside("has no checkpoint")
+            return set()
+        lines = self._complete_lines(self.file_path)
+        if not lines or loads(lines[0]) != self.job:
+            self._set_aside("belongs to another job")
+            return set()
+        entries = [loads(line) for line in lines[1:]]
+
+        results = self._complete_lines(self.results_file) if os.path.exists(self.results_file) else []
+        # the checkpoint may lag behind the results file, or the other way around after a system crash
+        count = min(len(entries), len(results))
+        kept = [(entry, result) for entry, result in zip(entries[:count], results[:count]) if entry[1]]
+        if len(kept) == count and not is_compressed(self.results_file):
+            # nothing failed: only cut the unsaved tail, the results stay in place
+            if os.path.exists(self.results_file):
+                os.truncate(self.results_file, sum(len(result) for result in results[:count]))
+        else:
+            # a compressed file cannot be cut at a line, so it is rewritten as well
+            base_name, ext = split_ext(self.results_file)
+            with JsonlWriter(base_name + ".tmp" + ext) as writer:
+                for _, result in kept:
+                    writer.write_line(result)
+            os.replace(base_name + ".tmp" + ext, self.results_file)
+        # rewritten in any case, which also drops an entry cut short by the crash
+        self._rewrite([entry for entry, _ in kept])
+
+        logger.info(f"Resuming {self.results_file}: {len(kept)} results kept, {count - len(kept)} failed "
+                    f"and {len(results) - count} unsaved results dropped")
+        return {line_number for (line_number, _), _ in kept}
+
+    @staticmethod
+    def _complete_lines(file_path: str) -> list[bytes]:
+        return [line + b'\n' for line in read_intact(file_path).split(b'\n')[:-1]]
+
+    def _set_aside(self, reason: str) -> None:
+        if os.path.exists(self.results_file) and os.path.getsize(self.results_file) > 0:
+            backup_file = backup_output_file(self.results_file)
+            logger.warning(f"{self.results_file} {reason}, backed up to {backup_file} before starting over")
+        elif os.path.exists(self.results_file):
+            os.remove(self.results_file)
+        self._rewrite([])
+
+    def _rewrite(self, entries: Iterable) -> None:
+        with JsonlWriter(self.file_path + ".tmp") as writer:
+            writer.write(self.job)
+            for entry in entries:
+                writer.write(entry)
+        os.replace(self.file_path + ".tmp", self.file_path)
+
+    def open(self) -> "RequestCheckpoint":
+        self._writer = JsonlWriter(self.file_path, 'a')
+        return self
+
+    def record(self, entries: Iterable[tuple[int, bool]]) -> None:
+        """Append (line number, ok) entries of results that were just written"""
+        for line_number, ok in entries:
+            self._writer.write_line(dumps_bytes([line_number, ok]))
+        self._writer.flush()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def remove(self) -> None:
+        """Forget the checkpoint once every request succeeded; the results file is then complete"""
+        self.close()
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
@@ -3,64 +3,106 @@ import re
 import pandas as pd
 import logging
 import os
-from typing import List, Dict, Tuple
+from typing import Iterable, Iterator, List, Dict, Tuple
+from lib.io import loads, open_file
+from lib.results_store import ResultsStore
+from lib.stage_cache import StageCache
 
 logger = logging.getLogger(__name__)
 
 class DataFormatter:
-    def __init__(self, config) -> None:
+    def __init__(self, config, results_store: ResultsStore | None = None) -> None:
         self.config = config
+        # When given, results are read from the store (in sentence order) instead of the jsonl files,
+        # except for models it has no results of
+        self.results_store = results_store
         
-    def run(self, file_pairs: List[Tuple[str, str, str]], skip_if_exists: bool = True):
+    def run(self, file_pairs: List[Tuple[str, str, str]], skip_if_exists: bool = True, cache: StageCache | None = None, force: bool = False):
         """Main method to run the formatting process"""
         # Create output directory if it doesn't exist
         os.makedirs(self.config.excel_output_dir, exist_ok=True)
         
         for model_name, input_file_jsonl, output_file_excel in file_pairs:
-            if skip_if_exists and os.path.exists(output_file_excel):
+            # models run outside of the store's pipeline (e.g. by C01 under another name) have no rows
+            # in it, and are formatted from their jsonl file
+            from_store = (self.results_store is not None
+                          and self.results_store.stats(self.config.run_id, model_name)["results"] > 0)
+            if (cache is None or from_store) and skip_if_exists and os.path.exists(output_file_excel):
                 logger.info(f"Skipping {output_file_excel} because it already exists.")
                 continue
+            if from_store:
+                # a live WAL database cannot be hashed reliably, so the stage cache is not used here
+                self.format_results(
+                    model_name=model_name,
+                    result_file=input_file_jsonl,
+                    output_file=output_file_excel,
+                    results=self.results_store.iter_results(self.config.run_id, model_name)
+                )
+                continue
             if not os.path.exists(input_file_jsonl):
                 logger.warning(f"Input file {input_file_jsonl} does not exist.")
                 continue
-            self.format_results(
+            format_func = lambda: self.format_results(
                 model_name=model_name,
                 result_file=input_file_jsonl,
                 output_file=output_file_excel
             )
+            if cache is None:
+                format_func()
+            else:
+                cache.run(
+                    f"format_results:{model_name}",
+                    format_func,
+                    inputs=[input_file_jsonl],
+                    outputs=[output_file_excel],
+                    code=[DataFormatter],
+                    force=force
+                )
+
+    def format_results(self, model_name: str, result_file: str, output_file: str, results: Iterable[List] | None = None):
+        """Format results from a jsonl file, or the given [request, response, metadata] results, into an Excel file"""
+        # results from the store come in sentence order, those of a file in completion order
+        sort_by_id = results is None
+        if results is None:
+            if not os.path.exists(result_file):
+                logger.warning(f"Result file {result_file} does not exist.")
+                return
+            results = self._iter_result_file(result_file)
 
-    def format_results(self, model_name: str, result_file: str, output_file: str):
-        """Format results from a jsonl file into an Excel file"""
-        if not os.path.exists(result_file):
-            logger.warning(f"Result file {result_file} does not exist.")
-            return
-            
-        # Read and process the results
-        results = []
+        # Process the results
+        rows = []
         error_count = 0
-        with open(result_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    # Each line contains [request, response, metadata]
-                    data = json.loads(line)
-                    result = self._process_result(model_name, data)
-                    results.append(result)
-                    if result.get(f'{model_name}_error', "") != "":
-                        error_count += 1
-                except Exception as e:
-                    logger.error(f"Error processing line: {e}")
-                    continue
+        for data in results:
+            try:
+                result = self._process_result(model_name, data)
+                rows.append(result)
+                if result.get(f'{model_name}_error', "") != "":
+                    error_count += 1
+            except Exception as e:
+                logger.error(f"Error processing line: {e}")
+                continue
         
         logger.info(f"Error count: {error_count}")
         # Convert to DataFrame and save
-        if results:
-            df = pd.DataFrame(results)
-            df.sort_values(by='id', inplace=True)
+        if rows:
+            df = pd.DataFrame(rows)
+            if sort_by_id:
+                df.sort_values(by='id', inplace=True)
             df.to_excel(output_file, index=False)
             logger.info(f"Results saved to {output_file}")
         else:
             logger.warning("No results to save")
 
+    def _iter_result_file(self, result_file: str) -> Iterator[List]:
+        with open_file(result_file, 'rb') as f:
+            for line in f:
+                try:
+                    # Each line contains [request, response, metadata]
+                    yield loads(line)
+                except Exception as e:
+                    logger.error(f"Error processing line: {e}")
+                    continue
+
     def _process_result(self, model_name: str, data: List) -> Dict:
         """Process a single result line"""
         request, response, metadata = data
@@ -87,6 +129,9 @@ class DataFormatter:
             except json.JSONDecodeError as e:
                 content = self.escape_quotes_in_json_values(content)
                 json_content = json.loads(content)
+            if isinstance(response, dict) and response.get('choices', [{}])[0].get('finish_reason') == 'length':
+                # a truncated correction is not scored as if it were complete
+                raise ValueError("Response cut short by max_tokens")
             llm_corrected = json_content.get('corrected', '')
         except Exception as e:
             logger.error(f"Error extracting {model_name} correction: {e}")
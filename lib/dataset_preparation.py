@@ -1,10 +1,13 @@
 import os
-import json
-import random
-from typing import Dict, List
+import hashlib
+from contextlib import contextmanager
+from itertools import zip_longest
+from typing import Dict, Iterator, List, Tuple
 import logging
-from lib.io import save_to_jsonl
-import settings
+from errant.corpus import M2Corpus
+from lib.io import dumps
+from lib.prompts import create_record
+from lib.stage_cache import StageCache
 
 logger = logging.getLogger(__name__)
 
@@ -12,33 +15,55 @@ class DatasetPreparation:
     def __init__(self, config) -> None:
         self.config = config
         
-    def run(self, skip_if_exist=True):
-        # Training data
-        self.prepare_train_val(
+    def run(self, skip_if_exist=True, cache: StageCache|None=None, force=False):
+        train_corpus_dir = getattr(self.config, "train_corpus_dir", None)
+        test_corpus_dir = getattr(self.config, "test_corpus_dir", None)
+        train_kwargs = dict(
             original_file=self.config.train_files["original"],
             corrected_file=self.config.train_files["corrected"],
             train_output_file=self.config.dataset_train_filename,
             val_output_file=self.config.dataset_val_filename,
-            skip_if_exist=skip_if_exist
+            corpus_dir=train_corpus_dir
         )
-        
-        # Validation data
-        # self.prepare_train_val(
-        #     original_file=self.config.val_files["original"],
-        #     corrected_file=self.config.val_files["corrected"],
-        #     output_file=self.config.dataset_val_filename,
-        #     skip_if_exist=skip_if_exist
-        # )
-
-        # Test data
-        self.prepare_test(
+        test_kwargs = dict(
             original_file=self.config.test_files["original"],
             corrected_file=self.config.test_files["corrected"],
             output_file=self.config.dataset_test_filename,
-            skip_if_exist=skip_if_exist 
+            corpus_dir=test_corpus_dir
         )
 
-    def prepare_train_val(self, original_file: str, corrected_file: str, train_output_file: str, val_output_file: str, skip_if_exist=True):
+        if cache is None:
+            # Training data
+            self.prepare_train_val(**train_kwargs, skip_if_exist=skip_if_exist)
+            # Test data
+            self.prepare_test(**test_kwargs, skip_if_exist=skip_if_exist)
+            return
+
+        # Re-run a stage only if its source sentences, settings or code changed
+        cache.run(
+            "prepare_train_val",
+            lambda: self.prepare_train_val(**train_kwargs, skip_if_exist=False),
+            inputs=[path for path in (train_kwargs["original_file"], train_kwargs["corrected_file"], train_corpus_dir) if path is not None],
+            outputs=[train_kwargs["train_output_file"], train_kwargs["val_output_file"]],
+            params={
+                "train_rate": self.config.train_rate,
+                "train_split_seed": getattr(self.config, "train_split_seed", 0),
+                "template_id": self.config.inference_prompt_template_id,
+            },
+            code=[DatasetPreparation],
+            force=force
+        )
+        cache.run(
+            "prepare_test",
+            lambda: self.prepare_test(**test_kwargs, skip_if_exist=False),
+            inputs=[path for path in (test_kwargs["original_file"], test_kwargs["corrected_file"], test_corpus_dir) if path is not None],
+            outputs=[test_kwargs["output_file"]],
+            params={"template_id": self.config.inference_prompt_template_id},
+            code=[DatasetPreparation],
+            force=force
+        )
+
+    def prepare_train_val(self, original_file: str, corrected_file: str, train_output_file: str, val_output_file: str, skip_if_exist=True, corpus_dir: str|None=None):
         if skip_if_exist and os.path.exists(train_output_file):
             logger.debug(f"Dataset {train_output_file} already exists, skip.")
             return
@@ -47,91 +72,111 @@ class DatasetPreparation:
             logger.debug(f"Dataset {val_output_file} already exists, skip.")
             return
             
-        if not os.path.exists(original_file):
-            logger.warning(f"Original file {original_file} does not exist.")
+        pairs = self.iter_sentence_pairs(original_file, corrected_file, corpus_dir)
+        if pairs is None:
             return
-        if not os.path.exists(corrected_file):
-            logger.warning(f"Corrected file {corrected_file} does not exist.")
-            return
-            
-        with open(original_file, 'r', encoding='utf-8') as f_orig, \
-             open(corrected_file, 'r', encoding='utf-8') as f_corr:
-            orig_lines = f_orig.readlines()
-            corr_lines = f_corr.readlines()
             
-        if len(orig_lines) != len(corr_lines):
-            raise ValueError("Original and corrected files have different number of lines")
+        # Stream the records into train and val, split by a hash of each sentence pair
+        train_count = 0
+        val_count = 0
+        with _atomic_open(train_output_file) as f_train, _atomic_open(val_output_file) as f_val:
+            for orig, corr in pairs:
+                orig, corr = orig.strip(), corr.strip()
+                record = self.create_chat_example(orig, corr, for_training=True)
+                if self.is_train_example(orig, corr):
+                    f_train.write(dumps(record) + '\n')
+                    train_count += 1
+                else:
+                    f_val.write(dumps(record) + '\n')
+                    val_count += 1
             
-        dataset = []
-        for orig, corr in zip(orig_lines, corr_lines):
-            record = self.create_chat_example(orig.strip(), corr.strip(), for_training=True)
-            dataset.append(record)
-        
-        # Split the dataset into train and val with random shuffle
-        random.shuffle(dataset)
-        train_size = int(len(dataset) * self.config.train_rate)
-        train_dataset = dataset[:train_size]
-        val_dataset = dataset[train_size:]
-            
-        save_to_jsonl(train_dataset, train_output_file)
-        save_to_jsonl(val_dataset, val_output_file)
-        logger.info(f"Created train dataset with {len(train_dataset)} examples in {train_output_file}")
-        logger.info(f"Created val dataset with {len(val_dataset)} examples in {val_output_file}")
+        logger.info(f"Created train dataset with {train_count} examples in {train_output_file}")
+        logger.info(f"Created val dataset with {val_count} examples in {val_output_file}")
 
-    def prepare_test(self, original_file: str, corrected_file: str, output_file: str, skip_if_exist=True):
+    def is_train_example(self, original: str, corrected: str) -> bool:
+        """Deterministically assign a sentence pair to the train split with probability `train_rate`"""
+        seed = getattr(self.config, "train_split_seed", 0)
+        digest = hashlib.sha256(f"{seed}\t{original}\t{corrected}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64 < self.config.train_rate
+
+    def prepare_test(self, original_file: str, corrected_file: str, output_file: str, skip_if_exist=True, corpus_dir: str|None=None):
         if skip_if_exist and os.path.exists(output_file):
             logger.debug(f"Dataset {output_file} already exists, skip.")
             return
             
+        pairs = self.iter_sentence_pairs(original_file, corrected_file, corpus_dir)
+        if pairs is None:
+            return
+
+        count = 0
+        with _atomic_open(output_file) as f_out:
+            for sentence_id, (orig, corr) in enumerate(pairs, start=1):
+                record = self.create_chat_example(
+                    original=orig.strip(), 
+                    corrected=corr.strip(), 
+                    for_training=False, 
+                    sentence_id=sentence_id
+                )
+                f_out.write(dumps(record) + '\n')
+                count += 1
+            
+        logger.info(f"Created dataset with {count} examples in {output_file}")
+
+    def iter_sentence_pairs(self, original_file: str, corrected_file: str, corpus_dir: str|None=None) -> Iterator[Tuple[str, str]]|None:
+        """Lazily read (original, corrected) pairs from the memory-mapped corpus if it exists, else from the txt files"""
+        if M2Corpus.exists(corpus_dir):
+            logger.debug(f"Reading sentences from corpus {corpus_dir}")
+            return M2Corpus(corpus_dir).iter_pairs()
+
         if not os.path.exists(original_file):
             logger.warning(f"Original file {original_file} does not exist.")
-            return
+            return None
         if not os.path.exists(corrected_file):
             logger.warning(f"Corrected file {corrected_file} does not exist.")
-            return
-            
-        with open(original_file, 'r', encoding='utf-8') as f_orig, \
-             open(corrected_file, 'r', encoding='utf-8') as f_corr:
-            orig_lines = f_orig.readlines()
-            corr_lines = f_corr.readlines()
-
-        dataset = []
-        sentence_id = 1
-        for orig, corr in zip(orig_lines, corr_lines):
-            record = self.create_chat_example(
-                original=orig.strip(), 
-                corrected=corr.strip(), 
-                for_training=False, 
-                sentence_id=sentence_id
-            )
-            dataset.append(record)
-            sentence_id += 1
-            
-        save_to_jsonl(dataset, output_file)
-        logger.info(f"Created dataset with {len(dataset)} examples in {output_file}")
+            return None
+        return _zip_lines(original_file, corrected_file)
+
+    def read_sentence_pairs(self, original_file: str, corrected_file: str, corpus_dir: str|None=None) -> List[Tuple[str, str]]|None:
+        """Read all (original, corrected) pairs, see `iter_sentence_pairs`"""
+        pairs = self.iter_sentence_pairs(original_file, corrected_file, corpus_dir)
+        return None if pairs is None else list(pairs)
 
     def create_chat_example(self, original: str, corrected: str|None, for_training: bool=True, sentence_id: int|None=None) -> Dict:
-        messages = [
-            {
-                "role": "user",
-                "content": settings.inference_prompt_template.format(original=original)
-            },
-        ]
-        
+        # Records reference the prompt template by id; the messages are rendered
+        # when the request is sent or the fine-tuning file is exported (see lib/prompts.py)
         if for_training:
-            if corrected is not None:
-                messages.append({
-                    "role": "assistant",
-                    "content": f'{{"corrected": "{corrected}"}}'
-                })
-            return {"messages": messages}
-        
+            return create_record(original, corrected)
+
+        record = create_record(original)
+        record["metadata"] = {
+            "sentence_id": sentence_id,
+            "original": original,
+            "corrected": corrected if corrected is not None else ""
+        }
+        return record
+
+
+def _zip_lines(original_file: str, corrected_file: str) -> Iterator[Tuple[str, str]]:
+    sentinel = object()
+    with open(original_file, 'r', encoding='utf-8') as f_orig, \
+         open(corrected_file, 'r', encoding='utf-8') as f_corr:
+        for orig, corr in zip_longest(f_orig, f_corr, fillvalue=sentinel):
+            if orig is sentinel or corr is sentinel:
+                raise ValueError("Original and corrected files have different number of lines")
+            yield orig, corr
+
 
-        return {
-            "messages": messages, 
-            "metadata": {
-                "sentence_id": sentence_id,
-                "original": original,
-                "corrected": corrected if corrected is not None else ""
-            }
-        } 
\ No newline at end of file
+@contextmanager
+def _atomic_open(file_path: str):
+    """Write to a temporary file and move it into place only if writing succeeds"""
+    path = os.path.dirname(file_path)
+    if path:
+        os.makedirs(path, exist_ok=True)
+    tmp_path = file_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            yield f
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
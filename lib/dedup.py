@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable
+
+from lib.io import JsonlWriter, loads, open_file, read_intact, split_ext
+from lib.jsonl_index import JsonlIndex
+from lib.prompts import render_request
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(record: Dict) -> str:
+    """Hash of everything in a record that is sent upstream (i.e. all but the metadata)"""
+    request = render_request({k: v for k, v in record.items() if k != "metadata"})
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def dedup_file_names(input_file: str, base_name: str|None=None) -> tuple[str, str]:
+    input_base_name, ext = split_ext(input_file)
+    base_name = base_name or input_base_name
+    return f"{base_name}_unique{ext}", f"{base_name}_dedup_index.json"
+
+
+def build_dedup_index(input_file: str, line_numbers: Iterable[int]|None=None, base_name: str|None=None) -> tuple[str, str]:
+    """Write the unique requests of a dataset and a persistent index of their duplicates.
+    The first record of every group of identical requests is kept; the index
+    maps its sentence_id to the sentence_ids of all records in the group.
+    Args:
+        input_file: str, a dataset jsonl file whose records have metadata.sentence_id
+        line_numbers: only dedup these lines of the file (see lib/jsonl_index.py)
+        base_name: str, the path prefix of the files written, by default that of the input file
+    Returns: tuple, the paths of the unique requests file and the index file
+    """
+    unique_file, index_file = dedup_file_names(input_file, base_name)
+    representatives = {}
+    groups = {}
+    metadata = {}
+    with open_file(input_file, 'rb') as f_in, JsonlWriter(unique_file) as writer:
+        lines = f_in if line_numbers is None else (line for _, line in JsonlIndex(input_file).iter_lines(line_numbers))
+        for line in lines:
+            record = loads(line)
+            sentence_id = record["metadata"]["sentence_id"]
+            metadata[sentence_id] = record["metadata"]
+            key = request_key(record)
+            if key in representatives:
+                groups[representatives[key]].append(sentence_id)
+                continue
+            representatives[key] = sentence_id
+            groups[sentence_id] = [sentence_id]
+            writer.write_line(line)
+
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump({"input_file": input_file, "groups": groups, "metadata": metadata}, f)
+
+    duplicates = len(metadata) - len(groups)
+    logger.info(f"{len(groups)} unique requests out of {len(metadata)} ({duplicates} duplicates) in {unique_file}")
+    return unique_file, index_file
+
+
+def fan_out_results(result_file: str, index_file: str, output_file: str, append: bool=False) -> int:
+    """Copy the result of every unique request to all sentences that share it.
+    Args:
+        result_file: str, results of the unique requests, as [request, response, metadata] lines
+        index_file: str, the index written by `build_dedup_index`
+        output_file: str, results for every sentence of the original dataset
+        append: bool, append to the output file instead of overwriting it
+    Returns: int, the number of results written
+    """
+    with open(index_file, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    # json turns the integer sentence ids into string keys
+    groups = index["groups"]
+    metadata = index["metadata"]
+
+    with open_file(result_file, 'rb') as f_in, JsonlWriter(output_file, 'a' if append else 'w') as writer:
+        for line in f_in:
+            data = loads(line)
+            sentence_id = data[2].get("sentence_id") if len(data) > 2 else None
+            group = groups.get(str(sentence_id))
+            if group is None:
+                writer.write_line(line)
+                continue
+            for duplicate_id in group:
+                writer.write([data[0], data[1], metadata[str(duplicate_id)]])
+    logger.info(f"Fanned out results of {result_file} to {writer.count} sentences in {output_file}")
+    return writer.count
+
+
+def load_previous_results(result_files: Iterable[str|None], is_successful: Callable[[Any], bool]) -> Dict[Any, list]:
+    """Successful results of earlier runs, to resume from, by sentence_id.
+    The results of unique requests are keyed by the sentence_id of their
+    representative, so they resume the unique requests as well as the full
+    output resumes the sentences. Lines cut short by a crash are skipped;
+    a later file wins over an earlier one.
+    Args:
+        result_files: paths of [request, response, metadata] results files, missing ones (or None) are skipped
+        is_successful: whether a response is worth keeping
+    Returns: dict, the results by sentence_id
+    """
+    results = {}
+    for result_file in result_files:
+        if not result_file or not os.path.exists(result_file):
+            continue
+        for line in read_intact(result_file).split(b'\n'):
+            if not line.strip():
+                continue
+            try:
+                result = loads(line)
+                sentence_id = result[2].get("sentence_id")
+            except (ValueError, IndexError, AttributeError) as e:
+                logger.warning(f"Error parsing previous result in {result_file}: {e}")
+                continue
+            if sentence_id is not None and is_successful(result[1]):
+                results[sentence_id] = result
+    return results
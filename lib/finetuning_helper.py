@@ -3,6 +3,9 @@ import json
 from time import sleep
 from openai import OpenAI
 from lib.io import save_to_json
+from lib.prompts import export_chat_file
+from lib.stage_cache import StageCache
+from lib.token_counter import CostEstimator, ensure_token_counts
 
 import logging
 logger = logging.getLogger(__name__)
@@ -14,14 +17,38 @@ class FineTuningHelper:
     def __init__(self, config) -> None:
         self.config = config
 
-    def run(self, wait_for_job=False, skip_if_exist=True):
+    def run(self, wait_for_job=False, skip_if_exist=True, cache: StageCache | None = None, force=False):
+        if cache is not None:
+            # Re-train only if the datasets or the training settings changed;
+            # the uploaded files of a previous run are stale in that case
+            cache.run(
+                "finetune",
+                lambda: self.train(wait_for_job=wait_for_job, reuse_uploaded_files=False),
+                inputs=[self.config.dataset_train_filename, self.config.dataset_val_filename],
+                outputs=[self.config.file_id_filename, self.config.job_id_filename],
+                params={
+                    "run_id": self.config.run_id,
+                    "base_model": self.config.fine_tuning_base_model_id,
+                    "suffix": self.config.model_suffix,
+                    "prompt_templates": self.config.prompt_templates,
+                },
+                code=[FineTuningHelper],
+                force=force,
+            )
+            return
         if skip_if_exist and self.is_job_exists():
             logger.info("Model already trained, skip.")
             return
+        self.train(wait_for_job=wait_for_job)
+
+    def train(self, wait_for_job=False, reuse_uploaded_files=True):
+        training_tokens = CostEstimator.training_tokens(ensure_token_counts(self.config.dataset_train_filename))
+        logger.info(f"Training tokens per epoch: {training_tokens}")
         logger.info("Uploading data...")
         file_ids = self.upload_data(
             training_file_name=self.config.dataset_train_filename,
             validation_file_name=self.config.dataset_val_filename,
+            reuse_uploaded_files=reuse_uploaded_files,
         )
         logger.info("Starting training...")
         job_id = self.start_training(
@@ -33,19 +60,23 @@ class FineTuningHelper:
             logger.info("Waiting for training job...")
             self.wait_for_training_job(job_id=job_id)
 
-    def upload_data(self, training_file_name, validation_file_name):
-        if os.path.exists(self.config.file_id_filename):
+    def upload_data(self, training_file_name, validation_file_name, reuse_uploaded_files=True):
+        if reuse_uploaded_files and os.path.exists(self.config.file_id_filename):
             file_ids = json.load(open(self.config.file_id_filename, "r"))
             logger.info(f"File already uploaded, load file IDs: {file_ids}")
             return file_ids
 
+        # The datasets hold compact records; upload them rendered into chat messages
+        training_chat_file = self.export_chat_file(training_file_name)
+        validation_chat_file = self.export_chat_file(validation_file_name)
+
         train_file_obj = client.files.create(
-            file=open(training_file_name, "rb"), purpose="fine-tune"
+            file=open(training_chat_file, "rb"), purpose="fine-tune"
         )
         training_file_id = train_file_obj.id
 
         validation_file_obj = client.files.create(
-            file=open(validation_file_name, "rb"), purpose="fine-tune"
+            file=open(validation_chat_file, "rb"), purpose="fine-tune"
         )
         validation_file_id = validation_file_obj.id
 
@@ -57,6 +88,12 @@ class FineTuningHelper:
         save_to_json(file_ids, self.config.file_id_filename)
         return file_ids
 
+    def export_chat_file(self, file_name):
+        chat_file_name = file_name.replace(".jsonl", "_chat.jsonl")
+        count = export_chat_file(file_name, chat_file_name)
+        logger.info(f"Exported {count} examples to {chat_file_name}")
+        return chat_file_name
+
     def start_training(self, training_file_id, validation_file_id, suffix_name):
         # Create a Fine Tuning Job
         job = client.fine_tuning.jobs.create(
@@ -0,0 +1,150 @@
+import time
+import asyncio
+import logging
+from types import SimpleNamespace
+from typing import Dict, List
+
+import aiohttp
+import numpy as np
+
+try:
+    import brotli  # optional, lets the server send Brotli-compressed responses
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class HttpTransport:
+    """A pooled aiohttp session that several runs of the processor share.
+
+    The connector keeps up to `pool_size` connections alive between requests
+    and runs, and caches DNS lookups, so a second model run starts on warm
+    TLS connections instead of opening new ones. Responses are requested
+    gzip (and Brotli, if the brotli package is installed) compressed when
+    `compress` is set. The session belongs to the event loop it was created
+    in; runs that share it must share the loop too (e.g. an asyncio.Runner).
+
+    Connection setup and DNS times, and the latency of requests on new
+    ("cold") versus reused ("warm") connections, are traced; see `metrics`.
+    """
+
+    def __init__(self, pool_size: int = 100, pool_size_per_host: int = 0, keepalive_timeout: float = 30.0,
+                 dns_cache_ttl: int = 300, connect_timeout: float = 10.0, read_timeout: float = 120.0,
+                 total_timeout: float|None = None, compress: bool = True) -> None:
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.accept_encoding = ("gzip, deflate, br" if brotli is not None else "gzip, deflate") if compress else "identity"
+        self._session: aiohttp.ClientSession|None = None
+        self._loop: asyncio.AbstractEventLoop|None = None
+        self.reset_metrics()
+
+    @classmethod
+    def from_config(cls, config) -> "HttpTransport":
+        return cls(
+            pool_size=config.http_pool_size,
+            keepalive_timeout=config.http_keepalive_timeout,
+            dns_cache_ttl=config.http_dns_cache_ttl,
+            connect_timeout=config.http_connect_timeout,
+            read_timeout=config.http_read_timeout,
+            compress=config.http_compress,
+        )
+
+    async def session(self) -> aiohttp.ClientSession:
+        """The shared session, created on first use in the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is not loop:
+            logger.warning("HTTP transport used from another event loop, opening new connections")
+            self._session = None
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Accept-Encoding": self.accept_encoding},
+                trace_configs=[self._trace_config()],
+            )
+            self._loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def __aenter__(self) -> "HttpTransport":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def reset_metrics(self) -> None:
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connection_setup_times: List[float] = []
+        self.dns_times: List[float] = []
+        self.cold_latencies: List[float] = []
+        self.warm_latencies: List[float] = []
+
+    def metrics(self) -> Dict:
+        """Connection counts, and percentiles (in ms) of the connection setup, DNS and request times"""
+        def percentiles(values):
+            if not values:
+                return None
+            p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+            return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1), "count": len(values)}
+        return {
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "connection_setup_ms": percentiles(self.connection_setup_times),
+            "dns_ms": percentiles(self.dns_times),
+            "cold_request_ms": percentiles(self.cold_latencies),
+            "warm_request_ms": percentiles(self.warm_latencies),
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        # every request gets its own context, shared by all the signals it triggers
+        trace_config = aiohttp.TraceConfig(trace_config_ctx_factory=lambda trace_request_ctx: SimpleNamespace(cold=False))
+
+        async def on_request_start(session, ctx, params):
+            ctx.request_start = time.perf_counter()
+
+        async def on_request_end(session, ctx, params):
+            latency = time.perf_counter() - ctx.request_start
+            (self.cold_latencies if ctx.cold else self.warm_latencies).append(latency)
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connection_start = time.perf_counter()
+
+        async def on_connection_create_end(session, ctx, params):
+            ctx.cold = True
+            self.connections_created += 1
+            self.connection_setup_times.append(time.perf_counter() - ctx.connection_start)
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.connections_reused += 1
+
+        async def on_dns_resolvehost_start(session, ctx, params):
+            ctx.dns_start = time.perf_counter()
+
+        async def on_dns_resolvehost_end(session, ctx, params):
+            self.dns_times.append(time.perf_counter() - ctx.dns_start)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        return trace_config
@@ -1,25 +1,304 @@
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
+import gzip
+from io import BufferedReader, TextIOWrapper
 import os
+import zlib
 import pandas as pd
 import json
-from typing import List, Dict
-    
-    
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List
+
+try:
+    import orjson
+except ImportError:  # optional; the json module is used instead
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # optional; only needed for .zst files
+    zstandard = None
+
+COMPRESSED_EXTENSIONS = ('.gz', '.zst')
+
+
+def split_ext(file_path: str) -> tuple[str, str]:
+    """Like os.path.splitext, but keeps a compression suffix with its extension: a.jsonl.gz -> (a, .jsonl.gz)"""
+    base_name, ext = os.path.splitext(file_path)
+    if ext in COMPRESSED_EXTENSIONS:
+        base_name, inner_ext = os.path.splitext(base_name)
+        ext = inner_ext + ext
+    return base_name, ext
+
+def is_compressed(file_path: str) -> bool:
+    return file_path.endswith(COMPRESSED_EXTENSIONS)
+
+def open_file(file_path: str, mode: str = 'rb', encoding: str | None = None) -> IO:
+    """Open a file, compressing or decompressing it on the fly if it ends with .gz or .zst."""
+    if 'b' not in mode:
+        # gzip and zstandard default to binary mode
+        mode = mode if 't' in mode else mode + 't'
+        encoding = encoding or 'utf-8'
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode, encoding=encoding)
+    if file_path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"Reading or writing {file_path} requires the zstandard package")
+        if 'r' in mode:
+            # appending writes a new frame, so read across all of them
+            reader = zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), read_across_frames=True, closefd=True)
+            stream = BufferedReader(reader)
+            return stream if 'b' in mode else TextIOWrapper(stream, encoding=encoding)
+        return zstandard.open(file_path, mode, encoding=encoding)
+    return open(file_path, mode, encoding=encoding)
+
+
+def read_intact(file_path: str) -> bytes:
+    """Read a whole file, decompressed if it ends with .gz or .zst. Of a compressed file cut short,
+    e.g. by a crash while it was written, the data that can still be decompressed is returned."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if not is_compressed(file_path):
+        return data
+    if file_path.endswith('.zst') and zstandard is None:
+        raise ImportError(f"Reading {file_path} requires the zstandard package")
+    chunks = []
+    # appending starts a new gzip member or zstd frame, so decompress them one after the other
+    while data:
+        if file_path.endswith('.gz'):
+            decompressor, errors = zlib.decompressobj(wbits=31), zlib.error
+        else:
+            decompressor, errors = zstandard.ZstdDecompressor().decompressobj(), zstandard.ZstdError
+        try:
+            chunks.append(decompressor.decompress(data))
+        except errors:
+            break
+        if not decompressor.eof:
+            break  # the last member or frame was cut short
+        data = decompressor.unused_data
+    return b''.join(chunks)
+
+
+def loads(line: str | bytes) -> Any:
+    """Parse one JSON document, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+def dumps_bytes(data: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def dumps(data: Any) -> str:
+    return dumps_bytes(data).decode('utf-8')
+
+def iter_jsonl(file_path: str) -> Iterator[Any]:
+    """Iterate over the records of a JSONL file without loading the whole file; blank lines are skipped."""
+    with open_file(file_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
 def read_jsonl(file_path: str) -> List[Dict]:
     """Read JSONL file and return list of dictionaries."""
-    data = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data.append(json.loads(line))
-    return data
+    return list(iter_jsonl(file_path))
 
-def save_to_jsonl(dataset, file_path):
-    path = os.path.dirname(file_path)
-    os.makedirs(path, exist_ok=True)
-    with open(file_path, 'w', encoding='utf-8') as file:
+
+class JsonlWriter:
+    """Write records to a JSONL file in batches of encoded lines.
+
+    Records are serialized as they are written and flushed to the file every
+    `batch_size` records, so large result files are written in a few big
+    writes instead of one per record. Files ending with .gz or .zst are
+    compressed in a background thread, so writers running in an event loop
+    are not held up by the compression.
+    """
+
+    def __init__(self, file_path: str, mode: str = 'w', batch_size: int = 1000) -> None:
+        path = os.path.dirname(file_path)
+        if path:
+            os.makedirs(path, exist_ok=True)
+        self.file = open_file(file_path, mode.replace('b', '') + 'b')
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+        self.compressed = is_compressed(file_path)
+        self._executor = ThreadPoolExecutor(max_workers=1) if self.compressed else None
+        self._pending: Future | None = None
+
+    def write(self, record: Any) -> None:
+        self.write_line(dumps_bytes(record))
+
+    def write_line(self, line: str | bytes) -> None:
+        """Write an already serialized record."""
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        self.buffer.append(line if line.endswith(b'\n') else line + b'\n')
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.compressed:
+            # a single worker keeps the batches in order; a flush of the
+            # compressed stream itself would only hurt the compression ratio
+            if self.buffer:
+                self._wait()
+                self._pending = self._executor.submit(self.file.write, b''.join(self.buffer))
+                self.buffer = []
+            return
+        if self.buffer:
+            self.file.write(b''.join(self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+
+    def _wait(self) -> None:
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def sync(self) -> None:
+        """Flush everything written so far down to the disk."""
+        self.flush()
+        if self.compressed:
+            self._wait()
+            self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        if self.compressed:
+            self._wait()
+            self._executor.shutdown()
+        self.file.close()
+
+    def __enter__(self) -> "JsonlWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class AsyncJsonlWriter:
+    """A single writer task that owns a JSONL file for asyncio code.
+
+    Producers `put` records without touching the file; the task batches them
+    from a queue, writes a batch when it reaches `batch_size` records or is
+    `flush_interval` seconds old, and fsyncs the file every
+    `checkpoint_interval` seconds and on close. File I/O runs in a worker
+    thread, so the event loop never blocks on the disk. Records put with a
+    key that was already written are dropped. `on_batch`, if given, is called
+    in the same thread with the (record, info) pairs of every written batch,
+    e.g. to mirror the records into a database.
+
+    Usage:
+        async with AsyncJsonlWriter(file_path, mode='a') as writer:
+            writer.put(record, key=task_id)
+    """
+
+    def __init__(self, file_path: str, mode: str = 'w', batch_size: int = 500, flush_interval: float = 1.0,
+                 checkpoint_interval: float = 30.0, on_batch: Callable[[list[tuple[Any, Any]]], Any] | None = None) -> None:
+        self.file_path = file_path
+        self.on_batch = on_batch
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.keys = set()
+        self.count = 0
+        self.num_duplicates = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._writer: JsonlWriter | None = None
+
+    async def open(self) -> "AsyncJsonlWriter":
+        self._writer = await asyncio.to_thread(JsonlWriter, self.file_path, self.mode, self.batch_size)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def put(self, record: Any, key: Any = None, info: Any = None) -> bool:
+        """Queue a record; returns False if a record with the same key was already queued."""
+        if key is not None:
+            if key in self.keys:
+                self.num_duplicates += 1
+                return False
+            self.keys.add(key)
+        self._queue.put_nowait((dumps_bytes(record), record, info))
+        self.count += 1
+        return True
+
+    async def close(self) -> None:
+        self._queue.put_nowait(None)
+        await self._task
+        await asyncio.to_thread(self._close_file)
+
+    async def __aenter__(self) -> "AsyncJsonlWriter":
+        return await self.open()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def _run(self) -> None:
+        batch = []
+        batch_started = last_checkpoint = time.monotonic()
+        closing = False
+        while not closing:
+            try:
+                if batch:
+                    timeout = max(0.0, self.flush_interval - (time.monotonic() - batch_started))
+                    line = await asyncio.wait_for(self._queue.get(), timeout)
+                else:
+                    line = await self._queue.get()
+                    batch_started = time.monotonic()
+                # None is the close sentinel; drain whatever else is already queued
+                while True:
+                    if line is None:
+                        closing = True
+                        break
+                    batch.append(line)
+                    if len(batch) >= self.batch_size or self._queue.empty():
+                        break
+                    line = self._queue.get_nowait()
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.monotonic()
+            if batch and (closing or len(batch) >= self.batch_size or now - batch_started >= self.flush_interval):
+                checkpoint = now - last_checkpoint >= self.checkpoint_interval
+                await asyncio.to_thread(self._write_batch, batch, checkpoint)
+                if checkpoint:
+                    last_checkpoint = now
+                batch = []
+
+    def _write_batch(self, batch: list[tuple[bytes, Any, Any]], checkpoint: bool) -> None:
+        for line, _, _ in batch:
+            self._writer.write_line(line)
+        if checkpoint:
+            self._writer.sync()
+        else:
+            self._writer.flush()
+        if self.on_batch is not None:
+            self.on_batch([(record, info) for _, record, info in batch])
+
+    def _close_file(self) -> None:
+        self._writer.sync()
+        self._writer.close()
+
+
+def save_to_jsonl(dataset: Iterable[Any], file_path: str) -> int:
+    with JsonlWriter(file_path) as writer:
         for record in dataset:
-            json_line = json.dumps(record)
-            file.write(json_line + '\n')
+            writer.write(record)
+    return writer.count
+
+def append_to_jsonl(data: Any, file_path: str) -> None:
+    """Append a single record to the end of a JSONL file."""
+    with open_file(file_path, 'ab') as f:
+        f.write(dumps_bytes(data) + b'\n')
 
 def read_json(file_path):
     with open(file_path, 'r') as file:
@@ -0,0 +1,160 @@
+import os
+import logging
+import tempfile
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+from lib.io import is_compressed, loads, split_ext
+
+logger = logging.getLogger(__name__)
+
+
+class JsonlIndex:
+    """Persistent line-offset index of a JSONL file.
+
+    The byte offset of every line (plus the file size, so line i spans
+    offsets[i]:offsets[i + 1]) is saved as a .npy file next to the data and
+    memory-mapped, so records can be read by line number, range, random
+    sample, shard or sentence_id by seeking, without copying the file. The
+    index is rebuilt when the file is newer than it or its size changed, and
+    the sentence ids whenever the offsets are. Both are written to a temporary
+    file moved into place, so that processes indexing the same file at once
+    (e.g. shards of one input) never load a partial one. Compressed files
+    cannot be indexed.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        if is_compressed(file_path):
+            raise ValueError(f"Cannot index compressed file {file_path}")
+        self.file_path = file_path
+        base_name = split_ext(file_path)[0]
+        self.offsets_file = f"{base_name}_offsets.npy"
+        self.ids_file = f"{base_name}_sentence_ids.npy"
+        if not self._is_fresh(self.offsets_file):
+            self.build()
+        self.offsets = np.load(self.offsets_file, mmap_mode='r')
+        if self.offsets[-1] != os.path.getsize(file_path):
+            self.build()
+            self.offsets = np.load(self.offsets_file, mmap_mode='r')
+        self._sentence_ids = None
+
+    def _is_fresh(self, index_file: str) -> bool:
+        return os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(self.file_path)
+
+    def build(self, chunk_size: int = 1 << 24) -> None:
+        """Scan the file for line starts, a chunk at a time"""
+        starts = [np.zeros(1, dtype=np.int64)]
+        position = 0
+        with open(self.file_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n'))
+                starts.append(newlines.astype(np.int64) + position + 1)
+                position += len(chunk)
+        offsets = np.concatenate(starts)
+        if offsets[-1] != position:
+            # the last line has no trailing newline
+            offsets = np.append(offsets, position)
+        _save_atomic(self.offsets_file, offsets)
+        # the sentence ids belong to these offsets: drop them, they are rebuilt when needed
+        self._sentence_ids = None
+        logger.info(f"Indexed {len(offsets) - 1} lines of {self.file_path}")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def iter_lines(self, line_numbers: Iterable[int]) -> Iterator[tuple[int, bytes]]:
+        """(line number, line) pairs of the given lines, in the given order"""
+        with open(self.file_path, 'rb') as f:
+            for i in line_numbers:
+                start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+                f.seek(start)
+                yield i, f.read(end - start)
+
+    def line(self, i: int) -> bytes:
+        return next(self.iter_lines([i]))[1]
+
+    def record(self, i: int):
+        return loads(self.line(i))
+
+    def records(self, line_numbers: Iterable[int]) -> Iterator:
+        for _, line in self.iter_lines(line_numbers):
+            yield loads(line)
+
+    def shard(self, index: int, count: int) -> range:
+        """Line numbers of the index-th of count contiguous shards of about the same size in bytes"""
+        if not 0 <= index < count:
+            raise ValueError(f"Shard {index} out of range for {count} shards")
+        bounds = np.searchsorted(self.offsets[:-1], np.linspace(0, self.offsets[-1], count + 1)[1:-1])
+        bounds = [0, *bounds.tolist(), len(self)]
+        return range(bounds[index], bounds[index + 1])
+
+    @property
+    def sentence_ids(self) -> np.ndarray:
+        """metadata.sentence_id of every line (-1 if missing), saved next to the offsets"""
+        if self._sentence_ids is None:
+            if not self._is_fresh(self.ids_file) or os.path.getmtime(self.ids_file) < os.path.getmtime(self.offsets_file):
+                ids = np.array([
+                    (record.get("metadata") or {}).get("sentence_id", -1) if isinstance(record, dict) else -1
+                    for record in self.records(range(len(self)))
+                ], dtype=np.int64)
+                _save_atomic(self.ids_file, ids)
+            self._sentence_ids = np.load(self.ids_file, mmap_mode='r')
+        return self._sentence_ids
+
+    def find_sentence_ids(self, sentence_ids: Iterable[int]) -> List[int]:
+        """Line numbers of the given sentence_ids, in the given order"""
+        ids = self.sentence_ids
+        wanted = np.asarray(list(sentence_ids), dtype=np.int64)
+        if len(ids) == 0:
+            if len(wanted):
+                raise KeyError(f"Sentence ids not found in {self.file_path}: {wanted.tolist()[:10]}")
+            return []
+        order = np.argsort(ids, kind='stable')
+        positions = np.searchsorted(ids, wanted, sorter=order)
+        positions = np.minimum(positions, len(ids) - 1)
+        lines = order[positions]
+        missing = wanted[ids[lines] != wanted]
+        if len(missing):
+            raise KeyError(f"Sentence ids not found in {self.file_path}: {missing.tolist()[:10]}")
+        return lines.tolist()
+
+
+def _save_atomic(file_path: str, array: np.ndarray) -> None:
+    """np.save to a temporary file next to `file_path`, then move it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def select_lines(index: JsonlIndex, top_k: int = -1, sample: int = -1, shard: tuple[int, int] | None = None,
+                 sentence_ids: Iterable[int] | None = None, seed: int | None = 0) -> List[int] | range:
+    """Line numbers of a subset of an indexed file; all lines if no selection is given.
+    Args:
+        top_k: int, the first k records
+        sample: int, k random records
+        shard: tuple, (index, count) of a contiguous shard
+        sentence_ids: the records with these metadata.sentence_id
+        seed: int, the seed of the random sample
+    """
+    lines = range(len(index))
+    if sentence_ids is not None:
+        lines = index.find_sentence_ids(sentence_ids)
+    if shard is not None:
+        shard_lines = index.shard(*shard)
+        lines = [i for i in lines if i in shard_lines] if sentence_ids is not None else shard_lines
+    if sample > 0:
+        # random records, kept in file order
+        rng = np.random.default_rng(seed)
+        lines = sorted(rng.choice(np.asarray(lines, dtype=np.int64), size=min(sample, len(lines)), replace=False).tolist())
+    if top_k > 0:
+        lines = lines[:top_k]
+    return lines
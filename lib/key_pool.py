@@ -0,0 +1,157 @@
+import time
+import logging
+from typing import Callable, Dict, Iterable, List
+
+from lib.rate_limiter import AdaptiveRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Errors that say nothing about the request, only that the key cannot be used
+KEY_ERROR_STATUSES = {401}
+KEY_ERROR_CODES = {"invalid_api_key", "insufficient_quota", "account_deactivated"}
+
+
+def parse_api_keys(values: Iterable[str|None]) -> List[str]:
+    """API keys from settings or environment variables: each value may hold several comma separated
+    keys, each optionally followed by ':' and its organization. Empty values and duplicates are dropped."""
+    keys = []
+    for value in values:
+        for key in (value or "").split(","):
+            key = key.strip()
+            if key and key not in keys:
+                keys.append(key)
+    return keys
+
+
+def is_key_error(status: int|None, error) -> bool:
+    """Whether a failed request was refused because of its API key, rather than of its content"""
+    if isinstance(error, dict) and error.get("code") in KEY_ERROR_CODES:
+        return True
+    return status in KEY_ERROR_STATUSES
+
+
+class PooledKey:
+    """An API key (and organization), with its own request and token budgets and health.
+
+    After `failure_threshold` consecutive failures (server errors, timeouts)
+    the pool puts the key aside for a cooldown that doubles with every further
+    failure, up to `max_cooldown` seconds; a success brings it back at once.
+    A key that the API refuses as such (invalid, out of quota) is disabled.
+    """
+
+    def __init__(self, api_key: str, organization: str|None, limiter: AdaptiveRateLimiter,
+                 failure_threshold: int = 3, max_cooldown: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.api_key = api_key
+        self.organization = organization
+        self.limiter = limiter
+        self.failure_threshold = failure_threshold
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.consecutive_failures = 0
+        self.unhealthy_until = float("-inf")
+        self.disabled = False
+        self.num_requests = 0
+
+    @property
+    def name(self) -> str:
+        """The key as it may appear in logs"""
+        name = f"...{self.api_key[-4:]}" if len(self.api_key) > 8 else "key"
+        return f"{name}@{self.organization}" if self.organization else name
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        return headers
+
+    def time_until(self, num_tokens: float) -> float:
+        """Seconds until the key may send a request of `num_tokens` tokens"""
+        if self.disabled:
+            return float("inf")
+        return max(self.limiter.time_until(num_tokens), self.unhealthy_until - self.clock())
+
+    def on_success(self) -> None:
+        self.consecutive_failures = 0
+        self.unhealthy_until = float("-inf")
+        self.limiter.on_success()
+
+    @property
+    def healthy(self) -> bool:
+        return not self.disabled and self.unhealthy_until <= self.clock()
+
+
+class KeyPool:
+    """API keys sharing the requests of a run, each with its own rate limiter and health.
+
+    Every request goes to the key that can send it soonest, so the throughput
+    adds up over the keys and a throttled or failing key only slows down its
+    own share. Among keys that can all send now, the one with the largest
+    share of its request and token budgets left is preferred, which spreads the load evenly. The last healthy
+    key is never put aside nor disabled, so that a pool of one behaves like a
+    single key.
+    """
+
+    def __init__(self, keys: List[PooledKey]) -> None:
+        if not keys:
+            raise ValueError("No API key given")
+        self.keys = keys
+
+    @classmethod
+    def from_api_keys(cls, api_keys: Iterable[str], max_requests_per_minute: float, max_tokens_per_minute: float,
+                      clock: Callable[[], float] = time.monotonic, **kwargs) -> "KeyPool":
+        """A pool of keys ("key" or "key:organization") starting with the same budgets per key"""
+        keys = []
+        for api_key in api_keys:
+            api_key, _, organization = api_key.partition(":")
+            limiter = AdaptiveRateLimiter(max_requests_per_minute, max_tokens_per_minute, clock=clock)
+            keys.append(PooledKey(api_key, organization or None, limiter, clock=clock, **kwargs))
+        return cls(keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def capacity(self) -> Dict[str, Dict[str, float]]:
+        """Current budgets per minute of every key"""
+        return {key.name: key.limiter.capacity for key in self.keys}
+
+    def select(self, num_tokens: float) -> tuple[PooledKey, float]:
+        """The key to send a request of `num_tokens` tokens with, and the seconds until it can"""
+        return min(
+            ((key, key.time_until(num_tokens)) for key in self.keys),
+            key=lambda pair: (pair[1], -self._budget_left(pair[0])),
+        )
+
+    @staticmethod
+    def _budget_left(key: PooledKey) -> float:
+        """The smallest share left of the request and token budgets of a key (refilled by time_until)"""
+        return min(bucket.available / bucket.capacity if bucket.capacity > 0 else 0.0
+                   for bucket in key.limiter.buckets.values())
+
+    def can_send_elsewhere(self, key: PooledKey, num_tokens: float) -> bool:
+        """Whether another key can send a request of `num_tokens` tokens now"""
+        return any(other.time_until(num_tokens) == 0 for other in self.keys if other is not key)
+
+    def _others_healthy(self, key: PooledKey) -> bool:
+        return any(other.healthy for other in self.keys if other is not key)
+
+    def on_failure(self, key: PooledKey) -> None:
+        """Count a failure of the key, and put it aside for a while if it keeps failing"""
+        key.consecutive_failures += 1
+        if key.consecutive_failures >= key.failure_threshold and self._others_healthy(key):
+            cooldown = min(key.max_cooldown, 2.0 ** (key.consecutive_failures - key.failure_threshold))
+            key.unhealthy_until = key.clock() + cooldown
+            logger.warning(f"API key {key.name} failed {key.consecutive_failures} times in a row, "
+                           f"put aside for {cooldown:g} s")
+
+    def disable(self, key: PooledKey, reason) -> bool:
+        """Stop using a key the API refused; returns False (and keeps it) if it is the last healthy one"""
+        if key.disabled:
+            return True
+        if not self._others_healthy(key):
+            return False
+        key.disabled = True
+        logger.error(f"API key {key.name} disabled: {reason}")
+        return True
@@ -0,0 +1,176 @@
+import math
+import time
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from typing import Callable, Iterable
+
+from aiohttp import web
+
+from lib.rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class MockOpenAIServer:
+    """Local stand-in for the OpenAI chat completions endpoint, for tests and benchmarks.
+
+    Every request is answered after `latency` seconds with a fixed completion
+    and a `usage` block, so the processor can be exercised without network
+    access or API costs. Use it as an async context manager; `url` is the
+    request_url to give to the processor.
+
+    With `requests_per_minute`/`tokens_per_minute`, the server enforces those
+    limits like the API does, separately for every API key: tokens are counted
+    as the prompt words plus max_tokens, every response carries x-ratelimit-*
+    headers, and requests over the limit are refused with a 429 and a
+    Retry-After header. Requests for which `fail_when(body)` is true get an
+    error with status `fail_status` instead of a completion, and requests with
+    one of the `invalid_keys` a 401, with one of the `exhausted_keys` a 429
+    insufficient_quota error. A completion longer than the max_tokens of
+    its request is cut short, with finish_reason "length". `requests_per_key`
+    counts the completions served to every key.
+    """
+
+    def __init__(self, latency: float = 0.05, completion: str = '{"corrected": ""}', completion_tokens: int = 8,
+                 requests_per_minute: float|None = None, tokens_per_minute: float|None = None,
+                 fail_when: Callable[[dict], bool]|None = None, fail_status: int = 500,
+                 invalid_keys: Iterable[str] = (), exhausted_keys: Iterable[str] = ()) -> None:
+        self.latency = latency
+        self.completion = completion
+        self.completion_tokens = completion_tokens
+        self.capacities = {}
+        if requests_per_minute is not None:
+            self.capacities["requests"] = requests_per_minute
+        if tokens_per_minute is not None:
+            self.capacities["tokens"] = tokens_per_minute
+        # the buckets of every API key, created on its first request
+        self.limits = defaultdict(lambda: {kind: TokenBucket(capacity) for kind, capacity in self.capacities.items()})
+        self.fail_when = fail_when
+        self.fail_status = fail_status
+        self.invalid_keys = set(invalid_keys)
+        self.exhausted_keys = set(exhausted_keys)
+        self.num_requests = 0
+        self.requests_per_key = Counter()
+        self.num_rate_limited = 0
+        self.num_failed = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._runner = None
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1/chat/completions"
+
+    async def start(self) -> "MockOpenAIServer":
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.debug(f"Mock OpenAI server listening on {self.url}")
+        return self
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "MockOpenAIServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    def _rate_limit_headers(self, limits: dict) -> dict:
+        headers = {}
+        for kind, bucket in limits.items():
+            headers[f"x-ratelimit-limit-{kind}"] = str(int(bucket.capacity))
+            headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(bucket.available)))
+            headers[f"x-ratelimit-reset-{kind}"] = f"{bucket.time_until(bucket.capacity):.3f}s"
+        return headers
+
+    def _admit(self, limits: dict, prompt_tokens: int, max_tokens: int) -> tuple[str, float]|None:
+        """None if the request fits in the limits (and is counted), else the exceeded limit and the seconds to wait"""
+        amounts = {"requests": 1, "tokens": prompt_tokens + max_tokens}
+        waits = {kind: bucket.time_until(amounts[kind]) for kind, bucket in limits.items()}
+        if not any(waits.values()):
+            for kind, bucket in limits.items():
+                bucket.consume(amounts[kind])
+            return None
+        return max(waits, key=waits.get), max(waits.values())
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        api_key = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if api_key in self.invalid_keys:
+            return web.json_response(
+                {"error": {
+                    "message": "Incorrect API key provided.",
+                    "type": "invalid_request_error",
+                    "code": "invalid_api_key",
+                }},
+                status=401,
+            )
+        if api_key in self.exhausted_keys:
+            return web.json_response(
+                {"error": {
+                    "message": "You exceeded your current quota, please check your plan and billing details.",
+                    "type": "insufficient_quota",
+                    "code": "insufficient_quota",
+                }},
+                status=429,
+            )
+        limits = self.limits[api_key]
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        refusal = self._admit(limits, prompt_tokens, body.get("max_tokens") or self.completion_tokens)
+        if refusal is not None:
+            kind, wait = refusal
+            self.num_rate_limited += 1
+            return web.json_response(
+                {"error": {
+                    "message": f"Rate limit reached for {kind}. Please try again in {wait:.3f}s.",
+                    "type": kind,
+                    "code": "rate_limit_exceeded",
+                }},
+                status=429,
+                headers={**self._rate_limit_headers(limits), "retry-after": str(math.ceil(wait)), "retry-after-ms": str(math.ceil(wait * 1000))},
+            )
+        self.num_requests += 1
+        self.requests_per_key[api_key] += 1
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self._in_flight -= 1
+        if self.fail_when is not None and self.fail_when(body):
+            self.num_failed += 1
+            return web.json_response(
+                {"error": {"message": "The server had an error while processing your request.", "type": "server_error"}},
+                status=self.fail_status,
+                headers=self._rate_limit_headers(limits),
+            )
+        completion, completion_tokens, finish_reason = self.completion, self.completion_tokens, "stop"
+        max_tokens = body.get("max_tokens")
+        if max_tokens is not None and max_tokens < completion_tokens:
+            completion, completion_tokens, finish_reason = completion[:max_tokens], max_tokens, "length"
+        return web.json_response({
+            "id": f"chatcmpl-mock-{self.num_requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": completion},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }, headers=self._rate_limit_headers(limits))
@@ -1,23 +1,84 @@
 import os
+import glob
 import asyncio
 import logging
 from lib.finetuning_helper import FineTuningHelper
+from lib.http_transport import HttpTransport
+from lib.jsonl_index import JsonlIndex, select_lines
+from lib.key_pool import parse_api_keys
 from lib.api_request_parallel_processor import process_api_requests_from_file_openai
+from lib.checkpoint import checkpoint_file
+from lib.dedup import build_dedup_index, fan_out_results
+from lib.io import JsonlWriter, loads, open_file
+from lib.results_store import ResultsStore
+from lib.stage_cache import StageCache
+from lib.token_counter import CompletionLengthEstimator, ensure_token_counts
 from lib.utils import backup_output_file
 
 
 logger = logging.getLogger(__name__)
 
 class ModelRunner:
-    def __init__(self, config, run_top_k=-1) -> None:
+    def __init__(self, config, run_top_k=-1, dedup=True, results_store: ResultsStore|None=None) -> None:
         self.config = config
         self.run_top_k = run_top_k
-        
-    def run(self, baseline=True, fine_tuned=True, skip_if_exists=True):
+        # Send identical requests once and copy the response to every sentence sharing it
+        self.dedup = dedup
+        # Results are also written to the store, under the run id and the model names of A04
+        self.results_store = results_store
+        # The model runs share the connections of one transport, in one event loop
+        self.transport = HttpTransport.from_config(config)
+        self._loop_runner = None
+
+    def run(self, baseline=True, fine_tuned=True, skip_if_exists=True, cache: StageCache|None=None, force=False):
+        with asyncio.Runner() as loop_runner:
+            self._loop_runner = loop_runner
+            try:
+                self._run_models(baseline, fine_tuned, skip_if_exists, cache, force)
+            finally:
+                logger.info(f"HTTP transport: {self.transport.metrics()}")
+                loop_runner.run(self.transport.close())
+                self._loop_runner = None
+
+    def _run_models(self, baseline, fine_tuned, skip_if_exists, cache, force):
+        # a run left with failed or interrupted requests is resumed even if the stage looks up to date
         if baseline:
-            self._run_baseline_models(skip_if_exists=skip_if_exists)
+            if cache is None:
+                self._run_baseline_models(skip_if_exists=skip_if_exists)
+            else:
+                cache.run(
+                    "inference_baseline",
+                    lambda: self._run_baseline_models(skip_if_exists=False),
+                    inputs=[self.config.dataset_test_filename],
+                    outputs=[self.config.dataset_test_result_gpt_4o_baseline_filename],
+                    params={
+                        "model": self.config.inference_base_model_id,
+                        "temperature": self.config.inference_base_model_temperature,
+                        "run_top_k": self.run_top_k,
+                        "dedup": self.dedup,
+                        "prompt_templates": self.config.prompt_templates,
+                    },
+                    code=[ModelRunner, process_api_requests_from_file_openai, build_dedup_index, ensure_token_counts],
+                    force=force or self._has_pending_requests(self.config.dataset_test_result_gpt_4o_baseline_filename)
+                )
         if fine_tuned:
-            self._run_openai_finetuned(skip_if_exists=skip_if_exists)
+            if cache is None:
+                self._run_openai_finetuned(skip_if_exists=skip_if_exists)
+            else:
+                # the fine-tuned model id is read from the job file
+                cache.run(
+                    "inference_finetuned",
+                    lambda: self._run_openai_finetuned(skip_if_exists=False),
+                    inputs=[self.config.dataset_test_filename, self.config.job_id_filename],
+                    outputs=[self.config.dataset_test_result_gpt_4o_finetuned_filename],
+                    params={
+                        "temperature": self.config.inference_finetuned_model_temperature,
+                        "dedup": self.dedup,
+                        "prompt_templates": self.config.prompt_templates,
+                    },
+                    code=[ModelRunner, process_api_requests_from_file_openai, build_dedup_index, ensure_token_counts],
+                    force=force or self._has_pending_requests(self.config.dataset_test_result_gpt_4o_finetuned_filename)
+                )
 
     def _run_openai_finetuned(self, skip_if_exists=True):
         finetuner = FineTuningHelper(self.config)
@@ -27,19 +88,20 @@ class ModelRunner:
             input_fn = self.config.dataset_test_filename
             output_fn = self.config.dataset_test_result_gpt_4o_finetuned_filename
             
-            if os.path.exists(output_fn):
+            if os.path.exists(output_fn) and not self._has_pending_requests(output_fn):
                 if skip_if_exists:
                     logger.info(f"Skip running model {fine_tuned_model}.")
                     return
                 else:
                     backup_output_file(output_fn)
 
-            self._run_openai_model(
+            self._run_openai_model_dedup(
                 input_jsonl_fn=input_fn,
                 output_jsonl_fn=output_fn,
+                store_model="gpt-4o_finetuned",
                 model=fine_tuned_model,
                 temperature=self.config.inference_finetuned_model_temperature,
-                api_key=os.getenv("OPENAI_API_KEY"),
+                api_keys=self._api_keys(self.config.openai_finetuned_api_key_envs),
             )
         else:
             logger.info(f"Fine-tuning model is not ready yet: {job}")
@@ -47,34 +109,125 @@ class ModelRunner:
     def _run_baseline_models(self, skip_if_exists=True):
         model_id = self.config.inference_base_model_id
         input_fn = self.config.dataset_test_filename
-        if self.run_top_k > 0:
-            input_fn = self.create_short_file(input_fn)
+        # the first k records are read in place through the line index of the input
+        line_numbers = select_lines(JsonlIndex(input_fn), top_k=self.run_top_k) if self.run_top_k > 0 else None
         output_fn = self.config.dataset_test_result_gpt_4o_baseline_filename
         
-        if os.path.exists(output_fn):
+        if os.path.exists(output_fn) and not self._has_pending_requests(output_fn):
             if skip_if_exists:
                 logger.info(f"Skip running model {model_id}.")
                 return
             else:
                 backup_output_file(output_fn)
         
-        self._run_openai_model(
+        self._run_openai_model_dedup(
             input_jsonl_fn=input_fn,
             output_jsonl_fn=output_fn,
+            store_model="gpt-4o_baseline",
+            line_numbers=line_numbers,
             model=model_id,
             temperature=self.config.inference_base_model_temperature,
-            api_key=os.getenv("OPENAI_API_KEY_BASELINE"),
+            api_keys=self._api_keys(self.config.openai_baseline_api_key_envs),
         )
     
-    def create_short_file(self, input_fn):
-        short_fn = input_fn.replace(".jsonl", f"_top{self.run_top_k}.jsonl")
-        with open(short_fn, 'w') as f:
-            for i, line in enumerate(open(input_fn)):
-                f.write(line)
-                if i + 1 >= self.run_top_k:
-                    break
-        return short_fn
+    def _run_openai_model_dedup(self, input_jsonl_fn, output_jsonl_fn, store_model, line_numbers=None, **kwargs):
+        # starting budgets; the processor follows the limits reported by the API from the first response on
+        kwargs.setdefault("max_requests_per_minute", self.config.openai_max_requests_per_minute)
+        kwargs.setdefault("max_tokens_per_minute", self.config.openai_max_tokens_per_minute)
+        kwargs.setdefault("completion_estimator", self._completion_estimator(input_jsonl_fn))
+        kwargs.setdefault("transport", self.transport)
+        kwargs.setdefault("loop_runner", self._loop_runner)
+        kwargs.setdefault("request_url", self.config.openai_request_url)
+        on_results = None
+        if self.results_store is not None:
+            on_results = lambda results: self.results_store.put_many(self.config.run_id, store_model, results)
+
+        if not self.dedup:
+            self._run_openai_model(input_jsonl_fn=input_jsonl_fn, output_jsonl_fn=output_jsonl_fn, on_results=on_results,
+                                   line_numbers=line_numbers, **kwargs)
+            return
+        unique_fn, index_fn = build_dedup_index(input_jsonl_fn, line_numbers)
+        # the results of the unique requests are resumed after a crash, from the checkpoint of the processor
+        unique_output_fn = self._unique_output_fn(output_jsonl_fn)
+        stored_output_fn = output_jsonl_fn.replace(".jsonl", "_stored.jsonl")
+        unique_line_numbers = None
+        if os.path.exists(stored_output_fn):
+            # left by an interrupted run: its requests are not in the checkpoint, and are sent this time
+            os.remove(stored_output_fn)
+        if self.results_store is not None and not os.path.exists(checkpoint_file(unique_output_fn)):
+            unique_line_numbers = self._reuse_stored_responses(
+                unique_fn, stored_output_fn, store_model, self._additional_params(kwargs.get("model"), kwargs.get("temperature", 0))
+            )
+        self._run_openai_model(input_jsonl_fn=unique_fn, output_jsonl_fn=unique_output_fn, on_results=on_results,
+                               line_numbers=unique_line_numbers, **kwargs)
+        fan_out_results(unique_output_fn, index_fn, output_jsonl_fn)
+        if not os.path.exists(checkpoint_file(unique_output_fn)):
+            # kept while requests failed, so that the next run only sends those again
+            os.remove(unique_output_fn)
+        if os.path.exists(stored_output_fn):
+            fan_out_results(stored_output_fn, index_fn, output_jsonl_fn, append=True)
+            os.remove(stored_output_fn)
+        if self.results_store is not None:
+            # add the duplicates and reused responses, keeping the rows (and latencies) of the requests actually sent
+            self.results_store.import_jsonl(self.config.run_id, store_model, output_jsonl_fn)
+            logger.info(f"Results of {self.config.run_id}/{store_model}: {self.results_store.stats(self.config.run_id, store_model)}")
+
+    def _reuse_stored_responses(self, unique_fn, stored_output_fn, store_model, additional_params):
+        """Write the stored responses of the model to identical requests, from any run, as results
+        Returns: list, the line numbers of the unique requests that still have to be sent
+        """
+        line_numbers = []
+        with open_file(unique_fn, 'rb') as f, JsonlWriter(stored_output_fn) as writer:
+            for line_number, line in enumerate(f):
+                request_json = loads(line)
+                request_json.update(additional_params)
+                metadata = request_json.pop("metadata", None)
+                response = self.results_store.find_response(store_model, request_json)
+                if response is None:
+                    line_numbers.append(line_number)
+                else:
+                    writer.write([request_json, response, metadata])
+        if writer.count:
+            logger.info(f"Reusing {writer.count} stored responses of {store_model}, sending {len(line_numbers)} requests")
+        return line_numbers
+
+    @staticmethod
+    def _additional_params(model, temperature):
+        """Parameters added to every request; if model and temperature are None, the value in the input file is used"""
+        additional_params = {}
+        if model is not None:
+            additional_params["model"] = model
+        if temperature is not None:
+            additional_params["temperature"] = temperature
+        return additional_params
+
+    @staticmethod
+    def _api_keys(env_names):
+        """The keys held in the given environment variables, to balance the requests of a run over"""
+        return parse_api_keys(os.getenv(env_name) for env_name in env_names)
+
+    @staticmethod
+    def _unique_output_fn(output_jsonl_fn):
+        return output_jsonl_fn.replace(".jsonl", "_unique.jsonl")
+
+    def _has_pending_requests(self, output_jsonl_fn):
+        """An interrupted run, or one with failed requests, left a checkpoint to resume from"""
+        return any(
+            os.path.exists(checkpoint_file(fn))
+            for fn in (output_jsonl_fn, self._unique_output_fn(output_jsonl_fn))
+        )
 
+    def _completion_estimator(self, input_jsonl_fn):
+        """Completion length model of past results, or of the reference answers of the input if there are none"""
+        result_files = sorted({
+            fn for pattern in self.config.completion_calibration_files for fn in glob.glob(pattern)
+            # the files of a run in progress may end in a line cut short by a crash
+            if not any(part in os.path.basename(fn) for part in ("_unique", "_stored", "_checkpoint"))
+        })
+        estimator = CompletionLengthEstimator.from_result_files(result_files) if result_files else None
+        if estimator is None:
+            estimator = CompletionLengthEstimator.from_token_counts(ensure_token_counts(input_jsonl_fn, "cl100k_base"))
+        return estimator
 
     @classmethod
     def _run_openai_model(
@@ -86,32 +239,40 @@ class ModelRunner:
         max_attempts=5,
         logging_level=logging.INFO,
         api_key=None,
+        api_keys=None,
+        on_results=None,
+        line_numbers=None,
+        max_requests_per_minute=3_000,
+        max_tokens_per_minute=250_000,
+        completion_estimator=None,
+        transport=None,
+        loop_runner=None,
+        request_url="https://api.openai.com/v1/chat/completions",
     ):
         logger.info(f"Run model [{model}] with input: {input_jsonl_fn}.")
-        # If model and temperature are None, the value in the input file will be used.
-        request_url = "https://api.openai.com/v1/chat/completions"
-        max_requests_per_minute = 3_000 * 0.5
-        max_tokens_per_minute = 250_000 * 0.5
         token_encoding_name = "cl100k_base"
+        # count the prompt tokens in batch up front instead of one request at a time in the event loop
+        ensure_token_counts(input_jsonl_fn, token_encoding_name)
 
-        additional_params = {}
-        if model is not None:
-            additional_params["model"] = model
-        if temperature is not None:
-            additional_params["temperature"] = temperature
+        additional_params = cls._additional_params(model, temperature)
 
-        # run script
-        asyncio.run(
+        # run script, in the event loop of the shared transport if there is one
+        (loop_runner.run if loop_runner is not None else asyncio.run)(
             process_api_requests_from_file_openai(
                 requests_filepath=input_jsonl_fn,
                 save_filepath=output_jsonl_fn,
                 request_url=request_url,
                 api_key=api_key,
+                api_keys=api_keys,
                 max_requests_per_minute=max_requests_per_minute,
                 max_tokens_per_minute=max_tokens_per_minute,
                 token_encoding_name=token_encoding_name,
                 max_attempts=max_attempts,
                 logging_level=logging_level,
                 additional_params=additional_params,
+                on_results=on_results,
+                line_numbers=line_numbers,
+                completion_estimator=completion_estimator,
+                transport=transport,
             )
         )
@@ -0,0 +1,63 @@
+from typing import Dict, List
+import settings
+from lib.io import JsonlWriter, iter_jsonl
+
+# Fields of a compact dataset record that are replaced by the rendered messages
+TEMPLATE_FIELDS = ("template_id", "original", "corrected")
+
+
+def create_record(original: str, corrected: str|None=None, template_id: str|None=None) -> Dict:
+    """Create a compact record that references its prompt template instead of embedding it"""
+    record = {
+        "template_id": template_id or settings.inference_prompt_template_id,
+        "original": original,
+    }
+    if corrected is not None:
+        record["corrected"] = corrected
+    return record
+
+
+def render_messages(record: Dict, include_answer: bool=False) -> List[Dict]:
+    """Render the chat messages of a record.
+    Records that already carry `messages` are returned as they are.
+    Args:
+        record: dict, a compact record (see `create_record`) or a chat record
+        include_answer: bool, append the expected assistant answer, for fine-tuning
+    Returns: list, the chat messages
+    """
+    if "messages" in record:
+        return record["messages"]
+    template_id = record["template_id"]
+    if template_id not in settings.prompt_templates:
+        raise KeyError(f"Unknown prompt template: {template_id}")
+    messages = [
+        {
+            "role": "user",
+            "content": settings.prompt_templates[template_id].format(original=record["original"])
+        },
+    ]
+    if include_answer and record.get("corrected") is not None:
+        messages.append({
+            "role": "assistant",
+            "content": f'{{"corrected": "{record["corrected"]}"}}'
+        })
+    return messages
+
+
+def render_request(record: Dict) -> Dict:
+    """Turn a record into the body of a chat completion request"""
+    if "messages" in record:
+        return record
+    request = {k: v for k, v in record.items() if k not in TEMPLATE_FIELDS}
+    request["messages"] = render_messages(record)
+    return request
+
+
+def export_chat_file(input_file: str, output_file: str) -> int:
+    """Render a file of compact training records into the chat format expected by fine-tuning
+    Returns: int, the number of records written
+    """
+    with JsonlWriter(output_file) as writer:
+        for record in iter_jsonl(input_file):
+            writer.write({"messages": render_messages(record, include_answer=True)})
+    return writer.count
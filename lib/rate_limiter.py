@@ -0,0 +1,182 @@
+import re
+import math
+import time
+import logging
+from typing import Callable, Dict, Mapping
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Continuously refilling budget of `capacity` units per minute, e.g. requests or tokens.
+
+    The bucket starts full. Callers ask how long to wait for an amount with
+    `time_until` and sleep exactly that long instead of polling; an amount
+    larger than the capacity waits for a full bucket.
+    """
+
+    def __init__(self, capacity_per_minute: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.capacity = float(capacity_per_minute)
+        self.available = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    @property
+    def rate(self) -> float:
+        """Refill rate, in units per second."""
+        return self.capacity / 60.0
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` units are available; 0 if they are now."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.available
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, amount: float) -> None:
+        """Take `amount` units; the balance may go negative, which delays later requests."""
+        self._refill()
+        self.available -= amount
+
+    def set_capacity(self, capacity_per_minute: float) -> None:
+        """Change the budget, e.g. to the limit reported by the API; the balance never exceeds it"""
+        self._refill()
+        self.capacity = float(capacity_per_minute)
+        self.available = min(self.available, self.capacity)
+
+    def cap_available(self, amount: float) -> None:
+        """Lower the balance to `amount` if it is higher, e.g. to the budget the API reports as remaining"""
+        self._refill()
+        self.available = min(self.available, amount)
+
+
+DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value: str|None) -> float|None:
+    """Seconds of a rate limit header value, e.g. '2' (Retry-After), '20ms', '1.5s' or '6m0s' (x-ratelimit-reset-*)"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_count(value: str|None) -> float|None:
+    """A non-negative number of a rate limit header value (x-ratelimit-limit-*, x-ratelimit-remaining-*),
+    None if it is missing or malformed"""
+    if value is None:
+        return None
+    try:
+        count = float(value)
+    except ValueError:
+        return None
+    return count if math.isfinite(count) and count >= 0 else None
+
+
+class AdaptiveRateLimiter:
+    """Request and token buckets adjusted live from the rate limit headers of the API responses.
+
+    The configured budgets are only a starting point: the x-ratelimit-limit-*
+    headers replace them with the real limits of the account, and the
+    x-ratelimit-remaining-* headers lower the balance when the API has seen
+    more usage than the buckets did (e.g. another process using the same key).
+    On top of that the budgets follow AIMD control: every rate limit error
+    halves them (at most once per `decrease_interval`), and every success
+    raises them back by `increase_fraction` of the limit. Dispatch is never
+    paused as a whole; the request that hit the limit waits for its
+    `retry_after` (see lib/retry.py).
+    """
+
+    KINDS = ("requests", "tokens")
+
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float, decrease_factor: float = 0.5,
+                 increase_fraction: float = 0.01, min_fraction: float = 0.05, decrease_interval: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self.buckets = {
+            "requests": TokenBucket(max_requests_per_minute, clock=clock),
+            "tokens": TokenBucket(max_tokens_per_minute, clock=clock),
+        }
+        # the highest budgets allowed, i.e. the configured ones until the API reports its own
+        self.limits = {"requests": float(max_requests_per_minute), "tokens": float(max_tokens_per_minute)}
+        self.decrease_factor = decrease_factor
+        self.increase_fraction = increase_fraction
+        self.min_fraction = min_fraction
+        self.decrease_interval = decrease_interval
+        self.last_decrease = float("-inf")
+
+    @property
+    def capacity(self) -> Dict[str, float]:
+        """Current budgets per minute"""
+        return {kind: bucket.capacity for kind, bucket in self.buckets.items()}
+
+    def time_until(self, num_tokens: float) -> float:
+        """Seconds until a request of `num_tokens` tokens may be sent; 0 if it may be sent now."""
+        return max(
+            self.buckets["requests"].time_until(1),
+            self.buckets["tokens"].time_until(num_tokens),
+        )
+
+    def consume(self, num_tokens: float) -> None:
+        self.buckets["requests"].consume(1)
+        self.buckets["tokens"].consume(num_tokens)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Follow the limits and remaining budgets reported by a response; malformed values are ignored"""
+        for kind in self.KINDS:
+            bucket = self.buckets[kind]
+            limit = parse_count(headers.get(f"x-ratelimit-limit-{kind}"))
+            # a limit of 0 would stop the run for good, rather than tell the real limit
+            if limit and limit != self.limits[kind]:
+                logger.info(f"Rate limit of {kind} per minute: {self.limits[kind]:g} -> {limit:g}")
+                self.limits[kind] = limit
+                if bucket.capacity > self.limits[kind]:
+                    bucket.set_capacity(self.limits[kind])
+            remaining = parse_count(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if remaining is not None:
+                bucket.cap_available(remaining)
+
+    def on_success(self) -> None:
+        """Additive increase of the budgets, up to the limits"""
+        for kind, bucket in self.buckets.items():
+            if bucket.capacity < self.limits[kind]:
+                bucket.set_capacity(min(self.limits[kind], bucket.capacity + self.increase_fraction * self.limits[kind]))
+
+    def retry_after(self, headers: Mapping[str, str]) -> float|None:
+        """Seconds to wait before retrying a failed request, from Retry-After or the reset of an exhausted budget"""
+        retry_after_ms = parse_duration(headers.get("retry-after-ms"))
+        if retry_after_ms is not None:
+            return retry_after_ms / 1000
+        retry_after = parse_duration(headers.get("retry-after"))
+        if retry_after is not None:
+            return retry_after
+        resets = [
+            parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            for kind in self.KINDS
+            if headers.get(f"x-ratelimit-remaining-{kind}") in ("0", "0.0")
+        ]
+        resets = [reset for reset in resets if reset is not None]
+        return max(resets) if resets else None
+
+    def on_rate_limit(self) -> None:
+        """Multiplicative decrease of the budgets"""
+        now = self.clock()
+        if now - self.last_decrease < self.decrease_interval:
+            # errors of the requests already in flight belong to the same overload
+            return
+        self.last_decrease = now
+        for kind, bucket in self.buckets.items():
+            bucket.set_capacity(max(self.min_fraction * self.limits[kind], bucket.capacity * self.decrease_factor))
+        logger.warning(f"Rate limit hit, budgets lowered to {self.capacity}")
@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import logging
+from typing import Any, Dict, Iterable, Iterator, List
+
+from lib.dedup import request_key
+from lib.io import dumps, iter_jsonl, loads
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    run TEXT NOT NULL,
+    model TEXT NOT NULL,
+    sentence_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    request TEXT,
+    response TEXT,
+    metadata TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    latency REAL,
+    request_hash TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run, model, sentence_id)
+);
+CREATE INDEX IF NOT EXISTS results_request_hash ON results (model, request_hash, status);
+"""
+
+# A successful result is never replaced by a failed attempt
+UPSERT = """
+INSERT INTO results (run, model, sentence_id, status, request, response, metadata,
+                     prompt_tokens, completion_tokens, latency, request_hash, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (run, model, sentence_id) DO UPDATE SET
+    status = excluded.status,
+    request = excluded.request,
+    response = excluded.response,
+    metadata = excluded.metadata,
+    prompt_tokens = excluded.prompt_tokens,
+    completion_tokens = excluded.completion_tokens,
+    latency = excluded.latency,
+    request_hash = excluded.request_hash,
+    updated_at = excluded.updated_at
+WHERE excluded.status = 'ok' OR results.status != 'ok'
+"""
+
+
+INSERT_IF_MISSING = UPSERT[:UPSERT.index("ON CONFLICT")] + "ON CONFLICT (run, model, sentence_id) DO NOTHING"
+
+
+def response_key(request: Dict) -> str:
+    """Hash of a request, to reuse its response for an identical one. max_tokens only caps the length of
+    the response (see lib/token_counter.py), so it is left out"""
+    return request_key({k: v for k, v in request.items() if k != "max_tokens"})
+
+
+def response_status(response: Any) -> str:
+    """'ok' if the response holds a message content, else 'error'"""
+    try:
+        return "ok" if response["choices"][0]["message"]["content"] is not None else "error"
+    except (IndexError, TypeError, KeyError):
+        return "error"
+
+
+class ResultsStore:
+    """SQLite store of model results keyed by (run, model, sentence_id).
+
+    Every row keeps the [request, response, metadata] of a result as JSON,
+    plus its status, token usage, latency and a hash of the request. The
+    database runs in WAL mode, so results can be queried while a run is
+    writing them. Resuming, reusing the response to an identical request and
+    reading a run in sentence order are indexed queries instead of scans of
+    the JSONL result files.
+    """
+
+    def __init__(self, db_file: str) -> None:
+        self.db_file = db_file
+        path = os.path.dirname(db_file)
+        if path:
+            os.makedirs(path, exist_ok=True)
+        # the connection is used from one thread at a time, e.g. the writer thread of AsyncJsonlWriter
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config) -> "ResultsStore|None":
+        """The store of the settings, or None if it is disabled"""
+        if not getattr(config, "use_results_store", False):
+            return None
+        return cls(config.results_db_filename)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def put(self, run: str, model: str, result: List, latency: float|None=None) -> None:
+        self.put_many(run, model, [(result, latency)])
+
+    def put_many(self, run: str, model: str, results: Iterable[tuple[List, float|None]], replace: bool=True) -> int:
+        """Insert or update [request, response, metadata] results with their latency in one transaction.
+        Results without a sentence_id in their metadata are skipped.
+        Args:
+            replace: bool, update existing rows (unless that would replace a success by a failure);
+                if False, existing rows are kept as they are
+        Returns: int, the number of results given to the database
+        """
+        rows = [row for row in (self._to_row(run, model, result, latency) for result, latency in results) if row]
+        with self.conn:
+            self.conn.executemany(UPSERT if replace else INSERT_IF_MISSING, rows)
+        return len(rows)
+
+    def _to_row(self, run: str, model: str, result: List, latency: float|None) -> tuple|None:
+        request, response = result[0], result[1]
+        metadata = result[2] if len(result) > 2 else {}
+        sentence_id = (metadata or {}).get("sentence_id")
+        if sentence_id is None:
+            return None
+        usage = (response.get("usage") or {}) if isinstance(response, dict) else {}
+        return (
+            run, model, sentence_id, response_status(response),
+            dumps(request), dumps(response), dumps(metadata),
+            usage.get("prompt_tokens"), usage.get("completion_tokens"), latency,
+            response_key(request) if isinstance(request, dict) else None, time.time(),
+        )
+
+    def import_jsonl(self, run: str, model: str, result_file: str, replace: bool=False, batch_size: int=1000) -> int:
+        """Load a JSONL result file, e.g. one written before the store existed; see `put_many` for `replace`"""
+        count = 0
+        batch = []
+        for result in iter_jsonl(result_file):
+            batch.append((result, None))
+            if len(batch) >= batch_size:
+                count += self.put_many(run, model, batch, replace)
+                batch = []
+        count += self.put_many(run, model, batch, replace)
+        logger.info(f"Imported {count} results of {result_file} into {self.db_file} as {run}/{model}")
+        return count
+
+    def completed(self, run: str, model: str) -> Dict[int, List]:
+        """Successful results of a run by sentence_id, to resume it"""
+        rows = self.conn.execute(
+            "SELECT sentence_id, request, response, metadata FROM results WHERE run = ? AND model = ? AND status = 'ok'",
+            (run, model),
+        )
+        return {sentence_id: [loads(request), loads(response), loads(metadata)] for sentence_id, request, response, metadata in rows}
+
+    def find_response(self, model: str, request: Dict) -> Dict|None:
+        """A complete successful response of the model to an identical request, in any run"""
+        rows = self.conn.execute(
+            "SELECT response FROM results WHERE model = ? AND request_hash = ? AND status = 'ok'",
+            (model, response_key(request)),
+        )
+        for (response,) in rows:
+            response = loads(response)
+            # a response cut short by max_tokens is not reused
+            if response["choices"][0].get("finish_reason") != "length":
+                return response
+        return None
+
+    def iter_results(self, run: str, model: str, status: str|None=None) -> Iterator[List]:
+        """[request, response, metadata] results of a run in sentence_id order"""
+        query = "SELECT request, response, metadata FROM results WHERE run = ? AND model = ?"
+        params = [run, model]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        for request, response, metadata in self.conn.execute(query + " ORDER BY sentence_id", params):
+            yield [loads(request), loads(response), loads(metadata)]
+
+    def stats(self, run: str, model: str) -> Dict:
+        row = self.conn.execute(
+            "SELECT COUNT(*), SUM(status = 'ok'), SUM(prompt_tokens), SUM(completion_tokens), AVG(latency) "
+            "FROM results WHERE run = ? AND model = ?",
+            (run, model),
+        ).fetchone()
+        return dict(zip(["results", "succeeded", "prompt_tokens", "completion_tokens", "mean_latency"], row))
@@ -0,0 +1,64 @@
+import heapq
+import time
+import random
+import asyncio
+import itertools
+from typing import Any, Callable
+
+import aiohttp
+
+# Errors that the same request will hit again, however long it waits
+FATAL_STATUSES = {400, 401, 403, 404, 422}
+FATAL_ERROR_CODES = {"insufficient_quota", "context_length_exceeded", "invalid_api_key", "model_not_found"}
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0, rng: Callable[[], float] = random.random) -> float:
+    """Exponential backoff with full jitter: a uniform delay up to min(cap, base * 2 ** attempt) seconds.
+    The jitter spreads out the retries of requests that failed together."""
+    return rng() * min(cap, base * 2 ** attempt)
+
+
+def is_retryable(status: int | None, error: Any) -> bool:
+    """Whether a failed request may succeed if sent again.
+    Args:
+        status: int, the HTTP status of the response, None if there was none
+        error: the `error` object of the response, or the exception raised
+    """
+    if isinstance(error, BaseException):
+        # network errors, timeouts and bodies that are not JSON are transient; anything else is a bug
+        return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ValueError))
+    if isinstance(error, dict) and error.get("code") in FATAL_ERROR_CODES:
+        return False
+    return status not in FATAL_STATUSES
+
+
+class RetryQueue:
+    """Requests waiting to be retried, ordered by the time they are due.
+
+    Every request is pushed with its own delay, so one failure only holds
+    back the request that failed, and the dispatcher sleeps until the next
+    retry is due instead of polling.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self._heap = []
+        self._order = itertools.count()  # keeps requests due at the same time in FIFO order
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, item: Any, delay: float = 0.0) -> None:
+        heapq.heappush(self._heap, (self.clock() + delay, next(self._order), item))
+
+    def pop_due(self) -> Any | None:
+        """The request due first, if it is due now"""
+        if self._heap and self._heap[0][0] <= self.clock():
+            return heapq.heappop(self._heap)[2]
+        return None
+
+    def time_until_due(self) -> float | None:
+        """Seconds until the next request is due, None if the queue is empty"""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self.clock())
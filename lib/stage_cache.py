@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import hashlib
+import inspect
+import logging
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class StageCache:
+    """Content-hash cache for pipeline stages.
+
+    A manifest records, for every stage, a key hashed from the contents of its
+    input files, its settings and its source code, plus the content hashes of
+    the outputs it produced. A stage is re-run only when its key changes;
+    otherwise its outputs are left alone, or restored from the cache store if
+    they were deleted or overwritten since.
+    """
+
+    def __init__(self, manifest_file: str, store_dir: str) -> None:
+        self.manifest_file = manifest_file
+        self.store_dir = store_dir
+        self.manifest = self._load_manifest()
+
+    @classmethod
+    def from_config(cls, config) -> "StageCache":
+        return cls(config.pipeline_manifest_filename, config.stage_cache_dir)
+
+    def run(self, name: str, func: Callable[[], object], inputs: Iterable[str] = (), outputs: Iterable[str] = (),
+            params: dict | None = None, code: Iterable[object] = (), force: bool = False) -> bool:
+        """Run a stage unless its inputs, settings and code are unchanged.
+        Args:
+            name: str, unique name of the stage
+            func: callable, runs the stage and writes `outputs`
+            inputs: paths of the files (or directories) the stage reads
+            outputs: paths of the files the stage writes
+            params: settings that affect the outputs; must be JSON serializable
+            code: modules, classes or functions whose source affects the outputs
+            force: bool, run even if the stage is up to date
+        Returns: bool, True if the stage was run
+        """
+        outputs = list(outputs)
+        key = self.compute_key(inputs, params, code)
+        entry = self.manifest["stages"].get(name)
+        if not force and entry and entry["key"] == key:
+            if self._outputs_match(entry):
+                logger.info(f"Stage {name} is up to date, skip.")
+                return False
+            if self._restore_outputs(entry):
+                logger.info(f"Stage {name} is up to date, restored its outputs from {self.store_dir}.")
+                return False
+            logger.info(f"Stage {name} is up to date but its outputs cannot be restored, re-run.")
+
+        logger.info(f"Running stage {name}...")
+        func()
+        self._record(name, key, outputs)
+        return True
+
+    def compute_key(self, inputs: Iterable[str] = (), params: dict | None = None, code: Iterable[object] = ()) -> str:
+        digest = hashlib.sha256()
+        for path in inputs:
+            digest.update(f"input:{path}:{self.hash_path(path)}\n".encode("utf-8"))
+        digest.update(f"params:{json.dumps(params or {}, sort_keys=True, default=str)}\n".encode("utf-8"))
+        for obj in code:
+            source_file = obj if isinstance(obj, str) else inspect.getsourcefile(obj)
+            digest.update(f"code:{os.path.basename(source_file)}:{self.hash_path(source_file)}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def hash_path(self, path: str) -> str | None:
+        """Content hash of a file, or of every file under a directory; None if missing."""
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    file_path = os.path.join(root, filename)
+                    digest.update(f"{os.path.relpath(file_path, path)}:{self.hash_path(file_path)}\n".encode("utf-8"))
+            return digest.hexdigest()
+        if not os.path.exists(path):
+            return None
+
+        # Reuse the hash of files that have not been touched since they were last hashed
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cached = self.manifest["files"].get(os.path.abspath(path))
+        if cached and cached["signature"] == signature:
+            return cached["sha256"]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.manifest["files"][os.path.abspath(path)] = {"signature": signature, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def _outputs_match(self, entry: dict) -> bool:
+        return all(self.hash_path(path) == sha256 for path, sha256 in entry["outputs"].items())
+
+    def _restore_outputs(self, entry: dict) -> bool:
+        for sha256 in entry["outputs"].values():
+            if sha256 is not None and not os.path.exists(self._store_path(sha256)):
+                return False
+        for path, sha256 in entry["outputs"].items():
+            if sha256 is None or self.hash_path(path) == sha256:
+                continue
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            shutil.copy2(self._store_path(sha256), path)
+        return True
+
+    def _record(self, name: str, key: str, outputs: list[str]) -> None:
+        hashes = {path: self.hash_path(path) for path in outputs}
+        os.makedirs(self.store_dir, exist_ok=True)
+        for path, sha256 in hashes.items():
+            if sha256 is not None and not os.path.exists(self._store_path(sha256)):
+                shutil.copy2(path, self._store_path(sha256))
+
+        previous = self.manifest["stages"].get(name)
+        self.manifest["stages"][name] = {"key": key, "outputs": hashes}
+        if previous:
+            self._prune(previous["outputs"].values())
+        self._save_manifest()
+
+    def _prune(self, candidates: Iterable[str | None]) -> None:
+        """Remove stored outputs that no stage refers to anymore."""
+        in_use = {sha256 for entry in self.manifest["stages"].values() for sha256 in entry["outputs"].values()}
+        for sha256 in candidates:
+            if sha256 is not None and sha256 not in in_use and os.path.exists(self._store_path(sha256)):
+                os.remove(self._store_path(sha256))
+
+    def _store_path(self, sha256: str) -> str:
+        return os.path.join(self.store_dir, sha256)
+
+    def _load_manifest(self) -> dict:
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {"stages": {}, "files": {}}
+
+    def _save_manifest(self) -> None:
+        directory = os.path.dirname(self.manifest_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_file, self.manifest_file)
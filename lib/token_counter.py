@@ -0,0 +1,243 @@
+import os
+import json
+import math
+import logging
+from itertools import islice
+from typing import Dict, Iterable, List
+
+import numpy as np
+import tiktoken
+
+from lib.io import iter_jsonl, loads, read_intact, split_ext
+from lib.prompts import render_messages
+
+logger = logging.getLogger(__name__)
+
+
+def token_counts_file(input_file: str) -> str:
+    return split_ext(input_file)[0] + "_tokens.json"
+
+
+def _file_signature(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def split_messages(record: Dict) -> tuple[List[Dict], str|None]:
+    """Split a record into its prompt messages and the text of its expected answer (if known)"""
+    if "messages" in record:
+        messages = record["messages"]
+        prompt = [m for m in messages if m["role"] != "assistant"]
+        answers = [m["content"] for m in messages if m["role"] == "assistant"]
+        return prompt, answers[-1] if answers else None
+    if record.get("corrected") is None and record.get("metadata", {}).get("corrected") is not None:
+        # test records keep the reference correction in their metadata
+        record = {**record, "corrected": record["metadata"]["corrected"]}
+    messages = render_messages(record, include_answer=True)
+    if messages[-1]["role"] == "assistant":
+        return messages[:-1], messages[-1]["content"]
+    return messages, None
+
+
+def count_tokens(records: Iterable[Dict], encoding, num_threads: int=8) -> tuple[List[int], List[int]]:
+    """Count the prompt and answer tokens of a batch of records with one batch encoding call.
+    Prompt tokens are counted as the chat completions API does (see
+    `num_tokens_consumed_from_request`), without the completion budget.
+    Returns: tuple, prompt token counts and answer token counts (0 if unknown)
+    """
+    texts = []
+    layout = []
+    for record in records:
+        prompt, answer = split_messages(record)
+        layout.append((prompt, answer is not None))
+        for message in prompt:
+            texts.extend(message.values())
+        if answer is not None:
+            texts.append(answer)
+
+    lengths = iter([len(tokens) for tokens in encoding.encode_ordinary_batch(texts, num_threads=num_threads)])
+    prompt_tokens = []
+    answer_tokens = []
+    for prompt, has_answer in layout:
+        num_tokens = 2  # every reply is primed with <im_start>assistant
+        for message in prompt:
+            num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
+            for key in message:
+                num_tokens += next(lengths)
+                if key == "name":  # if there's a name, the role is omitted
+                    num_tokens -= 1
+        prompt_tokens.append(num_tokens)
+        answer_tokens.append(next(lengths) if has_answer else 0)
+    return prompt_tokens, answer_tokens
+
+
+def count_file_tokens(input_file: str, token_encoding_name: str="cl100k_base", num_threads: int|None=None, batch_size: int=4096, encoding=None) -> Dict:
+    """Count the tokens of every record of a jsonl file and save them to a sidecar file.
+    Args:
+        input_file: str, a dataset or requests jsonl file
+        token_encoding_name: str, the tiktoken encoding
+        num_threads: int, the threads used by the batch encoder
+        batch_size: int, the records encoded at a time
+        encoding: the encoder to use instead of `token_encoding_name`
+    Returns: dict, the sidecar content, with per-record `prompt_tokens` and `answer_tokens`
+    """
+    encoding = encoding or tiktoken.get_encoding(token_encoding_name)
+    num_threads = num_threads or os.cpu_count() or 1
+    prompt_tokens = []
+    answer_tokens = []
+    records = iter_jsonl(input_file)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        prompts, answers = count_tokens(batch, encoding, num_threads)
+        prompt_tokens.extend(prompts)
+        answer_tokens.extend(answers)
+
+    counts = {
+        "signature": _file_signature(input_file),
+        "encoding": token_encoding_name,
+        "prompt_tokens": prompt_tokens,
+        "answer_tokens": answer_tokens,
+    }
+    with open(token_counts_file(input_file), 'w', encoding='utf-8') as f:
+        json.dump(counts, f)
+    logger.info(f"Counted {sum(prompt_tokens)} prompt and {sum(answer_tokens)} answer tokens in {len(prompt_tokens)} records of {input_file}")
+    return counts
+
+
+def load_token_counts(input_file: str, token_encoding_name: str="cl100k_base") -> Dict|None:
+    """Load the token counts of a file, or None if they are missing or out of date"""
+    sidecar = token_counts_file(input_file)
+    if not os.path.exists(sidecar):
+        return None
+    with open(sidecar, 'r', encoding='utf-8') as f:
+        counts = json.load(f)
+    if counts["encoding"] != token_encoding_name or counts["signature"] != _file_signature(input_file):
+        return None
+    return counts
+
+
+def ensure_token_counts(input_file: str, token_encoding_name: str="cl100k_base", **kwargs) -> Dict:
+    return load_token_counts(input_file, token_encoding_name) or count_file_tokens(input_file, token_encoding_name, **kwargs)
+
+
+class CompletionLengthEstimator:
+    """Completion tokens of a request as a linear function of its prompt tokens.
+
+    A correction is about the input sentence wrapped in JSON, so its length
+    follows the prompt length (the fixed template only shifts it). The fit
+    gives the completion budget of each request for the token bucket, and
+    its `max_tokens` cap: the estimate plus the `quantile` of the residuals,
+    with `headroom`, so runaway generations are cut short.
+    """
+    def __init__(self, slope: float, intercept: float, residual: float, headroom: float=1.5, min_max_tokens: int=16) -> None:
+        self.slope = slope
+        self.intercept = intercept
+        self.residual = residual
+        self.headroom = headroom
+        self.min_max_tokens = min_max_tokens
+
+    @classmethod
+    def fit(cls, prompt_tokens: List[int], completion_tokens: List[int], quantile: float=0.999, trim: float=0.01,
+            min_samples: int=20, **kwargs) -> "CompletionLengthEstimator|None":
+        """Fit on (prompt tokens, completion tokens) pairs; None if there are fewer than `min_samples`
+        Args:
+            quantile: float, the quantile of the residuals added to the estimate by the cap
+            trim: float, the share of the largest residuals left out of the fit
+        """
+        if len(prompt_tokens) < min_samples:
+            return None
+        x = np.asarray(prompt_tokens, dtype=np.float64)
+        y = np.asarray(completion_tokens, dtype=np.float64)
+        slope, intercept = cls._linear_fit(x, y)
+        # refit without the largest residuals, so a few runaway generations do not skew the line
+        residuals = y - (slope * x + intercept)
+        kept = residuals <= np.quantile(residuals, 1 - trim)
+        x, y = x[kept], y[kept]
+        slope, intercept = cls._linear_fit(x, y)
+        residual = max(float(np.quantile(y - (slope * x + intercept), quantile)), 0.0)
+        logger.info(f"Completion tokens ~ {slope:.3f} * prompt tokens + {intercept:.1f} (+{residual:.1f} at the {quantile} quantile), "
+                    f"fitted on {len(x)} samples")
+        return cls(slope, intercept, residual, **kwargs)
+
+    @classmethod
+    def from_result_files(cls, result_files: Iterable[str], **kwargs) -> "CompletionLengthEstimator|None":
+        """Fit on the `usage` of the successful responses of past result files; lines that
+        cannot be parsed, e.g. cut short by a crash, are skipped"""
+        prompt_tokens = []
+        completion_tokens = []
+        for result_file in result_files:
+            for line in read_intact(result_file).split(b'\n'):
+                try:
+                    result = loads(line)
+                except ValueError:
+                    continue
+                response = result[1] if len(result) > 1 else None
+                usage = response.get("usage") if isinstance(response, dict) else None
+                if usage and usage.get("completion_tokens") is not None:
+                    prompt_tokens.append(usage["prompt_tokens"])
+                    completion_tokens.append(usage["completion_tokens"])
+        return cls.fit(prompt_tokens, completion_tokens, **kwargs)
+
+    @classmethod
+    def from_token_counts(cls, counts: Dict, **kwargs) -> "CompletionLengthEstimator|None":
+        """Fit on the expected answers of a dataset, e.g. the references of the test set"""
+        pairs = [(p, a) for p, a in zip(counts["prompt_tokens"], counts["answer_tokens"]) if a > 0]
+        return cls.fit([p for p, _ in pairs], [a for _, a in pairs], **kwargs)
+
+    @staticmethod
+    def _linear_fit(x: np.ndarray, y: np.ndarray) -> tuple[float, float]:
+        """Least squares line with a non-negative slope"""
+        if np.ptp(x) > 0:
+            slope, intercept = np.polyfit(x, y, 1)
+            if slope > 0:
+                return float(slope), float(intercept)
+        return 0.0, float(y.mean())
+
+    def estimate(self, prompt_tokens: int) -> int:
+        """Expected completion tokens, budgeted in the token bucket"""
+        return max(1, math.ceil(self.slope * prompt_tokens + self.intercept))
+
+    def max_tokens(self, prompt_tokens: int) -> int:
+        """Cap of the completion, sent as the max_tokens of the request"""
+        cap = self.headroom * (self.slope * prompt_tokens + self.intercept + self.residual)
+        return max(self.min_max_tokens, math.ceil(cap))
+
+
+class CostEstimator:
+    """Estimate the training tokens and inference cost of the datasets before running any job"""
+    def __init__(self, config, token_encoding_name="cl100k_base") -> None:
+        self.config = config
+        self.token_encoding_name = token_encoding_name
+
+    def run(self):
+        train = ensure_token_counts(self.config.dataset_train_filename, self.token_encoding_name)
+        val = ensure_token_counts(self.config.dataset_val_filename, self.token_encoding_name)
+        test = ensure_token_counts(self.config.dataset_test_filename, self.token_encoding_name)
+
+        training_tokens = self.training_tokens(train)
+        print(f"Training examples: {len(train['prompt_tokens'])}, validation examples: {len(val['prompt_tokens'])}")
+        print(f"Training tokens per epoch: {training_tokens}, validation tokens: {self.training_tokens(val)}")
+
+        ft_model_id = f"ft:{self.config.fine_tuning_base_model_id}"
+        epochs = self.config.fine_tuning_estimated_epochs
+        price = self.config.model_prices.get(ft_model_id, {}).get("training")
+        if price is not None:
+            print(f"Fine-tuning {self.config.fine_tuning_base_model_id} for {epochs} epochs: "
+                  f"{training_tokens * epochs} tokens, ${training_tokens * epochs * price / 1e6:.2f}")
+
+        input_tokens = sum(test["prompt_tokens"])
+        output_tokens = sum(test["answer_tokens"])
+        print(f"Inference on {len(test['prompt_tokens'])} test sentences: {input_tokens} input tokens, ~{output_tokens} output tokens")
+        for model_id in (self.config.inference_base_model_id, ft_model_id):
+            prices = self.config.model_prices.get(model_id)
+            if prices is None:
+                print(f"  {model_id}: no price in settings.model_prices")
+                continue
+            cost = (input_tokens * prices["input"] + output_tokens * prices["output"]) / 1e6
+            print(f"  {model_id}: ${cost:.2f}")
+
+    @staticmethod
+    def training_tokens(counts: Dict) -> int:
+        return sum(counts["prompt_tokens"]) + sum(counts["answer_tokens"])
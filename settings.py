@@ -8,6 +8,10 @@ test_files = {
     "corrected": "data/output/txt/ABCN.dev.gold.bea19.cor.txt",
 }
 
+# Memory-mapped corpora built by 01_build_m2_corpus.py; used instead of the txt files above when present
+train_corpus_dir = "data/output/corpus/ABC.train.gold.bea19"
+test_corpus_dir = "data/output/corpus/ABCN.dev.gold.bea19"
+
 ################
 # OpenAI models
 
@@ -19,7 +23,13 @@ dataset_test_openai_batch_filename = "data/output/dataset/test_openai_batch.json
 dataset_test_result_gpt_4o_baseline_filename = "data/output/result/test_result_gpt_4o_baseline.jsonl"
 dataset_test_result_gpt_4o_finetuned_filename = "data/output/result/test_result_gpt_4o_finetuned.jsonl"
 
+# Optional SQLite store of the results, keyed by (run_id, model, sentence_id) (see lib/results_store.py)
+use_results_store = False
+results_db_filename = "data/output/result/results.sqlite"
+
 train_rate = 0.8
+# Seed of the hash that assigns each sentence pair to train or val
+train_split_seed = 0
 
 # Job
 run_id = "20250225"
@@ -35,8 +45,49 @@ inference_finetuned_model_temperature = 0
 inference_base_model_id = "gpt-4o-2024-08-06"
 inference_base_model_temperature = 0
 
+openai_request_url = "https://api.openai.com/v1/chat/completions"
+# Starting rate limits of lib/api_request_parallel_processor.py, per minute; they are replaced
+# by the x-ratelimit-limit-* headers of the responses, so they need no headroom
+openai_max_requests_per_minute = 3_000
+openai_max_tokens_per_minute = 250_000
+# Environment variables holding the API keys of each model run; every variable may hold several comma
+# separated keys ("key" or "key:organization"), and the requests of a run are balanced over all of them,
+# each key with its own budgets. Fine-tuned models can only be called by keys of the organization owning them
+openai_baseline_api_key_envs = ["OPENAI_API_KEY_BASELINE", "OPENAI_API_KEY"]
+openai_finetuned_api_key_envs = ["OPENAI_API_KEY"]
+# Past results (backups included) that calibrate the completion tokens budgeted and allowed per
+# request from its prompt length (see lib/token_counter.py); without any, the test references are used.
+# The files of a run in progress (_unique, _stored, _checkpoint) are left out
+completion_calibration_files = [
+    "data/output/result/test_result_gpt_4o_baseline.jsonl",
+    "data/output/result/test_result_gpt_4o_baseline.bk*.jsonl",
+    "data/output/result/test_result_gpt_4o_finetuned.jsonl",
+    "data/output/result/test_result_gpt_4o_finetuned.bk*.jsonl",
+]
+
+# Pooled HTTP transport of the processor, shared by the model runs of ModelRunner (see lib/http_transport.py);
+# timeouts in seconds, compression asks for gzip (and Brotli if the brotli package is installed) responses
+http_pool_size = 100
+http_keepalive_timeout = 30
+http_dns_cache_ttl = 300
+http_connect_timeout = 10
+http_read_timeout = 120
+http_compress = True
+
+# USD per 1M tokens, for the estimates of lib/token_counter.py; fine-tuned models are keyed "ft:{base model}"
+model_prices = {
+    "gpt-4o-2024-08-06": {"input": 2.50, "output": 10.00},
+    "ft:gpt-4o-2024-08-06": {"input": 3.75, "output": 15.00, "training": 25.00},
+}
+# Epochs assumed by the training cost estimate (the job picks them itself)
+fine_tuning_estimated_epochs = 3
+
 DEFAULT_LOG_LEVEL = "INFO"
 
+# Content-hash cache of the pipeline stages (see lib/stage_cache.py)
+pipeline_manifest_filename = "data/output/pipeline_manifest.json"
+stage_cache_dir = "data/output/.stage_cache"
+
 # Add these lines to your existing settings.py
 excel_output_dir = "data/output/excel"
 gpt_4o_baseline_results_excel = "data/output/excel/baseline_results_gpt_4o.xlsx"
@@ -48,6 +99,13 @@ gpt_4o_finetuned_results_excel = "data/output/excel/finetuned_results_gpt_4o.xls
 dataset_test_result_deepseek_baseline_filename = "data/output/result/test_result_deepseek_baseline.jsonl"
 deepseek_baseline_results_excel = "data/output/excel/baseline_results_deepseek.xlsx"
 
+# M2 files aligned from the model corrections (A05_gpt_output_to_m2.py)
+m2_output_dir = "data/output/m2"
+
+# Gold M2 of the test set and span-level scores (A06_gpt_score.py)
+test_m2_file = "data/m2/ABCN.dev.gold.bea19.m2"
+score_output_dir = "data/output/score"
+
 
 inference_prompt_template = """You are an English linguist and your task is to correct the grammatical and mechanical errors in English sentences. 
 Please make only necessary corrections to the extent that a sentence will be free from errors and comprehensible. 
@@ -61,3 +119,10 @@ Please respond in the following JSON format:
 
 The original sentence is:
 {original}"""
+
+# Dataset records reference the prompt by id and are rendered only when sent or exported;
+# add a new id instead of editing a template that existing datasets refer to
+inference_prompt_template_id = "gec-v1"
+prompt_templates = {
+    inference_prompt_template_id: inference_prompt_template,
+}
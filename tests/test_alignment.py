@@ -0,0 +1,28 @@
+import random
+from errant.alignment import align_sentences, format_m2_block
+from errant.converter import apply_edits, convert_m2_to_text
+
+def test_align_replacements():
+    edits = align_sentences("He have a lot of book .", "He has a lot of books .")
+    assert edits == [(1, 2, 'has', 'R:OTHER'), (5, 6, 'books', 'R:OTHER')]
+
+def test_align_identical_is_noop():
+    assert align_sentences("Fine .", "Fine .") == []
+    assert format_m2_block("Fine .", []) == "S Fine .\nA -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0\n"
+
+def test_align_edit_types():
+    edits = align_sentences("I like cats", "I like Cats .")
+    assert edits == [(2, 3, 'Cats .', 'R:OTHER')]
+    edits = align_sentences("I like cats", "I like Cats .", merge=False)
+    assert edits == [(2, 3, 'Cats', 'R:ORTH'), (3, 3, '.', 'M:PUNCT')]
+
+def test_alignment_round_trip():
+    rng = random.Random(0)
+    vocab = "a b the cat cats Cat , . run runs".split()
+    for _ in range(500):
+        original = ' '.join(rng.choice(vocab) for _ in range(rng.randint(1, 10)))
+        hypothesis = ' '.join(rng.choice(vocab) for _ in range(rng.randint(0, 10)))
+        for merge in (True, False):
+            edits = align_sentences(original, hypothesis, merge)
+            block = format_m2_block(original, edits)
+            assert convert_m2_to_text(block)['corrected'] == hypothesis
@@ -0,0 +1,107 @@
+import os
+import asyncio
+import pytest
+from lib import api_request_parallel_processor as processor
+from lib.checkpoint import RequestCheckpoint, checkpoint_file
+from lib.io import JsonlWriter, dumps, read_jsonl
+from lib.mock_openai_server import MockOpenAIServer
+from tests.test_rate_limiter import run_processor
+from tests.test_token_counter import WhitespaceEncoding
+
+def test_recover_drops_unsaved_and_failed_results(tmp_path):
+    requests_file = tmp_path / "requests.jsonl"
+    requests_file.write_text("".join(dumps({"n": i}) + "\n" for i in range(5)), encoding="utf-8")
+    results_file = str(tmp_path / "results.jsonl")
+    checkpoint = RequestCheckpoint(results_file, str(requests_file), {"model": "a"})
+    assert checkpoint.recover() == set()
+
+    # a crash after the results of lines 0-3 were written, but only three checkpoint entries
+    results = [[{"n": i}, {"ok": i} if i != 1 else ["error"]] for i in range(4)]
+    with open(results_file, "w", encoding="utf-8") as f:
+        f.write("".join(dumps(result) + "\n" for result in results) + '[{"n": 4}, {"o')
+    checkpoint.open()
+    checkpoint.record([(0, True), (1, False), (2, True)])
+    checkpoint.close()
+    with open(checkpoint.file_path, "a", encoding="utf-8") as f:
+        f.write("[3, tr")
+
+    assert RequestCheckpoint(results_file, str(requests_file), {"model": "a"}).recover() == {0, 2}
+    assert read_jsonl(results_file) == [results[0], results[2]]
+    assert read_jsonl(checkpoint.file_path)[1:] == [[0, True], [2, True]]
+    assert RequestCheckpoint(results_file, str(requests_file), {"model": "a"}).recover() == {0, 2}
+
+    # the results of another job are set aside
+    assert RequestCheckpoint(results_file, str(requests_file), {"model": "b"}).recover() == set()
+    assert not os.path.exists(results_file)
+    assert read_jsonl(str(tmp_path / "results.bk001.jsonl")) == [results[0], results[2]]
+
+@pytest.mark.parametrize("ext", [".jsonl.gz", ".jsonl.zst"])
+def test_recover_compressed_results_cut_short(tmp_path, ext):
+    requests_file = tmp_path / "requests.jsonl"
+    requests_file.write_text("".join(dumps({"n": i}) + "\n" for i in range(2000)), encoding="utf-8")
+    results_file = str(tmp_path / ("results" + ext))
+    checkpoint = RequestCheckpoint(results_file, str(requests_file))
+    checkpoint.recover()
+
+    # the first 1000 results are on disk, the stream of the next 1000 was cut short by a crash
+    results = [[{"n": i}, {"ok": i}] for i in range(2000)]
+    writer = JsonlWriter(results_file, 'a')
+    for result in results[:1000]:
+        writer.write(result)
+    writer.sync()
+    size = os.path.getsize(results_file)
+    for result in results[1000:]:
+        writer.write(result)
+    writer.close()
+    os.truncate(results_file, (size + os.path.getsize(results_file)) // 2)
+    checkpoint.open()
+    checkpoint.record((i, True) for i in range(2000))
+    checkpoint.close()
+
+    completed = RequestCheckpoint(results_file, str(requests_file)).recover()
+    assert set(range(1000)) <= completed < set(range(2000))
+    assert read_jsonl(results_file) == results[:len(completed)]
+    assert len(read_jsonl(checkpoint.file_path)) == len(completed) + 1
+
+@pytest.mark.parametrize("results_name", ["results.jsonl", "results.jsonl.gz", "results.jsonl.zst"])
+def test_processor_only_resends_failed_requests(tmp_path, monkeypatch, results_name):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run(server):
+        async with server:
+            coroutine, results_file = run_processor(tmp_path, server, 20, results_name=results_name)
+            await coroutine
+            return results_file
+
+    # requests of sentences 0, 5, 10 and 15 fail
+    failing = MockOpenAIServer(latency=0, fail_when=lambda body: int(body["messages"][-1]["content"].split()[-1]) % 5 == 0)
+    results_file = asyncio.run(run(failing))
+    assert failing.num_failed == 4
+    assert os.path.exists(checkpoint_file(results_file))
+
+    healthy = MockOpenAIServer(latency=0)
+    asyncio.run(run(healthy))
+    assert healthy.num_requests == 4
+    results = read_jsonl(results_file)
+    assert sorted(result[2]["sentence_id"] for result in results) == list(range(20))
+    assert all("choices" in result[1] for result in results)
+    assert not os.path.exists(checkpoint_file(results_file))
+
+def test_processor_resumes_after_a_crash(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run(timeout=None):
+        async with MockOpenAIServer(latency=0) as server:
+            # a burst of 600 requests, then 10 per second
+            coroutine, results_file = run_processor(tmp_path, server, 650, max_requests_per_minute=600)
+            try:
+                await asyncio.wait_for(coroutine, timeout)
+            except asyncio.TimeoutError:
+                pass
+            return server, results_file
+
+    crashed, results_file = asyncio.run(run(timeout=1.0))
+    assert 600 <= crashed.num_requests < 650
+    resumed, _ = asyncio.run(run())
+    assert resumed.num_requests <= 650 - crashed.num_requests + 1
+    assert sorted(result[2]["sentence_id"] for result in read_jsonl(results_file)) == list(range(650))
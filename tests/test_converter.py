@@ -1,5 +1,14 @@
+import random
 import pytest
-from errant.converter import convert_m2_to_text
+from errant.converter import (
+    apply_edits,
+    convert_m2_file,
+    convert_m2_to_references,
+    convert_m2_to_text,
+    find_m2_chunks,
+    iter_m2_file,
+    iter_m2_references,
+)
 
 def test_deletion():
     m2_str = """S It 's difficult answer at the question " what are you going to do in the future ? " if the only one who has to know it is in two minds .
@@ -33,3 +42,99 @@ def test_m2_with_empty_string():
 def test_m2_with_invalid_format():
     with pytest.raises(ValueError):
         convert_m2_to_text("Invalid M2 format")
+
+def test_iter_m2_file(tmp_path):
+    m2_path = tmp_path / "sample.m2"
+    m2_path.write_text(
+        "S He have a book .\n"
+        "A 1 2|||R:VERB:SVA|||has|||REQUIRED|||-NONE-|||0\n"
+        "\n"
+        "S Fine .\n"
+        "A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0\n"
+        "\n\n",
+        encoding="utf-8",
+    )
+    results = list(iter_m2_file(str(m2_path)))
+    assert results == [
+        {'original': "He have a book .", 'corrected': "He has a book ."},
+        {'original': "Fine .", 'corrected': "Fine ."},
+    ]
+    assert convert_m2_file(str(m2_path)) == results
+
+def test_stacked_insertions_keep_file_order():
+    m2_str = """S I like .
+A 2 2|||M:DET|||the|||REQUIRED|||-NONE-|||0
+A 2 2|||M:NOUN|||cats|||REQUIRED|||-NONE-|||0
+A 2 3|||R:PUNCT|||!|||REQUIRED|||-NONE-|||0"""
+    result = convert_m2_to_text(m2_str)
+    assert result['corrected'] == "I like the cats !"
+
+def _reference_apply_edits(tokens, edits):
+    # The original quadratic implementation of convert_m2_to_text
+    for start, end, replacement in reversed(edits):
+        if start < 0 or end < 0:
+            continue
+        if replacement == '':
+            tokens = tokens[:start] + tokens[end:]
+        else:
+            tokens = tokens[:start] + [replacement] + tokens[end:]
+    return tokens
+
+@pytest.mark.parametrize("seed", range(20))
+def test_apply_edits_matches_reference(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        n = rng.randint(0, 12)
+        tokens = [f"t{i}" for i in range(n)]
+        edits = []
+        ordered = rng.random() < 0.7
+        pos = 0
+        for k in range(rng.randint(0, 6)):
+            if rng.random() < 0.1:
+                edits.append((-1, -1, '-NONE-'))
+                continue
+            if ordered:
+                start = rng.randint(pos, n) if pos <= n else n
+                end = rng.randint(start, min(n, start + 3))
+                pos = end
+            else:
+                start = rng.randint(0, n + 2)
+                end = rng.randint(start, n + 3)
+            replacement = rng.choice(['', f"r{k}", f"r{k} s{k}"])
+            edits.append((start, end, replacement))
+        assert apply_edits(tokens, edits) == _reference_apply_edits(tokens, edits)
+
+def test_m2_references_per_annotator():
+    m2_str = """S He have a lot of book .
+A 1 2|||R:VERB:SVA|||has|||REQUIRED|||-NONE-|||0
+A 5 6|||R:NOUN:NUM|||books|||REQUIRED|||-NONE-|||1
+A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||2"""
+    result = convert_m2_to_references(m2_str)
+    assert result['corrected'] == "He has a lot of books ."
+    assert result['references'] == {
+        0: "He has a lot of book .",
+        1: "He have a lot of books .",
+        2: "He have a lot of book .",
+    }
+    result = convert_m2_to_references(m2_str, annotators=[1, 3])
+    assert result['references'] == {
+        1: "He have a lot of books .",
+        3: "He have a lot of book .",
+    }
+
+def test_m2_chunks_match_full_file(tmp_path):
+    m2_path = tmp_path / "sample.m2"
+    blocks = [
+        f"S He have {i} book .\nA 1 2|||R:VERB:SVA|||has|||REQUIRED|||-NONE-|||0\n"
+        for i in range(50)
+    ]
+    m2_path.write_text("\n".join(blocks) + "\n", encoding="utf-8")
+    expected = list(iter_m2_references(str(m2_path)))
+
+    chunks = find_m2_chunks(str(m2_path), chunk_size=200)
+    assert len(chunks) > 1
+    assert chunks[0][0] == 0 and chunks[-1][1] == m2_path.stat().st_size
+    results = []
+    for start, end in chunks:
+        results.extend(iter_m2_references(str(m2_path), [0], start=start, end=end))
+    assert results == expected
@@ -0,0 +1,28 @@
+from errant.converter import convert_m2_file
+from errant.corpus import M2Corpus
+
+M2_TEXT = """S He have a lot of book .
+A 1 2|||R:VERB:SVA|||has|||REQUIRED|||-NONE-|||0
+A 5 6|||R:NOUN:NUM|||books|||REQUIRED|||-NONE-|||0
+
+S This sentence has no errors .
+A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0
+
+S I like café .
+A 3 3|||M:NOUN|||très|||REQUIRED|||-NONE-|||1
+"""
+
+def test_corpus_round_trip(tmp_path):
+    m2_path = tmp_path / "sample.m2"
+    m2_path.write_text(M2_TEXT, encoding="utf-8")
+    M2Corpus.build([str(m2_path)], str(tmp_path / "corpus"))
+
+    corpus = M2Corpus(str(tmp_path / "corpus"))
+    expected = convert_m2_file(str(m2_path))
+    assert len(corpus) == 3
+    assert [corpus[i] for i in range(len(corpus))] == expected
+    assert list(corpus.iter_pairs()) == [(r['original'], r['corrected']) for r in expected]
+    assert corpus.tokens(2) == ["I", "like", "café", "."]
+    assert corpus.edits(0) == [(1, 2, "has", 0, "R:VERB:SVA"), (5, 6, "books", 0, "R:NOUN:NUM")]
+    assert corpus.edits(2) == [(3, 3, "très", 1, "M:NOUN")]
+    assert corpus[-1]['corrected'] == "I like café très ."
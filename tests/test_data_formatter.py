@@ -0,0 +1,33 @@
+import os
+from types import SimpleNamespace
+import pandas as pd
+from lib.data_formatter import DataFormatter
+from lib.io import save_to_jsonl
+from lib.prompts import create_record
+from lib.results_store import ResultsStore
+
+def _result(sentence_id, corrected):
+    response = {"choices": [{"message": {"content": f'{{"corrected": "{corrected}"}}'}, "finish_reason": "stop"}]}
+    return [create_record("a b"), response, {"sentence_id": sentence_id, "original": "a b", "corrected": "a c"}]
+
+def test_models_missing_from_the_store_are_formatted_from_their_file(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    store.put_many("run1", "stored", [(_result(i, "from store"), 1.0) for i in range(3)])
+    result_file = str(tmp_path / "other.jsonl")
+    save_to_jsonl([_result(i, "from file") for i in range(2)], result_file)
+    config = SimpleNamespace(excel_output_dir=str(tmp_path / "excel"), run_id="run1")
+    file_pairs = [
+        ("stored", str(tmp_path / "stored.jsonl"), str(tmp_path / "excel" / "stored.xlsx")),
+        ("other", result_file, str(tmp_path / "excel" / "other.xlsx")),
+    ]
+
+    DataFormatter(config, results_store=store).run(file_pairs)
+    assert list(pd.read_excel(file_pairs[0][2])["stored_corrected"]) == ["from store"] * 3
+    assert list(pd.read_excel(file_pairs[1][2])["other_corrected"]) == ["from file"] * 2
+
+    # existing outputs are kept
+    store.put_many("run1", "stored", [(_result(3, "from store"), 1.0)])
+    mtimes = [os.path.getmtime(output_file) for _, _, output_file in file_pairs]
+    DataFormatter(config, results_store=store).run(file_pairs)
+    assert [os.path.getmtime(output_file) for _, _, output_file in file_pairs] == mtimes
+    assert len(pd.read_excel(file_pairs[0][2])) == 3
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+from lib.dataset_preparation import DatasetPreparation
+from lib.io import read_jsonl
+from lib.stage_cache import StageCache
+
+def make_config(tmp_path, num_sentences=2000, **kwargs):
+    original = tmp_path / "orig.txt"
+    corrected = tmp_path / "cor.txt"
+    original.write_text("".join(f"sentence number {i} .\n" for i in range(num_sentences)), encoding="utf-8")
+    corrected.write_text("".join(f"Sentence number {i} .\n" for i in range(num_sentences)), encoding="utf-8")
+    files = {"original": str(original), "corrected": str(corrected)}
+    # no train_corpus_dir / test_corpus_dir / train_split_seed: the optional settings are missing
+    return SimpleNamespace(
+        train_files=files,
+        test_files=files,
+        dataset_train_filename=str(tmp_path / "out" / "train.jsonl"),
+        dataset_val_filename=str(tmp_path / "out" / "val.jsonl"),
+        dataset_test_filename=str(tmp_path / "out" / "test.jsonl"),
+        train_rate=0.8,
+        inference_prompt_template_id="default",
+        **kwargs,
+    )
+
+def test_hash_split_is_stable_and_proportional(tmp_path):
+    config = make_config(tmp_path)
+    pairs = [(f"sentence number {i} .", f"Sentence number {i} .") for i in range(2000)]
+    split = [DatasetPreparation(config).is_train_example(*pair) for pair in pairs]
+    assert split == [DatasetPreparation(config).is_train_example(*pair) for pair in pairs]
+    assert 0.77 < sum(split) / len(split) < 0.83
+    # the seed reshuffles the split
+    reseeded = make_config(tmp_path, train_split_seed=1)
+    assert split != [DatasetPreparation(reseeded).is_train_example(*pair) for pair in pairs]
+
+def test_streamed_datasets_through_the_cache(tmp_path):
+    config = make_config(tmp_path)
+    cache = StageCache(str(tmp_path / "manifest.json"), str(tmp_path / "store"))
+    DatasetPreparation(config).run(cache=cache)
+
+    train = read_jsonl(config.dataset_train_filename)
+    val = read_jsonl(config.dataset_val_filename)
+    assert len(train) + len(val) == 2000
+    assert {record["original"] for record in train}.isdisjoint(record["original"] for record in val)
+    test = read_jsonl(config.dataset_test_filename)
+    assert [record["metadata"]["sentence_id"] for record in test] == list(range(1, 2001))
+
+    # a second run is up to date and writes the same split
+    first_train = open(config.dataset_train_filename, encoding="utf-8").read()
+    cache = StageCache(str(tmp_path / "manifest.json"), str(tmp_path / "store"))
+    DatasetPreparation(config).run(cache=cache, force=True)
+    assert open(config.dataset_train_filename, encoding="utf-8").read() == first_train
@@ -0,0 +1,68 @@
+import json
+from lib.dedup import build_dedup_index, fan_out_results, load_previous_results
+from lib.prompts import create_record
+
+def _record(sentence_id, original, corrected):
+    record = create_record(original, corrected)
+    record["metadata"] = {"sentence_id": sentence_id, "original": original, "corrected": corrected}
+    return record
+
+def test_dedup_and_fan_out(tmp_path):
+    input_file = tmp_path / "test.jsonl"
+    records = [_record(1, "a b", "a c"), _record(2, "x", "y"), _record(3, "a b", "a d"), _record(4, "a b", "a c")]
+    input_file.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+
+    unique_file, index_file = build_dedup_index(str(input_file))
+    unique = [json.loads(line) for line in open(unique_file, encoding="utf-8")]
+    assert [r["metadata"]["sentence_id"] for r in unique] == [1, 2]
+
+    # results of the unique requests, in completion order
+    result_file = tmp_path / "result_unique.jsonl"
+    results = [[{"original": "x"}, {"answer": "y"}, {"sentence_id": 2}],
+               [{"original": "a b"}, {"answer": "a c"}, {"sentence_id": 1}]]
+    result_file.write_text("".join(json.dumps(r) + "\n" for r in results), encoding="utf-8")
+
+    output_file = tmp_path / "result.jsonl"
+    assert fan_out_results(str(result_file), index_file, str(output_file)) == 4
+    fanned = [json.loads(line) for line in open(output_file, encoding="utf-8")]
+    assert sorted(r[2]["sentence_id"] for r in fanned) == [1, 2, 3, 4]
+    by_id = {r[2]["sentence_id"]: r for r in fanned}
+    assert by_id[3][1] == {"answer": "a c"}
+    # every copy carries the metadata of its own sentence
+    assert by_id[3][2] == records[2]["metadata"]
+
+def test_dedup_selected_lines(tmp_path):
+    input_file = tmp_path / "test.jsonl"
+    records = [_record(1, "a b", "a c"), _record(2, "x", "y"), _record(3, "a b", "a d"), _record(4, "a b", "a c")]
+    input_file.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+
+    unique_file, index_file = build_dedup_index(str(input_file), [2, 3], base_name=str(tmp_path / "run"))
+    assert unique_file == str(tmp_path / "run_unique.jsonl")
+    assert [json.loads(line)["metadata"]["sentence_id"] for line in open(unique_file, encoding="utf-8")] == [3]
+    assert json.load(open(index_file, encoding="utf-8"))["groups"] == {"3": [3, 4]}
+
+def test_resume_from_unique_results_cut_short(tmp_path):
+    input_file = tmp_path / "test.jsonl"
+    records = [_record(i, f"s{(i + 1) // 2}", "c") for i in range(1, 9)]
+    input_file.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+    unique_file, index_file = build_dedup_index(str(input_file), base_name=str(tmp_path / "result_requests"))
+    assert [json.loads(line)["metadata"]["sentence_id"] for line in open(unique_file, encoding="utf-8")] == [1, 3, 5, 7]
+
+    # an earlier complete run failed on sentence 1; the next one crashed after the results of 1 and 5
+    ok = lambda i: [{"original": f"s{(i + 1) // 2}"}, {"answer": i}, {"sentence_id": i}]
+    (tmp_path / "result.jsonl").write_text("".join(json.dumps(r) + "\n" for r in [
+        [{}, {"error": "x"}, {"sentence_id": 1}], [{}, {"error": "x"}, {"sentence_id": 2}]]), encoding="utf-8")
+    (tmp_path / "result_unique.jsonl").write_text(
+        json.dumps(ok(1)) + "\n" + json.dumps(ok(5)) + "\n" + '[{"original": "s4"}, {"ans', encoding="utf-8")
+
+    previous = load_previous_results([str(tmp_path / "result.jsonl"), str(tmp_path / "result_unique.jsonl"), None],
+                                     lambda response: "answer" in response)
+    assert previous == {1: ok(1), 5: ok(5)}
+
+    # the resumed run only sends the unique requests of sentences 3 and 7
+    result_file = tmp_path / "resumed_unique.jsonl"
+    result_file.write_text("".join(json.dumps(r) + "\n" for r in [previous[1], ok(3), previous[5], ok(7)]), encoding="utf-8")
+    output_file = tmp_path / "resumed.jsonl"
+    assert fan_out_results(str(result_file), index_file, str(output_file)) == 8
+    fanned = [json.loads(line) for line in open(output_file, encoding="utf-8")]
+    assert {r[2]["sentence_id"]: r[1]["answer"] for r in fanned} == {1: 1, 2: 1, 3: 3, 4: 3, 5: 5, 6: 5, 7: 7, 8: 7}
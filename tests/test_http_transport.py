@@ -0,0 +1,41 @@
+import asyncio
+from lib import api_request_parallel_processor as processor
+from lib.http_transport import HttpTransport
+from lib.mock_openai_server import MockOpenAIServer
+from tests.test_rate_limiter import write_requests
+from tests.test_token_counter import WhitespaceEncoding
+
+def test_runs_share_warm_connections(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+    requests_file = str(tmp_path / "requests.jsonl")
+    write_requests(requests_file, 20)
+
+    async def run_models(transport):
+        async with MockOpenAIServer(latency=0.01) as server:
+            for model in ["baseline", "finetuned"]:
+                await processor.process_api_requests_from_file_openai(
+                    requests_filepath=requests_file,
+                    save_filepath=str(tmp_path / f"{model}_results.jsonl"),
+                    request_url=server.url,
+                    api_key="mock",
+                    max_requests_per_minute=1e9,
+                    max_tokens_per_minute=1e12,
+                    token_encoding_name="cl100k_base",
+                    max_attempts=1,
+                    logging_level=30,
+                    additional_params={"model": model},
+                    transport=transport,
+                )
+                # a shared transport stays open between runs
+                assert transport._session is not None and not transport._session.closed
+            await transport.close()
+
+    transport = HttpTransport(pool_size=5)
+    asyncio.run(run_models(transport))
+    metrics = transport.metrics()
+    # the pool bounds the connections, and the second run only reuses them
+    assert metrics["connections_created"] <= 5
+    assert metrics["connections_reused"] >= 40 - 5
+    assert metrics["cold_request_ms"]["count"] == metrics["connections_created"]
+    assert metrics["warm_request_ms"]["count"] == 40 - metrics["connections_created"]
+    assert transport._session is None
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from lib import io
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(io, "orjson", None)
+    elif io.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+def test_jsonl_round_trip(tmp_path, backend):
+    records = [{"original": "Ça va ?", "n": 1}, [{"messages": []}, {"error": "x\ny"}, {"sentence_id": 2}]]
+    file_path = str(tmp_path / "out" / "data.jsonl")
+    with io.JsonlWriter(file_path, batch_size=1) as writer:
+        writer.write(records[0])
+    io.append_to_jsonl(records[1], file_path)
+    assert io.read_jsonl(file_path) == records
+    assert list(io.iter_jsonl(file_path)) == records
+
+    assert io.save_to_jsonl(iter(records), file_path) == 2
+    # blank lines, e.g. a trailing empty line, are skipped
+    with open(file_path, "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert io.read_jsonl(file_path) == records
+
+def test_write_line_keeps_serialized_records(tmp_path, backend):
+    file_path = str(tmp_path / "data.jsonl")
+    with io.JsonlWriter(file_path) as writer:
+        writer.write_line('{"a": 1}')
+        writer.write_line(b'{"b": 2}\n')
+    assert writer.count == 2
+    with open(file_path, encoding="utf-8") as f:
+        assert f.read() == '{"a": 1}\n{"b": 2}\n'
+    assert io.loads(io.dumps({1: "x"})) == {"1": "x"}
+
+@pytest.mark.parametrize("ext", [".jsonl.gz", ".jsonl.zst"])
+def test_compressed_jsonl(tmp_path, ext):
+    if ext.endswith(".zst") and io.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    file_path = str(tmp_path / f"result{ext}")
+    records = [{"sentence_id": i, "content": "He has a book ." * 10} for i in range(100)]
+    with io.JsonlWriter(file_path, batch_size=7) as writer:
+        for record in records[:50]:
+            writer.write(record)
+    # appending adds a new compressed member/frame that is read back seamlessly
+    for record in records[50:]:
+        io.append_to_jsonl(record, file_path)
+    assert io.read_jsonl(file_path) == records
+    with io.open_file(file_path, "r") as f:
+        assert f.readline().startswith('{"sentence_id":0')
+    assert io.split_ext(file_path) == (str(tmp_path / "result"), ext)
+
+def test_async_writer_batches_and_dedupes(tmp_path):
+    file_path = str(tmp_path / "results.jsonl")
+
+    async def produce():
+        async with io.AsyncJsonlWriter(file_path, batch_size=4, flush_interval=0.05) as writer:
+            for task_id in range(10):
+                assert writer.put({"task_id": task_id}, key=task_id)
+                await asyncio.sleep(0)
+            # a retried request that completes twice is written once
+            assert not writer.put({"task_id": 3, "retry": True}, key=3)
+            await asyncio.sleep(0.2)
+            # flushed by the time threshold, before the writer is closed
+            assert len(io.read_jsonl(file_path)) == 10
+            writer.put({"task_id": 10}, key=10)
+        return writer
+
+    writer = asyncio.run(produce())
+    assert writer.count == 11 and writer.num_duplicates == 1
+    assert [r["task_id"] for r in io.read_jsonl(file_path)] == list(range(11))
@@ -0,0 +1,54 @@
+import os
+import json
+import pytest
+from lib.io import save_to_jsonl
+from lib.jsonl_index import JsonlIndex, select_lines
+
+@pytest.fixture
+def dataset(tmp_path):
+    file_path = str(tmp_path / "test.jsonl")
+    save_to_jsonl([{"original": "x" * i, "metadata": {"sentence_id": 100 + i}} for i in range(50)], file_path)
+    return file_path
+
+def test_random_access(dataset):
+    index = JsonlIndex(dataset)
+    assert len(index) == 50
+    assert index.record(7)["metadata"]["sentence_id"] == 107
+    assert [r["metadata"]["sentence_id"] for r in index.records([3, 1])] == [103, 101]
+    assert index.find_sentence_ids([149, 100]) == [49, 0]
+    with pytest.raises(KeyError):
+        index.find_sentence_ids([7])
+
+    # shards cover every line once
+    shards = [index.shard(i, 4) for i in range(4)]
+    assert [i for shard in shards for i in shard] == list(range(50))
+
+def test_select_lines(dataset):
+    index = JsonlIndex(dataset)
+    assert list(select_lines(index, top_k=3)) == [0, 1, 2]
+    sample = select_lines(index, sample=10, seed=1)
+    assert len(sample) == 10 and sample == sorted(sample) and sample == select_lines(index, sample=10, seed=1)
+    assert select_lines(index, sentence_ids=[110, 140], shard=(0, 2)) == [10]
+
+def test_index_is_rebuilt_when_the_file_changes(dataset):
+    assert len(JsonlIndex(dataset)) == 50
+    with open(dataset, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"original": "no newline"}))
+    index = JsonlIndex(dataset)
+    assert len(index) == 51
+    assert index.record(50) == {"original": "no newline"}
+    assert index.sentence_ids[50] == -1
+
+def test_sentence_ids_are_rebuilt_with_the_offsets(dataset, tmp_path):
+    index = JsonlIndex(dataset)
+    assert index.sentence_ids[0] == 100
+    stat = os.stat(dataset)
+    # the file is replaced by another one of a different size, restored with its old mtime
+    save_to_jsonl([{"original": "y", "metadata": {"sentence_id": 200 + i}} for i in range(60)], dataset)
+    os.utime(dataset, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    index = JsonlIndex(dataset)
+    assert len(index) == 60
+    assert index.sentence_ids[0] == 200
+    assert index.find_sentence_ids([259]) == [59]
+    # the index files were moved into place
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
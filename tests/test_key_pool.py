@@ -0,0 +1,91 @@
+import time
+import asyncio
+from lib import api_request_parallel_processor as processor
+from lib.io import read_jsonl
+from lib.key_pool import KeyPool, parse_api_keys
+from lib.mock_openai_server import MockOpenAIServer
+from tests.test_rate_limiter import FakeClock, run_processor
+from tests.test_token_counter import WhitespaceEncoding
+
+def test_parse_api_keys():
+    assert parse_api_keys(["sk-a, sk-b:org-1", None, "", "sk-a"]) == ["sk-a", "sk-b:org-1"]
+    pool = KeyPool.from_api_keys(["sk-a", "sk-b:org-1"], 60, 1000)
+    assert pool.keys[1].headers == {"Authorization": "Bearer sk-b", "OpenAI-Organization": "org-1"}
+
+def test_requests_go_to_the_key_with_capacity():
+    clock = FakeClock()
+    pool = KeyPool.from_api_keys(["sk-a", "sk-b"], 60, 1000, clock=clock)
+    a, b = pool.keys
+    # the load is spread while both keys have capacity
+    key, wait = pool.select(100)
+    assert (key, wait) == (a, 0)
+    a.limiter.consume(100)
+    assert pool.select(100) == (b, 0)
+
+    # a throttled key does not hold back the other one
+    a.limiter.update({"x-ratelimit-remaining-requests": "0"})
+    assert pool.select(100) == (b, 0)
+    assert pool.can_send_elsewhere(a, 100)
+    b.limiter.consume(1000)
+    key, wait = pool.select(100)
+    assert key is a and wait == 1
+
+def test_failing_keys_are_put_aside_but_never_all():
+    clock = FakeClock()
+    pool = KeyPool.from_api_keys(["sk-a", "sk-b"], 60, 1000, clock=clock, failure_threshold=2)
+    a, b = pool.keys
+    pool.on_failure(a)
+    assert a.healthy
+    pool.on_failure(a)
+    pool.on_failure(a)  # the cooldown doubles
+    assert not a.healthy and a.time_until(1) == 2
+    # b stays in use whatever happens, as the last healthy key
+    for _ in range(5):
+        pool.on_failure(b)
+    assert b.healthy
+    assert not pool.disable(b, "invalid_api_key")
+    clock.now = 2
+    a.on_success()
+    assert pool.disable(a, "invalid_api_key")
+    assert pool.select(1) == (b, 0)
+
+def test_processor_balances_requests_over_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run():
+        # a burst of 600 requests per key, then 10 per second; a single key would take 40 s
+        async with MockOpenAIServer(latency=0, requests_per_minute=600, invalid_keys={"sk-revoked"}) as server:
+            coroutine, results_file = run_processor(
+                tmp_path, server, 1000, max_requests_per_minute=600, max_attempts=3,
+                api_keys=["sk-first", "sk-revoked", "sk-second"],
+            )
+            start = time.perf_counter()
+            await coroutine
+            return server, time.perf_counter() - start, results_file
+
+    server, elapsed, results_file = asyncio.run(run())
+    assert elapsed < 10
+    assert server.num_rate_limited == 0
+    assert set(server.requests_per_key) == {"sk-first", "sk-second"}
+    assert sum(server.requests_per_key.values()) == 1000
+    results = read_jsonl(results_file)
+    assert sorted(result[2]["sentence_id"] for result in results) == list(range(1000))
+    assert all("choices" in result[1] for result in results)
+
+def test_processor_disables_a_key_out_of_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run():
+        async with MockOpenAIServer(latency=0, exhausted_keys={"sk-exhausted"}) as server:
+            coroutine, results_file = run_processor(
+                tmp_path, server, 40, api_keys=["sk-exhausted", "sk-funded"],
+            )
+            await coroutine
+            return server, results_file
+
+    server, results_file = asyncio.run(run())
+    assert server.num_rate_limited == 0
+    assert server.requests_per_key == {"sk-funded": 40}
+    results = read_jsonl(results_file)
+    assert sorted(result[2]["sentence_id"] for result in results) == list(range(40))
+    assert all("choices" in result[1] for result in results)
@@ -0,0 +1,123 @@
+import os
+import asyncio
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+# lib/finetuning_helper.py creates its OpenAI client on import, which needs a key
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+from lib import api_request_parallel_processor as processor
+from lib.io import JsonlWriter, read_jsonl
+from lib.mock_openai_server import MockOpenAIServer
+from lib.model_runner import ModelRunner
+from lib.prompts import create_record
+from lib.results_store import ResultsStore
+from lib.stage_cache import StageCache
+from tests.test_token_counter import WhitespaceEncoding
+
+@contextmanager
+def serve_in_thread(server):
+    """Run the mock server in its own event loop, as ModelRunner runs its own"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+def make_config(tmp_path, server, num_sentences=30, run_id="run1"):
+    test_file = str(tmp_path / "test.jsonl")
+    with JsonlWriter(test_file) as writer:
+        for i in range(1, num_sentences + 1):
+            # every sentence appears twice, so half of the requests are duplicates
+            original = f"sentence number {(i + 1) // 2} ."
+            record = create_record(original)
+            record["metadata"] = {"sentence_id": i, "original": original, "corrected": original}
+            writer.write(record)
+    return SimpleNamespace(
+        run_id=run_id,
+        dataset_test_filename=test_file,
+        dataset_test_result_gpt_4o_baseline_filename=str(tmp_path / "result" / "baseline.jsonl"),
+        inference_base_model_id="mock",
+        inference_base_model_temperature=0,
+        prompt_templates={},
+        openai_request_url=server.url,
+        openai_max_requests_per_minute=1e9,
+        openai_max_tokens_per_minute=1e12,
+        openai_baseline_api_key_envs=["MOCK_OPENAI_API_KEY"],
+        completion_calibration_files=[],
+        http_pool_size=10,
+        http_keepalive_timeout=30,
+        http_dns_cache_ttl=300,
+        http_connect_timeout=10,
+        http_read_timeout=30,
+        http_compress=True,
+    )
+
+def setup_env(monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+    monkeypatch.setenv("MOCK_OPENAI_API_KEY", "sk-mock")
+
+def sentence_ids(result_file):
+    return sorted(result[2]["sentence_id"] for result in read_jsonl(result_file))
+
+def test_stored_responses_are_reused_across_runs(tmp_path, monkeypatch):
+    setup_env(monkeypatch)
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    with serve_in_thread(MockOpenAIServer(latency=0)) as server:
+        config = make_config(tmp_path, server)
+        ModelRunner(config, results_store=store).run(fine_tuned=False)
+        assert server.num_requests == 15
+        assert store.stats("run1", "gpt-4o_baseline")["succeeded"] == 30
+
+        # another run of the same model sends nothing: every unique request has a stored response
+        config.run_id = "run2"
+        ModelRunner(config, results_store=store).run(fine_tuned=False, skip_if_exists=False)
+        assert server.num_requests == 15
+    assert sentence_ids(config.dataset_test_result_gpt_4o_baseline_filename) == list(range(1, 31))
+    assert store.stats("run2", "gpt-4o_baseline")["succeeded"] == 30
+    assert not os.path.exists(str(tmp_path / "result" / "baseline_stored.jsonl"))
+
+def test_cached_run_with_failed_requests_is_resumed(tmp_path, monkeypatch):
+    setup_env(monkeypatch)
+    cache = StageCache(str(tmp_path / "manifest.json"), str(tmp_path / "store"))
+    # the requests of sentences 1, 4 and 7 fail for good
+    failing = MockOpenAIServer(latency=0, fail_status=400, fail_when=lambda body: body["messages"][-1]["content"].split()[-2] in {"1", "4", "7"})
+    with serve_in_thread(failing) as server:
+        config = make_config(tmp_path, server, num_sentences=20)
+        ModelRunner(config).run(fine_tuned=False, cache=cache)
+    assert failing.num_failed == 3
+    output_file = config.dataset_test_result_gpt_4o_baseline_filename
+    assert ModelRunner(config)._has_pending_requests(output_file)
+
+    # the stage was recorded, yet the next run resumes it and only sends the failed requests
+    with serve_in_thread(MockOpenAIServer(latency=0)) as server:
+        config.openai_request_url = server.url
+        ModelRunner(config).run(fine_tuned=False, cache=cache)
+        assert server.num_requests == 3
+    results = read_jsonl(output_file)
+    assert sorted(result[2]["sentence_id"] for result in results) == list(range(1, 21))
+    assert all("choices" in result[1] for result in results)
+    assert not ModelRunner(config)._has_pending_requests(output_file)
+
+def test_crashed_run_with_a_torn_results_file_is_resumed(tmp_path, monkeypatch):
+    setup_env(monkeypatch)
+    failing = MockOpenAIServer(latency=0, fail_status=400, fail_when=lambda body: body["messages"][-1]["content"].split()[-2] in {"1", "4"})
+    with serve_in_thread(failing) as server:
+        config = make_config(tmp_path, server, num_sentences=20)
+        config.completion_calibration_files = [str(tmp_path / "result" / "baseline*.jsonl")]
+        ModelRunner(config).run(fine_tuned=False)
+    # the results of the unique requests end in a line cut short by a crash
+    unique_file = str(tmp_path / "result" / "baseline_unique.jsonl")
+    with open(unique_file, "ab") as f:
+        f.write(b'[{"model": "mock"}, {"id": "chatcmpl-')
+
+    with serve_in_thread(MockOpenAIServer(latency=0)) as server:
+        config.openai_request_url = server.url
+        ModelRunner(config).run(fine_tuned=False, skip_if_exists=False)
+        assert server.num_requests == 2
+    assert sentence_ids(config.dataset_test_result_gpt_4o_baseline_filename) == list(range(1, 21))
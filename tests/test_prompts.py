@@ -0,0 +1,27 @@
+import json
+import settings
+from lib.prompts import create_record, export_chat_file, render_messages, render_request
+
+def test_render_compact_record():
+    record = create_record("He have a book .", "He has a book .")
+    assert record == {"template_id": settings.inference_prompt_template_id, "original": "He have a book .", "corrected": "He has a book ."}
+
+    messages = render_messages(record)
+    assert messages == [{"role": "user", "content": settings.inference_prompt_template.format(original="He have a book .")}]
+    messages = render_messages(record, include_answer=True)
+    assert messages[1] == {"role": "assistant", "content": '{"corrected": "He has a book ."}'}
+
+def test_render_request_keeps_parameters():
+    record = create_record("He have a book .")
+    record["model"] = "gpt-4o"
+    request = render_request(record)
+    assert set(request) == {"model", "messages"}
+    # chat records are passed through unchanged
+    assert render_request(request) is request
+
+def test_export_chat_file(tmp_path):
+    compact = tmp_path / "train.jsonl"
+    compact.write_text(json.dumps(create_record("a", "b")) + "\n", encoding="utf-8")
+    assert export_chat_file(str(compact), str(tmp_path / "train_chat.jsonl")) == 1
+    exported = json.loads((tmp_path / "train_chat.jsonl").read_text(encoding="utf-8"))
+    assert [m["role"] for m in exported["messages"]] == ["user", "assistant"]
@@ -0,0 +1,148 @@
+import time
+import asyncio
+import logging
+from lib import api_request_parallel_processor as processor
+from lib.io import JsonlWriter, read_jsonl
+from lib.mock_openai_server import MockOpenAIServer
+from lib.prompts import create_record
+from lib.rate_limiter import AdaptiveRateLimiter, TokenBucket, parse_duration
+from tests.test_token_counter import WhitespaceEncoding
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_token_bucket_waits_for_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock)  # one unit per second
+    assert bucket.time_until(60) == 0
+    bucket.consume(59)
+    assert bucket.time_until(1) == 0
+    assert bucket.time_until(3) == 2
+    bucket.consume(3)  # borrowing delays the next requests
+    assert bucket.time_until(1) == 3
+    clock.now = 3
+    assert bucket.time_until(1) == 0
+    # refills up to the capacity only, and an amount above it waits for a full bucket
+    clock.now = 1000
+    assert bucket.time_until(100) == 0
+    bucket.consume(100)
+    assert bucket.time_until(1) == 41
+
+def write_requests(file_path, num_requests):
+    with JsonlWriter(file_path) as writer:
+        for i in range(num_requests):
+            record = create_record(f"sentence {i}")
+            record["metadata"] = {"sentence_id": i}
+            writer.write(record)
+
+def run_processor(tmp_path, server, num_requests, max_requests_per_minute=1e9, max_attempts=1,
+                  results_name="results.jsonl", **kwargs):
+    requests_file = str(tmp_path / "requests.jsonl")
+    results_file = str(tmp_path / results_name)
+    write_requests(requests_file, num_requests)
+    return processor.process_api_requests_from_file_openai(
+        requests_filepath=requests_file,
+        save_filepath=results_file,
+        request_url=server.url,
+        api_key="mock",
+        max_requests_per_minute=max_requests_per_minute,
+        max_tokens_per_minute=1e12,
+        token_encoding_name="cl100k_base",
+        max_attempts=max_attempts,
+        logging_level=logging.WARNING,
+        additional_params={"model": "mock"},
+        **kwargs,
+    ), results_file
+
+def test_processor_sleeps_while_requests_are_in_flight(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run():
+        async with MockOpenAIServer(latency=1.0) as server:
+            run, results_file = run_processor(tmp_path, server, 20)
+            cpu_start = time.process_time()
+            await run
+            return server, time.process_time() - cpu_start, results_file
+
+    server, cpu, results_file = asyncio.run(run())
+    assert server.num_requests == 20
+    assert server.max_in_flight == 20
+    assert sorted(result[2]["sentence_id"] for result in read_jsonl(results_file)) == list(range(20))
+    # the loop sleeps until responses arrive instead of waking up every millisecond
+    assert cpu < 0.5
+
+def test_processor_dispatches_at_the_request_rate(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run():
+        async with MockOpenAIServer(latency=0) as server:
+            run, _ = run_processor(tmp_path, server, 605, max_requests_per_minute=600)
+            start = time.perf_counter()
+            await run
+            return server, time.perf_counter() - start
+
+    server, wall = asyncio.run(run())
+    assert server.num_requests == 605
+    # a burst of a minute's budget, then 10 requests per second
+    assert 0.4 < wall < 3
+
+def test_parse_duration():
+    assert parse_duration("2") == 2
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("6m0s") == 360
+    assert parse_duration(None) is None and parse_duration("soon") is None
+
+def test_adaptive_limiter_follows_headers_and_aimd():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(6_000, 1_000_000, clock=clock)
+    limiter.update({"x-ratelimit-limit-requests": "600", "x-ratelimit-remaining-requests": "0", "x-ratelimit-limit-tokens": "2000000"})
+    # the reported limits replace the configured ones; the remaining budget caps the balance
+    assert limiter.capacity == {"requests": 600, "tokens": 1_000_000}
+    assert limiter.limits["tokens"] == 2_000_000
+    assert limiter.time_until(1) == 0.1
+
+    assert limiter.retry_after({"retry-after": "1", "retry-after-ms": "250"}) == 0.25
+    assert limiter.retry_after({"x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "1m30s"}) == 90
+    assert limiter.retry_after({}) is None
+    limiter.on_rate_limit()
+    assert limiter.capacity == {"requests": 300, "tokens": 500_000}
+    # errors of requests already in flight do not lower the budgets again
+    limiter.on_rate_limit()
+    assert limiter.capacity["requests"] == 300
+
+    clock.now = 100
+    for _ in range(60):
+        limiter.on_success()
+    assert limiter.capacity["requests"] == 600
+    assert limiter.capacity["tokens"] == 1_700_000
+
+def test_adaptive_limiter_ignores_malformed_headers():
+    limiter = AdaptiveRateLimiter(600, 1_000_000, clock=FakeClock())
+    limiter.update({"x-ratelimit-limit-requests": "600/min", "x-ratelimit-remaining-requests": "",
+                    "x-ratelimit-limit-tokens": "0", "x-ratelimit-remaining-tokens": "nan"})
+    assert limiter.limits == {"requests": 600, "tokens": 1_000_000}
+    assert limiter.time_until(1_000) == 0
+
+def test_processor_adapts_to_the_server_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run():
+        # the processor starts at 10 times the real request limit
+        async with MockOpenAIServer(latency=0, requests_per_minute=600) as server:
+            run, results_file = run_processor(tmp_path, server, 610, max_requests_per_minute=6_000, max_attempts=10)
+            start = time.perf_counter()
+            await run
+            return server, time.perf_counter() - start, results_file
+
+    server, wall, results_file = asyncio.run(run())
+    assert server.num_requests == 610
+    assert all("choices" in result[1] for result in read_jsonl(results_file))
+    # the overflow of the first burst is refused, then the processor keeps to the limit
+    # and the refused requests wait for their Retry-After
+    assert server.num_rate_limited < 50
+    assert wall < 5
@@ -0,0 +1,47 @@
+from lib.io import save_to_jsonl
+from lib.prompts import create_record
+from lib.results_store import ResultsStore
+
+def _result(sentence_id, content, model="gpt-4o"):
+    request = create_record(f"sentence {sentence_id}")
+    request["model"] = model
+    if content is None:
+        response = ["HTTP 500"]
+    else:
+        response = {"choices": [{"message": {"content": content}}], "usage": {"prompt_tokens": 10, "completion_tokens": 3}}
+    return [request, response, {"sentence_id": sentence_id}]
+
+def test_resume_and_export(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    assert store.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    store.put_many("run1", "baseline", [(_result(3, "c"), 0.5), (_result(1, "a"), 0.2), (_result(2, None), 1.0)])
+    assert sorted(store.completed("run1", "baseline")) == [1, 3]
+
+    # a failed retry never replaces a success, a successful one replaces a failure
+    store.put("run1", "baseline", _result(1, None))
+    store.put("run1", "baseline", _result(2, "b"), latency=0.3)
+    assert [r[1]["choices"][0]["message"]["content"] for r in store.iter_results("run1", "baseline")] == ["a", "b", "c"]
+    assert store.stats("run1", "baseline")["prompt_tokens"] == 30
+
+    save_to_jsonl(list(store.iter_results("run1", "baseline")), str(tmp_path / "out.jsonl"))
+    # importing keeps the existing rows, with their latency
+    assert store.import_jsonl("run1", "baseline", str(tmp_path / "out.jsonl")) == 3
+    assert store.stats("run1", "baseline")["mean_latency"] == (0.5 + 0.2 + 0.3) / 3
+
+def test_find_response(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    save_to_jsonl([_result(1, "a"), _result(2, "b")], str(tmp_path / "baseline.jsonl"))
+    store.import_jsonl("run1", "baseline", str(tmp_path / "baseline.jsonl"))
+
+    assert store.find_response("baseline", _result(2, None)[0])["choices"][0]["message"]["content"] == "b"
+    assert store.find_response("baseline", _result(5, None)[0]) is None
+    assert store.find_response("finetuned", _result(2, None)[0]) is None
+    # the max_tokens cap does not change the response key, but a truncated response is not reused
+    capped = _result(3, "c")
+    capped[0]["max_tokens"] = 4
+    capped[1]["choices"][0]["finish_reason"] = "length"
+    store.put("run1", "baseline", capped)
+    assert store.find_response("baseline", _result(3, None)[0]) is None
+    capped[1]["choices"][0]["finish_reason"] = "stop"
+    store.put("run2", "baseline", capped)
+    assert store.find_response("baseline", _result(3, None)[0])["choices"][0]["message"]["content"] == "c"
@@ -0,0 +1,74 @@
+import time
+import asyncio
+import aiohttp
+from lib import api_request_parallel_processor as processor
+from lib.io import read_jsonl
+from lib.mock_openai_server import MockOpenAIServer
+from lib.retry import RetryQueue, backoff_delay, is_retryable
+from tests.test_rate_limiter import FakeClock, run_processor
+from tests.test_token_counter import WhitespaceEncoding
+
+def test_backoff_delay_is_capped_full_jitter():
+    assert backoff_delay(0, rng=lambda: 1.0) == 1
+    assert backoff_delay(3, rng=lambda: 1.0) == 8
+    assert backoff_delay(10, rng=lambda: 1.0) == 60
+    assert backoff_delay(10, rng=lambda: 0.0) == 0
+    assert all(0 <= backoff_delay(2) <= 4 for _ in range(100))
+
+def test_errors_are_classified():
+    assert is_retryable(429, {"message": "Rate limit reached"})
+    assert is_retryable(500, {"type": "server_error"})
+    assert is_retryable(None, aiohttp.ClientConnectionError())
+    assert is_retryable(None, asyncio.TimeoutError())
+    assert not is_retryable(429, {"code": "insufficient_quota"})
+    assert not is_retryable(400, {"code": "invalid_request_error"})
+    assert not is_retryable(401, {"message": "Incorrect API key"})
+    assert not is_retryable(None, KeyError("messages"))
+
+def test_retry_queue_orders_by_due_time():
+    clock = FakeClock()
+    queue = RetryQueue(clock=clock)
+    assert queue.pop_due() is None and queue.time_until_due() is None
+    queue.push("late", 5)
+    queue.push("soon", 1)
+    queue.push("also soon", 1)
+    assert queue.time_until_due() == 1 and queue.pop_due() is None
+    clock.now = 2
+    assert [queue.pop_due(), queue.pop_due(), queue.pop_due()] == ["soon", "also soon", None]
+    assert queue.time_until_due() == 3 and len(queue) == 1
+
+def test_transient_errors_are_retried_without_stalling(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+    seen = set()
+
+    def first_attempt(body):
+        content = body["messages"][-1]["content"]
+        first = content not in seen
+        seen.add(content)
+        return first
+
+    async def run():
+        async with MockOpenAIServer(latency=0, fail_when=first_attempt) as server:
+            coroutine, results_file = run_processor(tmp_path, server, 50, max_attempts=3)
+            start = time.perf_counter()
+            await coroutine
+            return server, time.perf_counter() - start, results_file
+
+    server, wall, results_file = asyncio.run(run())
+    assert server.num_failed == 50 and server.num_requests == 100
+    assert all("choices" in result[1] for result in read_jsonl(results_file))
+    # every request waits for its own first backoff of at most a second
+    assert wall < 3
+
+def test_fatal_errors_are_not_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+
+    async def run():
+        async with MockOpenAIServer(latency=0, fail_when=lambda body: True, fail_status=400) as server:
+            coroutine, results_file = run_processor(tmp_path, server, 5, max_attempts=5)
+            await coroutine
+            return server, results_file
+
+    server, results_file = asyncio.run(run())
+    assert server.num_requests == 5
+    assert [len(result[1]) for result in read_jsonl(results_file)] == [1] * 5
@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pytest
+from errant.alignment import write_m2_file
+from errant.corpus import M2Corpus
+from errant.scorer import compute_prf, normalize_edits, normalize_gold, score_corpus, score_sentence
+
+ABCN_DEV_M2 = os.path.join(os.path.dirname(__file__), "..", "data", "m2", "ABCN.dev.gold.bea19.m2")
+
+GOLD_M2 = """S He have a lot of book .
+A 1 2|||R:VERB:SVA|||has|||REQUIRED|||-NONE-|||0
+A 5 6|||R:NOUN:NUM|||books|||REQUIRED|||-NONE-|||0
+
+S This is fine .
+A -1 -1|||noop|||-NONE-|||REQUIRED|||-NONE-|||0
+"""
+
+HYP_M2 = """S He have a lot of book .
+A 1 2|||R:OTHER|||has|||REQUIRED|||-NONE-|||0
+
+S This is fine .
+A 3 3|||M:PUNCT|||!|||REQUIRED|||-NONE-|||0
+"""
+
+def test_score_sentence_picks_best_annotator():
+    hyp = {(1, 2, 'has'): 'R:OTHER'}
+    gold = {0: {(5, 6, 'books'): 'R:NOUN:NUM'}, 1: {(1, 2, 'has'): 'R:VERB:SVA'}}
+    tp, fp, fn, annotator, outcomes = score_sentence(hyp, gold)
+    assert (tp, fp, fn, annotator) == (1, 0, 0, 1)
+    assert outcomes == [('R:VERB:SVA', 0)]
+
+def test_compute_prf_is_vectorized():
+    precision, recall, f = compute_prf(np.array([1, 0]), np.array([1, 0]), np.array([0, 0]))
+    assert precision.tolist() == [0.5, 1.0]
+    assert recall.tolist() == [1.0, 1.0]
+    assert f[0] == pytest.approx(1.25 * 0.5 / (0.25 * 0.5 + 1))
+
+def test_score_corpus(tmp_path):
+    (tmp_path / "gold.m2").write_text(GOLD_M2, encoding="utf-8")
+    (tmp_path / "hyp.m2").write_text(HYP_M2, encoding="utf-8")
+    gold = M2Corpus.build([str(tmp_path / "gold.m2")], str(tmp_path / "gold"))
+
+    scores = score_corpus(str(tmp_path / "hyp.m2"), gold, processes=1)
+    assert scores['counts'].tolist() == [[1, 0, 1], [0, 1, 0]]
+    assert (scores['tp'], scores['fp'], scores['fn']) == (1, 1, 1)
+    assert scores['precision'] == pytest.approx(0.5)
+    assert scores['recall'] == pytest.approx(0.5)
+    assert scores['by_type']['R:NOUN:NUM']['fn'] == 1
+    assert scores['by_type']['M:PUNCT']['fp'] == 1
+
+def test_edits_are_split_the_same_way_on_both_sides():
+    tokens = "I think is good .".split()
+    gold = normalize_gold(tokens, [(2, 3, 'it', 0, 'R:PRON'), (3, 4, '', 0, 'U:VERB')])
+    hyp = normalize_edits(tokens, [(2, 4, 'it')])
+    assert list(gold[0]) == list(hyp) == [(2, 4, 'it')]
+    assert gold[0][(2, 4, 'it')] == 'R:PRON'
+    tp, fp, fn, _, outcomes = score_sentence(hyp, gold)
+    assert (tp, fp, fn) == (1, 0, 0)
+
+def test_false_positives_take_the_type_of_the_gold_error():
+    tokens = "He have a book .".split()
+    gold = normalize_gold(tokens, [(1, 2, 'has', 0, 'R:VERB:SVA')])
+    hyp = normalize_edits(tokens, [(1, 2, 'had'), (4, 5, '!')])
+    _, _, _, _, outcomes = score_sentence(hyp, gold)
+    assert sorted(outcomes) == [('R:PUNCT', 1), ('R:VERB:SVA', 1), ('R:VERB:SVA', 2)]
+
+@pytest.mark.parametrize("merge", [True, False])
+def test_gold_corrections_score_perfectly(tmp_path, merge):
+    gold = M2Corpus.build([ABCN_DEV_M2], str(tmp_path / "gold"))
+    originals, corrections = zip(*gold.iter_pairs())
+    write_m2_file(str(tmp_path / "hyp.m2"), originals, corrections, processes=1)
+    scores = score_corpus(str(tmp_path / "hyp.m2"), gold, processes=1, merge=merge)
+    assert scores['tp'] > 0 and scores['fp'] == scores['fn'] == 0
+    assert scores['f'] == 1.0
+    assert all(type_scores['precision'] == 1.0 for type_scores in scores['by_type'].values())
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from errant.significance import approximate_randomization, paired_bootstrap
+
+def _counts(seed=1, n=500):
+    rng = np.random.default_rng(seed)
+    counts_a = rng.poisson([1, 0.5, 1.5], (n, 3))
+    counts_b = counts_a.copy()
+    counts_b[:, 0] += rng.binomial(1, 0.3, n)
+    return counts_a, counts_b
+
+def test_paired_bootstrap_detects_better_system():
+    counts_a, counts_b = _counts()
+    result = paired_bootstrap(counts_a, counts_b, n_resamples=1000)
+    assert result['delta'] > 0
+    assert result['ci_low'] <= result['delta'] <= result['ci_high']
+    assert result['ci_low'] > 0
+    assert result['p_value'] < 0.01
+    # the p-value is two-sided: a worse system B is as significant as a better one
+    assert paired_bootstrap(counts_b, counts_a, n_resamples=1000)['p_value'] == result['p_value']
+
+def test_identical_systems_are_not_significant():
+    counts_a, _ = _counts()
+    assert approximate_randomization(counts_a, counts_a, n_resamples=200)['p_value'] == 1.0
+    result = paired_bootstrap(counts_a, counts_a, n_resamples=200)
+    assert result['delta'] == 0 and result['ci_low'] == result['ci_high'] == 0
+    assert result['p_value'] == 1.0
+
+def test_shape_mismatch():
+    with pytest.raises(ValueError):
+        paired_bootstrap(np.zeros((3, 3)), np.zeros((4, 3)))
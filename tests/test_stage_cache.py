@@ -0,0 +1,31 @@
+from lib.stage_cache import StageCache
+
+def test_stage_reruns_only_on_change(tmp_path):
+    source = tmp_path / "input.txt"
+    output = tmp_path / "output.txt"
+    source.write_text("a", encoding="utf-8")
+    calls = []
+
+    def stage():
+        calls.append(1)
+        output.write_text(source.read_text(encoding="utf-8").upper(), encoding="utf-8")
+
+    def run(params=None):
+        cache = StageCache(str(tmp_path / "manifest.json"), str(tmp_path / "store"))
+        return cache.run("upper", stage, inputs=[str(source)], outputs=[str(output)], params=params, code=[stage.__code__.co_filename])
+
+    assert run() is True
+    assert run() is False
+    assert len(calls) == 1
+
+    # deleted outputs are restored from the store without re-running
+    output.unlink()
+    assert run() is False
+    assert output.read_text(encoding="utf-8") == "A"
+
+    # changed inputs or settings re-run the stage
+    source.write_text("b", encoding="utf-8")
+    assert run() is True
+    assert output.read_text(encoding="utf-8") == "B"
+    assert run(params={"mode": "x"}) is True
+    assert len(calls) == 3
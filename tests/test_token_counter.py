@@ -0,0 +1,87 @@
+import json
+from lib import api_request_parallel_processor as processor
+from lib.prompts import create_record, render_request
+from lib.token_counter import count_file_tokens, load_token_counts, token_counts_file
+
+class WhitespaceEncoding:
+    """Stand-in for a tiktoken encoding: one token per whitespace-separated word"""
+    def encode(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [self.encode(text) for text in texts]
+
+def test_counts_match_send_time_counting(tmp_path, monkeypatch):
+    record = create_record("He have a book .")
+    record["metadata"] = {"sentence_id": 1, "original": "He have a book .", "corrected": "He has a book ."}
+    chat = {"messages": [{"role": "system", "content": "Be brief"}, {"role": "user", "content": "Fix : a b", "name": "x"}]}
+    input_file = tmp_path / "test.jsonl"
+    input_file.write_text(json.dumps(record) + "\n" + json.dumps(chat) + "\n", encoding="utf-8")
+
+    counts = count_file_tokens(str(input_file), encoding=WhitespaceEncoding(), batch_size=1)
+    assert counts["answer_tokens"] == [len('{"corrected": "He has a book ."}'.split()), 0]
+
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+    for request, prompt_tokens in zip([record, chat], counts["prompt_tokens"]):
+        request = render_request({k: v for k, v in request.items() if k != "metadata"})
+        expected = processor.num_tokens_consumed_from_request(request, "chat/completions", "cl100k_base")
+        assert prompt_tokens + processor.num_completion_tokens(request) == expected
+
+def test_stale_counts_are_ignored(tmp_path):
+    input_file = tmp_path / "train.jsonl"
+    input_file.write_text(json.dumps(create_record("a", "b")) + "\n", encoding="utf-8")
+    count_file_tokens(str(input_file), encoding=WhitespaceEncoding())
+    assert token_counts_file(str(input_file)) == str(tmp_path / "train_tokens.json")
+    assert load_token_counts(str(input_file)) is not None
+    assert load_token_counts(str(input_file), "o200k_base") is None
+
+    input_file.write_text(json.dumps(create_record("a b", "b")) + "\n", encoding="utf-8")
+    assert load_token_counts(str(input_file)) is None
+
+def test_completion_estimator_from_results(tmp_path):
+    from lib.io import save_to_jsonl
+    from lib.token_counter import CompletionLengthEstimator
+    from lib.api_request_parallel_processor import num_tokens_estimated_from_request
+    # completions of about half the prompt beyond a 100-token template, one runaway generation
+    results = [[{}, {"usage": {"prompt_tokens": 100 + 2 * n, "completion_tokens": 10 + n}}, {"sentence_id": n}] for n in range(50)]
+    results.append([{}, {"error": "x"}, {"sentence_id": 50}])
+    results.append([{}, {"usage": {"prompt_tokens": 120, "completion_tokens": 4000}}, {"sentence_id": 51}])
+    result_file = str(tmp_path / "result.jsonl")
+    save_to_jsonl(results, result_file)
+
+    estimator = CompletionLengthEstimator.from_result_files([result_file], quantile=0.9)
+    assert estimator.estimate(100) < estimator.estimate(200)
+    assert 15 <= estimator.estimate(120) <= 120
+    assert estimator.estimate(120) < estimator.max_tokens(120) < 1000
+
+    request = {"messages": []}
+    assert num_tokens_estimated_from_request(request, 120, estimator) == 120 + estimator.estimate(120)
+    assert request["max_tokens"] == estimator.max_tokens(120)
+    # an explicit max_tokens is kept and bounds the budget
+    assert num_tokens_estimated_from_request({"max_tokens": 5, "n": 2}, 120, estimator) == 130
+
+    assert CompletionLengthEstimator.from_result_files([result_file], min_samples=100) is None
+
+def test_responses_cut_short_by_the_cap_are_sent_again_uncapped(tmp_path, monkeypatch):
+    import asyncio
+    from lib.io import read_jsonl
+    from lib.mock_openai_server import MockOpenAIServer
+    from lib.token_counter import CompletionLengthEstimator
+    from tests.test_rate_limiter import run_processor
+    monkeypatch.setattr(processor.tiktoken, "get_encoding", lambda name: WhitespaceEncoding())
+    # caps every completion at 4 tokens, while the server answers with 8
+    estimator = CompletionLengthEstimator(slope=0.0, intercept=2.0, residual=0.0, headroom=1.0, min_max_tokens=4)
+
+    async def run():
+        async with MockOpenAIServer(latency=0, completion_tokens=8) as server:
+            coroutine, results_file = run_processor(tmp_path, server, 10, completion_estimator=estimator)
+            count_file_tokens(str(tmp_path / "requests.jsonl"), encoding=WhitespaceEncoding())
+            await coroutine
+            return server, results_file
+
+    server, results_file = asyncio.run(run())
+    assert server.num_requests == 20
+    results = read_jsonl(results_file)
+    assert len(results) == 10
+    assert all(result[1]["choices"][0]["finish_reason"] == "stop" for result in results)
+    assert all("max_tokens" not in result[0] for result in results)